@@ -0,0 +1,439 @@
+# ai_assistant.py
+# Integração com o Gemini: instrução de sistema, pool de modelos e marcadores nas respostas
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from caching import LRUCache
+from config import AI_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+AI_MODEL_NAME = 'gemini-2.0-flash'
+ALLOWED_PARAM_KEYS = ("spreading_factor", "tx_power_dbm", "signal_bandwidth_khz", "coding_rate", "preamble_length", "sync_word")
+REQUIRED_ARTIFACT_KEYS = ("title", "type", "language", "filename", "content")
+
+
+# Instrução de sistema do assistente (montada uma vez, partilhada por todos os modelos do pool)
+SYSTEM_INSTRUCTION = (
+    "You are an expert assistant focused *only* on LoRa technology, LoRaWAN, and related hardware/software "
+    "specifically for smart home, DIY, and hobbyist applications. Do not answer questions outside this scope. "
+    "Provide clear, practical advice suitable for beginners and intermediate users.\n"
+    "## Floor Plan Analysis (If Provided):\n"
+    "The user might provide floor plan data in the 'user_inputs.floorplan' part of the initial context. It has this structure:\n"
+    "{ 'rows': R, 'cols': C, 'grid_rows': ['..b.G', ...], 'gateway': {'row': r, 'col': c} or null, 'sensors': [{'row': r, 'col': c}, ...] }\n"
+    "Where 'grid_rows' has one string per row (R strings of C characters, row 0 first, column 0 leftmost) and each character is a cell: "
+    "'.' empty, 'd' drywall, 'b' brick, 'c' concrete, 'G' gateway, 'S' sensor.\n"
+    "The initial context may also include 'floorplan_analysis.sensors': the link of each sensor computed by the server "
+    "(serving gateway number, distance_m, wall_loss_db, path_loss_db and margin_db at the configured SF). "
+    "Use these numbers instead of estimating wall losses from the grid yourself.\n"
+    "**If floor plan data is present and relevant to the question:**\n"
+    "- Use it to give specific advice on gateway/sensor placement (e.g., 'Move gateway near (row, col) to improve signal to sensor at (row, col)').\n"
+    "- Identify potential signal dead spots caused by walls (especially 'concrete' or multiple 'brick').\n"
+    "- Suggest adding repeaters (more gateways/nodes) if coverage seems challenging based on the plan.\n"
+    "- Relate parameter choices (like SF) to the specific layout challenges.\n"
+    "**Emoji Grid Representation:**\n"
+    "When your response **directly discusses specific device placements (gateway, sensors), analyzes signal paths based on walls, or suggests moving devices according to the provided floor plan grid**, "
+    "write the marker `<<<FLOORPLAN_GRID>>>` on its own line where the floor plan should be shown. "
+    "The server replaces it with an emoji picture of the user's grid (⚪️ empty, 🟫 drywall, 🧱 brick, ⬛️ concrete, 📡 gateway, 🟩 sensor). "
+    "**Never draw the grid yourself**, and only use the marker when your explanation actively refers to the spatial layout or positions in the floor plan.\n\n"
+    "## Confidence Level Check:\n"
+    "## Confidence Level Check:\n"
+    "If your explanation involves practical skills (like soldering, wiring, complex software configuration, flashing firmware) "
+    "where user experience matters significantly, **ask the user about their confidence level first**. "
+    "Phrase your question clearly and include a marker EXACTLY like this: `<<<ASK_CONFIDENCE: [Brief Topic e.g., Soldering/Wiring/Linux Config]>>>` "
+    "Example: 'This involves soldering. <<<ASK_CONFIDENCE: Soldering>>> How confident are you with soldering?' "
+    "**Stop your response there.** Wait for the user's next message, which will start with 'My confidence with [Topic] is: [Level e.g., Beginner/Confident]'. "
+    "Then, tailor the *detail level* of your *next* response accordingly (more detail for Beginner, standard for Confident). "
+    "Do NOT ask about confidence for simple explanations or parameter choices.\n"
+    "## Parameter Updates:\n"
+    "If parameters should change, include: ```json\n<<<UPDATE_PARAMS>>>{\"param\": value}<<<END_UPDATE>>>\n``` Explain why.\n"
+    "## Code Generation/Explanation:\n"
+    "Explain code clearly. Provide complete, well-commented code snippets with links if possible.\n"
+    "## Adding New Artifacts:\n"
+    "If adding a new code example/instructions, include: ```json\n<<<ADD_ARTIFACT>>>{\"title\": \"...\", \"type\": \"...\", ...}<<<END_ADD>>>\n``` Explain it."
+)
+
+
+# Um cliente/modelo por chave de API (indexado pelo hash da chave), reutilizado entre pedidos
+_model_pool = LRUCache(maxsize=AI_SETTINGS["model_pool_size"], ttl_s=AI_SETTINGS["model_pool_ttl_s"])
+
+def _hash_api_key(api_key):
+    """SHA-256 of an API key: pool key and (shortened) log id, so the raw key is never logged."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+# O SDK do Gemini demora quase 1 s a importar: só é carregado no primeiro pedido ao assistente
+_genai = None
+_genai_lock = threading.Lock()
+
+def _load_genai():
+    """Imports the Gemini SDK on first use. Returns (genai, glm), glm being its generativelanguage API client package."""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            from google.ai import generativelanguage as glm
+            _genai = (genai, glm)
+            logger.info("Loaded the Gemini SDK.")
+        return _genai
+
+
+def get_model(api_key):
+    """
+    GenerativeModel bound to its own client for api_key, taken from the pool or created.
+
+    The client is the SDK's GenerativeServiceClient with the key in its client_options, not
+    the global genai.configure, so concurrent users with different keys can't mix them up.
+    An SDK whose models don't take a client (see requirements.txt for the tested versions)
+    falls back to genai.configure, one key at a time.
+    """
+    key_hash = _hash_api_key(api_key)
+    model = _model_pool.get(key_hash)
+    genai, glm = _load_genai()
+    if model is None:
+        model = genai.GenerativeModel(AI_MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION)
+        if '_client' in vars(model):
+            model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        else:
+            logger.warning("This google-generativeai version has no per-model client: using the global genai.configure.")
+        _model_pool.put(key_hash, model)
+        logger.info(f"Created Gemini client for key {key_hash[:8]}... ({len(_model_pool)} in pool).")
+    if '_client' not in vars(model):
+        with _genai_lock:
+            genai.configure(api_key=api_key)
+    return model
+
+
+def ai_model_pool_stats():
+    """Counters of the per-key model pool (entries are key hashes, never shown)."""
+    return _model_pool.stats()
+
+
+def start_chat(api_key, chat_history):
+    """Replays chat_history[:-1] on the pooled model for api_key. Returns (chat, last_user_message)."""
+    model = get_model(api_key)
+    logger.debug(f"Starting chat with history (length {len(chat_history)})")
+    chat = model.start_chat(history=chat_history[:-1])
+    return chat, chat_history[-1]['parts'][0]['text']
+
+
+class MarkerStreamParser:
+    """
+    Incremental parser for the reply markers (<<<ASK_CONFIDENCE: topic>>>,
+    <<<UPDATE_PARAMS>>>json<<<END_UPDATE>>>, <<<ADD_ARTIFACT>>>json<<<END_ADD>>>, <<<FLOORPLAN_GRID>>>).
+
+    feed() takes chunks as they arrive and returns ('text', str) events for the text that can
+    already be shown, plus ('confidence' | 'update_params' | 'add_artifact' | 'floorplan_grid',
+    content) events for complete markers. Anything that might still become a marker (a trailing '<', '<<<UPD', an
+    open marker waiting for its end tag) is held back, so markers split across chunks are
+    never shown. finish() flushes what's left (an unterminated marker is returned as text).
+    """
+
+    _MARKERS = (
+        ('<<<ASK_CONFIDENCE:', 'confidence', '>>>'),
+        ('<<<UPDATE_PARAMS>>>', 'update_params', '<<<END_UPDATE>>>'),
+        ('<<<ADD_ARTIFACT>>>', 'add_artifact', '<<<END_ADD>>>'),
+        ('<<<FLOORPLAN_GRID>>>', 'floorplan_grid', None), # Sem fim: é substituído pela grelha desenhada no servidor
+    )
+    MAX_MARKER_CHARS = 200_000 # Marcador sem fim depois disto passa a ser texto normal
+
+    def __init__(self):
+        self._buffer = ''
+        self._open = None # (tipo, texto do início, regex do fim) do marcador em curso
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        events = []
+        while self._buffer:
+            if self._open is None:
+                start = self._buffer.find('<<<')
+                if start == -1:
+                    # Um '<' ou '<<' no fim ainda pode ser o início de um marcador
+                    held = min(len(self._buffer) - len(self._buffer.rstrip('<')), 2)
+                    self._emit_text(events, self._buffer[:len(self._buffer) - held])
+                    self._buffer = self._buffer[len(self._buffer) - held:]
+                    break
+                self._emit_text(events, self._buffer[:start])
+                self._buffer = self._buffer[start:]
+                for opener, kind, closer in self._MARKERS:
+                    if re.match(re.escape(opener), self._buffer, re.IGNORECASE):
+                        if closer is None:
+                            events.append((kind, ''))
+                        else:
+                            self._open = (kind, self._buffer[:len(opener)], re.compile(re.escape(closer), re.IGNORECASE))
+                        self._buffer = self._buffer[len(opener):]
+                        break
+                else:
+                    if any(len(self._buffer) < len(opener) and re.match(re.escape(self._buffer), opener, re.IGNORECASE) for opener, _, _ in self._MARKERS):
+                        break # Início de marcador incompleto: esperar pelo resto
+                    self._emit_text(events, self._buffer[0]) # '<<<' que não é marcador
+                    self._buffer = self._buffer[1:]
+            else:
+                kind, opener_text, closer = self._open
+                end = closer.search(self._buffer)
+                if end is None:
+                    if len(self._buffer) > self.MAX_MARKER_CHARS:
+                        self._emit_text(events, opener_text + self._buffer)
+                        self._buffer, self._open = '', None
+                    break
+                events.append((kind, self._buffer[:end.start()]))
+                self._buffer, self._open = self._buffer[end.end():], None
+        return events
+
+    def finish(self):
+        text = (self._open[1] if self._open else '') + self._buffer
+        self._buffer, self._open = '', None
+        return [('text', text)] if text else []
+
+    @staticmethod
+    def _emit_text(events, text):
+        if text:
+            events.append(('text', text))
+
+
+def _marker_json(content):
+    """JSON payload of an UPDATE_PARAMS/ADD_ARTIFACT marker (the model sometimes wraps it in ```json fences)."""
+    json_str = re.sub(r'^```json\s*|\s*```$', '', content.strip(), flags=re.MULTILINE)
+    return json.loads(json_str)
+
+
+def parse_param_update(content):
+    """Allowed parameter changes from an UPDATE_PARAMS marker, or None if invalid/empty."""
+    logger.info(f"Found potential parameter update JSON: {content.strip()}")
+    try:
+        parsed_update = _marker_json(content)
+    except json.JSONDecodeError as json_err:
+        logger.error(f"Failed to decode param JSON: {json_err}")
+        return None
+    if not isinstance(parsed_update, dict):
+        logger.warning("Parsed param JSON not a dict.")
+        return None
+    valid_update = {}
+    for key, value in parsed_update.items():
+        if key in ALLOWED_PARAM_KEYS: valid_update[key] = value
+        else: logger.warning(f"Ignoring unknown parameter key: {key}")
+    if not valid_update:
+        logger.warning("Parsed JSON for param update empty/invalid.")
+        return None
+    logger.info(f"Parsed valid parameter updates: {valid_update}")
+    return valid_update
+
+
+def parse_new_artifact(content):
+    """New artifact from an ADD_ARTIFACT marker, or None if invalid."""
+    logger.info(f"Found potential new artifact JSON: {content.strip()}")
+    try:
+        parsed_artifact = _marker_json(content)
+    except json.JSONDecodeError as json_err:
+        logger.error(f"Failed to decode new artifact JSON: {json_err}")
+        return None
+    if not isinstance(parsed_artifact, dict) or not all(key in parsed_artifact for key in REQUIRED_ARTIFACT_KEYS):
+        logger.warning("Parsed JSON for new artifact missing keys or not a dict.")
+        return None
+    logger.info(f"Parsed valid new artifact: {parsed_artifact.get('title')}")
+    return parsed_artifact
+
+
+class ReplyBuilder:
+    """
+    Collects parser events into the /ask_ai payload (answer text, confidence flag, updates, new artifact).
+    <<<FLOORPLAN_GRID>>> markers are replaced by floorplan_grid (the server-drawn emoji grid), or dropped without one.
+    """
+
+    def __init__(self, floorplan_grid=None):
+        self.floorplan_grid = floorplan_grid
+        self.text_parts = []
+        self.markers = {} # Só o primeiro de cada tipo conta
+
+    def add(self, kind, content):
+        """Records a parser event; returns the text it adds to the answer ('' for markers)."""
+        if kind == 'floorplan_grid':
+            kind, content = 'text', f"\n{self.floorplan_grid}\n" if self.floorplan_grid else ''
+        if kind == 'text':
+            self.text_parts.append(content)
+            return content
+        self.markers.setdefault(kind, content)
+        return ''
+
+    def payload(self):
+        """Final payload; 'notes' is the text appended to the answer (already part of 'answer')."""
+        answer = ''.join(self.text_parts).strip()
+        notes = ''
+        payload = {}
+        if 'confidence' in self.markers:
+            # A resposta para aqui: atualizações só depois de o utilizador indicar o nível
+            payload["requires_confidence_input"] = True
+            payload["confidence_topic"] = self.markers['confidence'].strip()
+            logger.info(f"AI is asking for confidence level on topic: {payload['confidence_topic']}")
+        else:
+            updated_parameters = parse_param_update(self.markers['update_params']) if 'update_params' in self.markers else None
+            if updated_parameters:
+                payload["updated_parameters"] = updated_parameters
+                notes += "\n\n*(Note: Parameters updated based on discussion.)*"
+            new_artifact = parse_new_artifact(self.markers['add_artifact']) if 'add_artifact' in self.markers else None
+            if new_artifact:
+                payload["new_artifact"] = new_artifact
+                notes += f"\n\n*(Note: Added new artifact '{new_artifact.get('title')}'.)*"
+        return {"answer": answer + notes, **payload}, notes
+
+
+def process_ai_response(raw_text, floorplan_grid=None):
+    """Parses a complete reply: removes the markers (inserting floorplan_grid where asked) and returns the /ask_ai payload."""
+    parser, builder = MarkerStreamParser(), ReplyBuilder(floorplan_grid)
+    for kind, content in parser.feed(raw_text) + parser.finish():
+        builder.add(kind, content)
+    return builder.payload()[0]
+
+
+class AIBusyError(Exception):
+    """Every AI request slot is in use; the caller should retry later."""
+
+
+# Chamadas ao Gemini correm num pool próprio e limitado, para não ocupar os workers que servem /generate_config
+_ai_executor = None
+_ai_executor_lock = threading.Lock()
+_ai_slots = threading.BoundedSemaphore(AI_SETTINGS["max_concurrent_requests"])
+
+def _get_ai_executor():
+    """Returns the thread pool that runs the Gemini calls (created on first use)."""
+    global _ai_executor
+    with _ai_executor_lock:
+        if _ai_executor is None:
+            _ai_executor = ThreadPoolExecutor(max_workers=AI_SETTINGS["max_concurrent_requests"], thread_name_prefix='gemini')
+            logger.info(f"Started AI thread pool with {AI_SETTINGS['max_concurrent_requests']} workers.")
+        return _ai_executor
+
+def _submit_ai_call(fn, *args):
+    """Runs fn(*args) on the AI pool if a slot is free (AIBusyError otherwise); the slot is freed when fn returns."""
+    if not _ai_slots.acquire(blocking=False):
+        raise AIBusyError(f"The AI assistant is busy ({AI_SETTINGS['max_concurrent_requests']} requests in progress). Please try again shortly.")
+    def run():
+        try:
+            return fn(*args)
+        finally:
+            _ai_slots.release()
+    try:
+        return _get_ai_executor().submit(run)
+    except Exception:
+        _ai_slots.release()
+        raise
+
+
+def _ask_ai_blocking(api_key, chat_history, floorplan_grid, timeout_s):
+    try:
+        chat, last_user_message = start_chat(api_key, chat_history)
+        logger.debug(f"Sending last message to Gemini: {last_user_message[:200]}...")
+        response = chat.send_message(last_user_message, request_options={"timeout": timeout_s})
+        logger.debug("Received response from Gemini.")
+        if response.parts:
+            return process_ai_response(response.text, floorplan_grid), 200
+        if response.prompt_feedback.block_reason:
+            logger.warning(f"Gemini request blocked: {response.prompt_feedback.block_reason}")
+            return {"answer": f"Request blocked due to: {response.prompt_feedback.block_reason}."}, 400
+        logger.warning("Gemini response missing text parts.")
+        return {"answer": "The AI model did not provide a text response."}, 500
+    except Exception as e:
+        logger.error(f"Error calling Gemini API: {e}", exc_info=True)
+        return {"answer": f"Error communicating with the AI service: {e}. Check API key/quota."}, 401 if "API key not valid" in str(e) else 500
+
+
+def ask_ai_reply(api_key, chat_history, floorplan_grid=None, timeout_s=AI_SETTINGS["request_timeout_s"]):
+    """
+    Sends the last message of chat_history and waits (at most timeout_s) for the full reply.
+    floorplan_grid replaces the <<<FLOORPLAN_GRID>>> markers. Returns (payload, status_code);
+    raises AIBusyError when no AI slot is free.
+    """
+    future = _submit_ai_call(_ask_ai_blocking, api_key, chat_history, floorplan_grid, timeout_s)
+    try:
+        return future.result(timeout=timeout_s)
+    except FuturesTimeoutError:
+        logger.warning(f"Gemini did not answer within {timeout_s} s.")
+        return {"answer": f"The AI service did not answer within {timeout_s:g} s. Please try again."}, 504
+
+
+def _stream_reply_events(api_key, chat_history, floorplan_grid, timeout_s, cancelled):
+    """Yields the stream_ai_reply events; stops reading the model stream once cancelled is set."""
+    try:
+        chat, last_user_message = start_chat(api_key, chat_history)
+        response = chat.send_message(last_user_message, stream=True, request_options={"timeout": timeout_s})
+        parser, builder = MarkerStreamParser(), ReplyBuilder(floorplan_grid)
+        for chunk in response:
+            if cancelled.is_set():
+                logger.info("AI reply stream cancelled (client disconnected or timed out).")
+                return
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                continue # Pedaço sem texto (ex: só metadados)
+            for kind, content in parser.feed(chunk_text):
+                text = builder.add(kind, content)
+                if text:
+                    yield 'token', {"text": text}
+        for kind, content in parser.finish():
+            text = builder.add(kind, content)
+            if text:
+                yield 'token', {"text": text}
+    except Exception as e:
+        logger.error(f"Error calling Gemini API: {e}", exc_info=True)
+        yield 'error', {"error": f"Error communicating with the AI service: {e}. Check API key/quota.", "status": 401 if "API key not valid" in str(e) else 500}
+        return
+
+    if not builder.text_parts and not builder.markers:
+        block_reason = getattr(getattr(response, 'prompt_feedback', None), 'block_reason', None)
+        if block_reason:
+            logger.warning(f"Gemini request blocked: {block_reason}")
+            yield 'error', {"error": f"Request blocked due to: {block_reason}.", "status": 400}
+        else:
+            logger.warning("Gemini response missing text parts.")
+            yield 'error', {"error": "The AI model did not provide a text response.", "status": 500}
+        return
+    payload, notes = builder.payload()
+    if notes:
+        yield 'token', {"text": notes}
+    yield 'done', payload
+
+
+def _stream_reply_to_queue(api_key, chat_history, floorplan_grid, timeout_s, events, cancelled):
+    try:
+        for event in _stream_reply_events(api_key, chat_history, floorplan_grid, timeout_s, cancelled):
+            events.put(event)
+    finally:
+        events.put(None) # Fim
+
+
+def _consume_reply_events(events, cancelled, timeout_s):
+    deadline = time.monotonic() + timeout_s
+    try:
+        while True:
+            try:
+                event = events.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                logger.warning(f"AI reply stream exceeded {timeout_s} s.")
+                yield 'error', {"error": f"The AI service did not finish within {timeout_s:g} s. Please try again.", "status": 504}
+                return
+            if event is None:
+                return
+            yield event
+    finally:
+        cancelled.set() # Cliente desligou (generator fechado) ou timeout: a thread do pool deixa de ler o stream
+
+
+def stream_ai_reply(api_key, chat_history, floorplan_grid=None, timeout_s=AI_SETTINGS["request_timeout_s"]):
+    """
+    Sends the last message of chat_history and returns a generator of (event, data) as the reply
+    streams in: ('token', {'text'}) for displayable text (markers already removed), then a final
+    ('done', payload) with the same fields as /ask_ai, or ('error', {'error', 'status'}).
+    floorplan_grid replaces the <<<FLOORPLAN_GRID>>> markers, as in ask_ai_reply.
+
+    The model is read on the AI pool; raises AIBusyError up front when no slot is free. Closing
+    the generator (client disconnected) or passing timeout_s stops reading the model stream.
+    """
+    events, cancelled = queue.Queue(), threading.Event()
+    _submit_ai_call(_stream_reply_to_queue, api_key, chat_history, floorplan_grid, timeout_s, events, cancelled)
+    return _consume_reply_events(events, cancelled, timeout_s)
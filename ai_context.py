@@ -0,0 +1,145 @@
+# ai_context.py
+# Contexto inicial das conversas com o assistente: lido uma vez e guardado pelo hash do conteúdo, com dados derivados da planta
+import hashlib
+import json
+import logging
+import re
+import numpy as np
+from caching import LRUCache, canonical_hash
+from config import AI_SETTINGS
+from lora_logic import (CELL_TYPES, SPREADING_FACTORS, encode_grid, get_gateway_positions, parse_floorplan_data, _has_grid, _get_link_settings,
+                        _compute_link_budget)
+
+logger = logging.getLogger(__name__)
+
+# Formato antigo: o contexto vinha dentro da 1ª mensagem ("Initial Context: {...} \n First Question: ...")
+_INITIAL_CONTEXT_RE = re.compile(r'^\s*Initial Context:\s*(\{.*?\})\s*\n\s*First Question:\s*(.*)$', re.DOTALL)
+
+_contexts = LRUCache(maxsize=AI_SETTINGS["context_cache_size"], ttl_s=AI_SETTINGS["context_cache_ttl_s"])
+_message_contexts = LRUCache(maxsize=AI_SETTINGS["context_cache_size"], ttl_s=AI_SETTINGS["context_cache_ttl_s"]) # hash da 1ª mensagem -> (AIContext, pergunta)
+
+
+# Símbolos por tipo de célula (mesma ordem que CELL_TYPES): letras compactas para o modelo, emoji para mostrar ao utilizador
+GRID_LETTERS = {'empty': '.', 'drywall': 'd', 'brick': 'b', 'concrete': 'c', 'gateway': 'G', 'sensor': 'S'}
+GRID_EMOJI = {'empty': '⚪️', 'drywall': '🟫', 'brick': '🧱', 'concrete': '⬛️', 'gateway': '📡', 'sensor': '🟩'}
+
+
+def grid_rows(grid_codes, symbols):
+    """One string per grid row, each cell drawn with symbols[cell type]."""
+    lookup = np.array([symbols[cell_type] for cell_type in CELL_TYPES], dtype=object)
+    return [''.join(row) for row in lookup[grid_codes]]
+
+
+class AIContext:
+    """
+    Initial context of an AI chat ({'context', 'data', 'user_inputs'} from the Pro page), parsed once.
+
+    Shared by every chat (and turn) started from the same content. The floor plan is parsed and
+    analysed up front: the model gets a compact version (grid as one letter per cell plus the
+    server-computed path loss and margin of each sensor) instead of the raw grid, and the emoji
+    grid it can ask for with <<<FLOORPLAN_GRID>>> is drawn here rather than by the model.
+    """
+
+    def __init__(self, context, context_id):
+        self.context_id = context_id
+        self.topic = context.get('context')
+        self.user_inputs = context.get('user_inputs') if isinstance(context.get('user_inputs'), dict) else {}
+        floorplan_raw = self.user_inputs.get('floorplan') or (context.get('data') if self.topic == 'floorplan' else None)
+        self.floorplan, errors = parse_floorplan_data(floorplan_raw)
+        if errors or not isinstance(self.floorplan, dict):
+            self.floorplan = {}
+        grid = self.floorplan.get('grid')
+        self.grid_codes = encode_grid(grid) if _has_grid(grid) else None
+        self.link_margins = self._compute_link_margins()
+        self.prompt_json = json.dumps(self._prompt_context(context), ensure_ascii=False) # Serializado uma vez para todas as mensagens
+        self._emoji_grid = None
+
+    def first_message(self, question):
+        """Text of the first user message sent to the model (context + question, in the format the system instruction expects)."""
+        return f"Initial Context: {self.prompt_json} \n First Question: {question}"
+
+    def emoji_grid(self):
+        """The floor plan as an emoji grid in a Markdown code block (None without a floor plan)."""
+        if self.grid_codes is None:
+            return None
+        if self._emoji_grid is None:
+            self._emoji_grid = "```\n" + "\n".join(grid_rows(self.grid_codes, GRID_EMOJI)) + "\n```"
+        return self._emoji_grid
+
+    def _prompt_context(self, context):
+        """Copy of the context for the model, with the floor plan grid in compact form and the link analysis added."""
+        if self.grid_codes is None:
+            return context
+        compact_floorplan = {key: value for key, value in self.floorplan.items() if key != 'grid'}
+        compact_floorplan['grid_rows'] = grid_rows(self.grid_codes, GRID_LETTERS)
+        prompt_context = dict(context)
+        if self.user_inputs.get('floorplan'):
+            prompt_context['user_inputs'] = {**self.user_inputs, 'floorplan': compact_floorplan}
+        if self.topic == 'floorplan' and context.get('data'):
+            prompt_context['data'] = compact_floorplan
+        if self.link_margins:
+            prompt_context['floorplan_analysis'] = {"sensors": self.link_margins}
+        return prompt_context
+
+    def _compute_link_margins(self):
+        """
+        Per-sensor link data for the floor plan at the configured SF and TX power
+        ([] without a floor plan, gateway or sensors).
+        """
+        sensors = self.floorplan.get('sensors') or []
+        gateways = get_gateway_positions(self.floorplan)
+        if self.grid_codes is None or not sensors or not gateways:
+            return []
+        settings, _ = _get_link_settings(self.user_inputs)
+        parameters = self.user_inputs.get('parameters') or {}
+        spreading_factor = parameters.get('spreading_factor')
+        sf_idx = SPREADING_FACTORS.index(spreading_factor) if spreading_factor in SPREADING_FACTORS else len(SPREADING_FACTORS) - 1
+        tx_power_dbm = parameters.get('tx_power_dbm', settings["tx_power_dbm"])
+        budget = _compute_link_budget(self.grid_codes, gateways, sensors, settings["floors"], settings["frequency_mhz"],
+                                      settings["bw_khz"], tx_power_dbm, settings["antenna_gain_dbi"])
+        return [{
+            "sensor": {"row": int(sensor['row']), "col": int(sensor['col'])},
+            "gateway": int(budget["gateway_index"][i]) + 1,
+            "distance_m": round(float(budget["distance_m"][i]), 1),
+            "wall_loss_db": round(float(budget["wall_loss_db"][i]), 1),
+            "path_loss_db": round(float(budget["path_loss_db"][i]), 1),
+            "margin_db": round(float(budget["margin_db"][sf_idx, i]), 1),
+        } for i, sensor in enumerate(sensors)]
+
+
+def get_ai_context(context):
+    """AIContext for a structured context dict, from the cache (by content hash) or parsed now."""
+    context_id = canonical_hash(context)
+    ai_context = _contexts.get(context_id)
+    if ai_context is None:
+        ai_context = AIContext(context, context_id)
+        _contexts.put(context_id, ai_context)
+        logger.info(f"Parsed AI context {context_id[:8]}... (topic: {ai_context.topic}, floor plan: {'yes' if ai_context.floorplan else 'no'}).")
+    return ai_context
+
+
+def split_initial_context(chat_history):
+    """
+    For histories in the old format (context embedded in the first message), returns
+    (AIContext, chat_history with that message reduced to the question); otherwise (None, chat_history).
+    """
+    first = chat_history[0]
+    text = ''.join(part.get('text', '') for part in first.get('parts', [])) if first.get('role') == 'user' else ''
+    # O texto inteiro identifica o contexto, assim o JSON só é lido na primeira vez
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    cached = _message_contexts.get(text_hash)
+    if cached is None:
+        match = _INITIAL_CONTEXT_RE.match(text)
+        if not match:
+            return None, chat_history
+        try:
+            context = json.loads(match.group(1))
+        except json.JSONDecodeError as parse_err:
+            logger.warning(f"Could not parse the initial AI context: {parse_err}")
+            return None, chat_history
+        if not isinstance(context, dict):
+            return None, chat_history
+        cached = (get_ai_context(context), match.group(2))
+        _message_contexts.put(text_hash, cached)
+    ai_context, question = cached
+    return ai_context, [{'role': 'user', 'parts': [{'text': question}]}] + chat_history[1:]
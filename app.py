@@ -1,262 +1,326 @@
 # app.py
 import json
-from flask import Flask, render_template, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, render_template, request, jsonify
 import os
 import logging
-import google.generativeai as genai
-import re
 
-from config import REGION_FREQUENCIES
-from lora_logic import generate_recommendations
-
-basedir = os.path.abspath(os.path.dirname(__file__))
-template_dir = os.path.join(basedir, 'frontend')
-app = Flask(__name__, template_folder=template_dir)
+from config import REGION_FREQUENCIES, AI_SETTINGS
+from caching import canonical_hash
+from lora_logic import generate_recommendations_cached, recommendation_cache_key, recommendation_cache, get_response_options, is_default_response, shape_recommendations, get_recommendation_part, generate_recommendations_batch, generate_coverage_map, optimize_gateway_placement, plan_gateways, MAX_BATCH_SITES
+from network_sim import simulate_site
+from artifact_store import artifact_store
+from codegen import render_cache_stats
+from firmware_bundle import stream_firmware_bundle, bundle_name
+from floorplan_sessions import create_session, apply_session_edits, RevisionConflict
+from chat_sessions import create_chat_session, get_chat_session
+from ai_context import get_ai_context, split_initial_context
+from ai_assistant import ask_ai_reply, stream_ai_reply, ai_model_pool_stats, AIBusyError
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 template_dir = os.path.join(basedir, 'frontend')
 static_dir = os.path.join(basedir, 'static') # Define o caminho para a pasta static
 
-# Adiciona static_folder='static' e static_url_path='/static' (opcional, mas explícito)
-app = Flask(__name__,
-            template_folder=template_dir,
-            static_folder=static_dir, # Informa o Flask onde estão os ficheiros estáticos
-            static_url_path='/static') # URL base para aceder aos ficheiros estáticos
-
-logging.basicConfig(level=logging.INFO)
-app.logger.setLevel(logging.INFO)
-app.config['LOGGER_HANDLER_POLICY'] = 'always'
-
-
-logging.basicConfig(level=logging.INFO)
-app.logger.setLevel(logging.INFO)
-app.config['LOGGER_HANDLER_POLICY'] = 'always'
+# Rotas num blueprint: a app é criada uma única vez por create_app()
+routes = Blueprint('routes', __name__)
 
 # --- Routes ---
-@app.route('/')
+@routes.route('/')
 def index():
-    app.logger.info("Serving index page.")
+    current_app.logger.info("Serving index page.")
     return render_template('index.html', regions=REGION_FREQUENCIES.keys())
 
-@app.route('/pro')
+@routes.route('/pro')
 def pro_index():
-    app.logger.info("Serving Pro index page.")
+    current_app.logger.info("Serving Pro index page.")
     return render_template('pro_index.html', regions=REGION_FREQUENCIES.keys())
 
-@app.route('/generate_config', methods=['POST'])
+@routes.route('/generate_config', methods=['POST'])
 def generate_config_route():
-    # Unchanged from previous version
-    app.logger.info("Received request for /generate_config")
+    current_app.logger.info("Received request for /generate_config")
     try:
         user_data = request.get_json()
         if not user_data: return jsonify({"error": "No data received"}), 400
         log_data = user_data.copy(); log_data.pop('api_key', None)
-        app.logger.debug(f"Processing request data (key omitted): {log_data}")
-        recommendations, errors = generate_recommendations(user_data)
+        current_app.logger.debug(f"Processing request data (key omitted): {log_data}")
+        options, option_errors = get_response_options(user_data)
+        if option_errors: return jsonify({"error": "; ".join(option_errors)}), 400
+        # O resultado só depende das entradas do pedido: o seu hash (sem parsing) serve de ETag (304 sem recalcular) e de id para as partes omitidas
+        result_id = recommendation_cache_key(user_data)
+        etag = result_id if is_default_response(options) else canonical_hash([result_id, options])
+        if request.if_none_match.contains(etag):
+            current_app.logger.info("Config unchanged (ETag match), returning 304.")
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        recommendations, errors, _, _ = generate_recommendations_cached(user_data, result_id)
         if errors: return jsonify({"error": "; ".join(errors), "recommendations": recommendations}), 400
-        app.logger.info("Successfully generated recommendations.")
-        return jsonify({"recommendations": recommendations})
+        current_app.logger.info("Successfully generated recommendations.")
+        body = {"recommendations": recommendations, "result_id": result_id}
+        if not is_default_response(options):
+            body["recommendations"], omitted = shape_recommendations(recommendations, options)
+            body["omitted"] = {part: f"/generate_config/{result_id}/{part}" for part in omitted}
+        response = jsonify(body)
+        response.set_etag(etag)
+        return response
     except Exception as e:
-        app.logger.error(f"Exception in /generate_config: {e}", exc_info=True)
+        current_app.logger.error(f"Exception in /generate_config: {e}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/ask_ai', methods=['POST'])
-def ask_ai_route():
-    """Handles AI chat, including confidence checks and parameter/artifact updates."""
-    app.logger.info("Received request for /ask_ai")
-    ai_text_response = "Sorry, I couldn't process that request."
-    updated_parameters = None
-    new_artifact_data = None
-    requires_confidence_input = False # Flag for frontend
-    confidence_topic = None         # Topic for confidence question
-    status_code = 500
-
+@routes.route('/generate_config/<result_id>/firmware.zip', methods=['GET'])
+def firmware_bundle_route(result_id):
+    """Zip with sender/receiver firmware for every owned module of a cached /generate_config result, streamed as it is rendered."""
+    cached = recommendation_cache.get(result_id)
+    if cached is None or "parameters" not in cached[0].get("config_json", {}):
+        return jsonify({"error": "Unknown or expired result"}), 404
+    config_json = cached[0]["config_json"]
+    return Response(stream_firmware_bundle(config_json), mimetype='application/zip',
+                    headers={"Content-Disposition": f'attachment; filename="{bundle_name(config_json)}.zip"'})
+
+@routes.route('/generate_config/<result_id>/<path:part>', methods=['GET'])
+def generate_config_part_route(result_id, part):
+    """One part left out of a /generate_config response ("omitted"), while the result is still cached (404 otherwise)."""
     try:
-        request_data = request.get_json()
-        if not request_data: return jsonify({"error": "No data received"}), 400
-
-        api_key = request_data.get('api_key')
-        chat_history = request_data.get('chat_history', [])
-
-        if not api_key: return jsonify({"error": "API Key is missing"}), 400
-        if not isinstance(chat_history, list) or not chat_history:
-             return jsonify({"error": "Invalid or empty chat_history provided"}), 400
-
-        try:
-            # Tentar extrair a planta do ÚLTIMO input do utilizador no histórico (se existir)
-            # O frontend deve garantir que user_inputs (incluindo floorplan) está no contexto inicial
-            floorplan_context = {}
-            last_user_message_data = {}
-            if chat_history and chat_history[-1]['role'] == 'user':
-                # Tenta fazer parse do JSON dentro da mensagem do user (se o frontend o colocar lá)
-                # Ou, mais robusto: o frontend envia a planta como um campo separado no request_data
-                # Vamos assumir que está no contexto inicial da conversa
-                if chat_history[0]['role'] == 'user' and 'Initial Context:' in chat_history[0]['parts'][0]['text']:
-                    try:
-                        context_str = chat_history[0]['parts'][0]['text'].split('Initial Context:')[1].split('\nFirst Question:')[0].strip()
-                        initial_context = json.loads(context_str)
-                        floorplan_context = initial_context.get('user_inputs', {}).get('floorplan', {})
-                        if floorplan_context:
-                            app.logger.info("Extracted floor plan data from initial context for AI.")
-                    except Exception as parse_err:
-                        app.logger.warning(f"Could not extract/parse floor plan from initial context: {parse_err}")
-
-                genai.configure(api_key=api_key)
-
-                # --- System Instruction Including Confidence Check ---
-                system_instruction = (
-                "You are an expert assistant focused *only* on LoRa technology, LoRaWAN, and related hardware/software "
-                "specifically for smart home, DIY, and hobbyist applications. Do not answer questions outside this scope. "
-                "Provide clear, practical advice suitable for beginners and intermediate users.\n"
-                "## Floor Plan Analysis (If Provided):\n"
-                "The user might provide floor plan data in the 'user_inputs.floorplan' part of the initial context. It has this structure:\n"
-                "{ 'rows': R, 'cols': C, 'grid': [['type', ...], ...], 'gateway': {'row': r, 'col': c} or null, 'sensors': [{'row': r, 'col': c}, ...] }\n"
-                "Where 'grid' is a 2D array (R rows, C columns), 'type' can be 'empty', 'drywall', 'brick', 'concrete', 'gateway', 'sensor'.\n"
-                "**If floor plan data is present and relevant to the question:**\n"
-                "- Use it to give specific advice on gateway/sensor placement (e.g., 'Move gateway near (row, col) to improve signal to sensor at (row, col)').\n"
-                "- Identify potential signal dead spots caused by walls (especially 'concrete' or multiple 'brick').\n"
-                "- Suggest adding repeaters (more gateways/nodes) if coverage seems challenging based on the plan.\n"
-                "- Relate parameter choices (like SF) to the specific layout challenges.\n"
-                "**Emoji Grid Representation:**\n"
-                "When your response **directly discusses specific device placements (gateway, sensors), analyzes signal paths based on walls, or suggests moving devices according to the provided floor plan grid**, you **MUST include a visual representation of the grid using emojis**. \n"
-                "Use the following emojis:\n"
-                "- `empty`: ⚪️\n"
-                "- `drywall`: 🟫\n"
-                "- `brick`: 🧱\n"
-                "- `concrete`: ⬛️\n"
-                "- `gateway`: 📡\n"
-                "- `sensor`: 🟩\n"
-                "**Format the grid within a Markdown code block (```)** for proper alignment. Each row of the grid should be on a new line. Do not include spaces between emojis within a row.\n"
-                "Example for a 3x4 grid:\n"
-                "```\n"
-                "⚪️⚪️🧱⚪️\n"
-                "⚪️📡⚪️🟩\n"
-                "⚪️⬛️⬛️⚪️\n"
-                "```\n"
-                "**Only include this emoji grid when your explanation actively refers to the spatial layout or positions from the `user_inputs.floorplan.grid` data.** Do not include it otherwise.\n\n"
-                "## Confidence Level Check:\n"
-                 "## Confidence Level Check:\n"
-                 "If your explanation involves practical skills (like soldering, wiring, complex software configuration, flashing firmware) "
-                 "where user experience matters significantly, **ask the user about their confidence level first**. "
-                 "Phrase your question clearly and include a marker EXACTLY like this: `<<<ASK_CONFIDENCE: [Brief Topic e.g., Soldering/Wiring/Linux Config]>>>` "
-                 "Example: 'This involves soldering. <<<ASK_CONFIDENCE: Soldering>>> How confident are you with soldering?' "
-                 "**Stop your response there.** Wait for the user's next message, which will start with 'My confidence with [Topic] is: [Level e.g., Beginner/Confident]'. "
-                 "Then, tailor the *detail level* of your *next* response accordingly (more detail for Beginner, standard for Confident). "
-                 "Do NOT ask about confidence for simple explanations or parameter choices.\n"
-                 "## Parameter Updates:\n"
-                 "If parameters should change, include: ```json\n<<<UPDATE_PARAMS>>>{\"param\": value}<<<END_UPDATE>>>\n``` Explain why.\n"
-                 "## Code Generation/Explanation:\n"
-                 "Explain code clearly. Provide complete, well-commented code snippets with links if possible.\n"
-                 "## Adding New Artifacts:\n"
-                 "If adding a new code example/instructions, include: ```json\n<<<ADD_ARTIFACT>>>{\"title\": \"...\", \"type\": \"...\", ...}<<<END_ADD>>>\n``` Explain it."
-            )
-            # --- End System Instruction ---
+        cached = recommendation_cache.get(result_id)
+        value = get_recommendation_part(cached[0], part) if cached is not None else None
+        if value is None: return jsonify({"error": "Unknown part or expired result"}), 404
+        response = jsonify({"result_id": result_id, "part": part, "value": value})
+        response.set_etag(canonical_hash([result_id, part]))
+        return response.make_conditional(request)
+    except Exception as e:
+        current_app.logger.error(f"Exception in /generate_config/<id>/<part>: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-            model = genai.GenerativeModel(
-                'gemini-2.0-flash',
-                 system_instruction=system_instruction
-            )
+@routes.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    """Hit/miss counters of the recommendation cache, the Gemini client pool and the rendered code cache, and the artifact store writes."""
+    return jsonify({"recommendations": recommendation_cache.stats(), "ai_models": ai_model_pool_stats(), "artifact_store": artifact_store.stats(), "codegen": render_cache_stats()})
 
-            app.logger.debug(f"Starting chat with history (length {len(chat_history)})")
-            chat = model.start_chat(history=chat_history[:-1])
-            last_user_message = chat_history[-1]['parts'][0]['text']
-            app.logger.debug(f"Sending last message to Gemini: {last_user_message[:200]}...")
-            response = chat.send_message(last_user_message)
-            app.logger.debug(f"Received response from Gemini.")
+@routes.route('/generate_config/batch', methods=['POST'])
+def generate_config_batch_route():
+    """Generates configs for many sites ({"sites": [...], "save_artifacts": false}), streamed as NDJSON as each site finishes."""
+    current_app.logger.info("Received request for /generate_config/batch")
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        sites = user_data.get('sites')
+        if not isinstance(sites, list) or not sites or not all(isinstance(site, dict) for site in sites):
+            return jsonify({"error": "'sites' must be a non-empty list of site payloads"}), 400
+        if len(sites) > MAX_BATCH_SITES:
+            return jsonify({"error": f"Too many sites ({len(sites)} > {MAX_BATCH_SITES})"}), 400
+        results = generate_recommendations_batch(sites, save_artifacts=bool(user_data.get('save_artifacts', False)))
+        return Response((json.dumps(result) + "\n" for result in results), mimetype='application/x-ndjson')
+    except Exception as e:
+        current_app.logger.error(f"Exception in /generate_config/batch: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-            if response.parts:
-                 raw_text_response = response.text
-                 status_code = 200
-                 ai_text_response = raw_text_response
+@routes.route('/floorplan_session', methods=['POST'])
+def create_floorplan_session_route():
+    """Starts an editor session with the full floor plan (payload of /generate_config); later edits go to /floorplan_session/<id>/edits."""
+    current_app.logger.info("Received request for /floorplan_session")
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        session_id, summary = create_session(user_data)
+        return jsonify({"session_id": session_id, **summary})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Exception in /floorplan_session: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-                 # --- Check for Confidence Question ---
-                 confidence_match = re.search(r'<<<ASK_CONFIDENCE:\s*(.*?)\s*>>>', ai_text_response, re.IGNORECASE)
-                 if confidence_match:
-                     requires_confidence_input = True
-                     confidence_topic = confidence_match.group(1).strip()
-                     # Remove the marker from the response shown to the user
-                     ai_text_response = ai_text_response.replace(confidence_match.group(0), "").strip()
-                     app.logger.info(f"AI is asking for confidence level on topic: {confidence_topic}")
-                 # --- End Confidence Check ---
+@routes.route('/floorplan_session/<session_id>/edits', methods=['POST'])
+def floorplan_session_edits_route(session_id):
+    """Applies cell edits ({"base_revision": n, "edits": [{"row", "col", "type"}]}) and returns the updated link margins."""
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        result = apply_session_edits(session_id, user_data.get('edits') or [], user_data.get('base_revision'))
+        if result is None: return jsonify({"error": "Unknown or expired session"}), 404
+        return jsonify({"session_id": session_id, **result})
+    except RevisionConflict as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Exception in /floorplan_session/<id>/edits: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-                 # --- Parse for Parameter Updates (Only if not asking for confidence) ---
-                 if not requires_confidence_input:
-                     update_match = re.search(r'<<<UPDATE_PARAMS>>>(.*?)<<<END_UPDATE>>>', ai_text_response, re.DOTALL | re.IGNORECASE)
-                     if update_match:
-                         # (Parsing logic remains the same as previous version)
-                         json_str = update_match.group(1).strip(); json_str = re.sub(r'^```json\s*|\s*```$', '', json_str, flags=re.MULTILINE)
-                         app.logger.info(f"Found potential parameter update JSON: {json_str}")
-                         try:
-                             parsed_update = json.loads(json_str)
-                             if isinstance(parsed_update, dict):
-                                 valid_update = {}; allowed_keys = ["spreading_factor", "tx_power_dbm", "signal_bandwidth_khz", "coding_rate", "preamble_length", "sync_word"]
-                                 for key, value in parsed_update.items():
-                                     if key in allowed_keys: valid_update[key] = value
-                                     else: app.logger.warning(f"Ignoring unknown parameter key: {key}")
-                                 if valid_update:
-                                     updated_parameters = valid_update; app.logger.info(f"Parsed valid parameter updates: {updated_parameters}")
-                                     ai_text_response = ai_text_response.replace(update_match.group(0), "").strip()
-                                     ai_text_response += "\n\n*(Note: Parameters updated based on discussion.)*"
-                                 else: app.logger.warning("Parsed JSON for param update empty/invalid.")
-                             else: app.logger.warning("Parsed param JSON not a dict.")
-                         except json.JSONDecodeError as json_err: app.logger.error(f"Failed to decode param JSON: {json_err}")
-                 # --- End Parameter Parsing ---
+@routes.route('/coverage_map', methods=['POST'])
+def coverage_map_route():
+    """Returns the best SF and link margin for every floor plan cell (same payload as /generate_config)."""
+    current_app.logger.info("Received request for /coverage_map")
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        coverage, errors = generate_coverage_map(user_data)
+        if errors: return jsonify({"error": "; ".join(errors), "coverage": coverage}), 400
+        current_app.logger.info("Successfully generated coverage map.")
+        return jsonify({"coverage": coverage})
+    except Exception as e:
+        current_app.logger.error(f"Exception in /coverage_map: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-                 # --- Parse for New Artifact Addition (Only if not asking for confidence) ---
-                 if not requires_confidence_input:
-                     add_artifact_match = re.search(r'<<<ADD_ARTIFACT>>>(.*?)<<<END_ADD>>>', ai_text_response, re.DOTALL | re.IGNORECASE)
-                     if add_artifact_match:
-                         # (Parsing logic remains the same as previous version)
-                         json_str = add_artifact_match.group(1).strip(); json_str = re.sub(r'^```json\s*|\s*```$', '', json_str, flags=re.MULTILINE)
-                         app.logger.info(f"Found potential new artifact JSON: {json_str}")
-                         try:
-                             parsed_artifact = json.loads(json_str)
-                             required_keys = ["title", "type", "language", "filename", "content"]
-                             if isinstance(parsed_artifact, dict) and all(key in parsed_artifact for key in required_keys):
-                                 new_artifact_data = parsed_artifact; app.logger.info(f"Parsed valid new artifact: {new_artifact_data.get('title')}")
-                                 ai_text_response = ai_text_response.replace(add_artifact_match.group(0), "").strip()
-                                 ai_text_response += f"\n\n*(Note: Added new artifact '{new_artifact_data.get('title')}'.)*"
-                             else: app.logger.warning("Parsed JSON for new artifact missing keys or not a dict.")
-                         except json.JSONDecodeError as json_err: app.logger.error(f"Failed to decode new artifact JSON: {json_err}")
-                 # --- End New Artifact Parsing ---
+@routes.route('/optimize_gateway', methods=['POST'])
+def optimize_gateway_route():
+    """Returns the top N gateway positions for the floor plan (payload of /generate_config plus 'top_n' and 'objective')."""
+    current_app.logger.info("Received request for /optimize_gateway")
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        result, errors = optimize_gateway_placement(user_data, top_n=user_data.get('top_n', 5), objective=user_data.get('objective', 'margin'))
+        if errors: return jsonify({"error": "; ".join(errors), "placement": result}), 400
+        current_app.logger.info("Successfully optimized gateway placement.")
+        return jsonify({"placement": result})
+    except Exception as e:
+        current_app.logger.error(f"Exception in /optimize_gateway: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
+@routes.route('/plan_gateways', methods=['POST'])
+def plan_gateways_route():
+    """Returns a multi-gateway plan covering every sensor at SF <= 'max_sf' (payload of /generate_config plus 'max_sf' and optional 'max_gateways')."""
+    current_app.logger.info("Received request for /plan_gateways")
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        result, errors = plan_gateways(user_data, max_sf=user_data.get('max_sf', 12), max_gateways=user_data.get('max_gateways'))
+        if errors: return jsonify({"error": "; ".join(errors), "plan": result}), 400
+        current_app.logger.info("Successfully planned gateways.")
+        return jsonify({"plan": result})
+    except Exception as e:
+        current_app.logger.error(f"Exception in /plan_gateways: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-            elif response.prompt_feedback.block_reason:
-                 ai_text_response = f"Request blocked due to: {response.prompt_feedback.block_reason}."
-                 status_code = 400
-                 app.logger.warning(f"Gemini request blocked: {response.prompt_feedback.block_reason}")
-            else:
-                 ai_text_response = "The AI model did not provide a text response."
-                 status_code = 500
-                 app.logger.warning("Gemini response missing text parts.")
+@routes.route('/simulate_network', methods=['POST'])
+def simulate_network_route():
+    """Simulates ALOHA collisions over a day for the site (payload of /generate_config plus optional 'node_counts', 'duration_h', 'channels')."""
+    current_app.logger.info("Received request for /simulate_network")
+    try:
+        user_data = request.get_json()
+        if not user_data: return jsonify({"error": "No data received"}), 400
+        results, errors = simulate_site(user_data)
+        if errors: return jsonify({"error": "; ".join(errors), "simulation": results}), 400
+        current_app.logger.info("Successfully simulated network capacity.")
+        return jsonify({"simulation": results})
+    except Exception as e:
+        current_app.logger.error(f"Exception in /simulate_network: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
 
-        except Exception as e:
-            app.logger.error(f"Error calling Gemini API: {e}", exc_info=True)
-            ai_text_response = f"Error communicating with the AI service: {e}. Check API key/quota."
-            status_code = 401 if "API key not valid" in str(e) else 500
+def _get_chat_request():
+    """
+    Reads an /ask_ai request: {"session_id", "message"} continues a chat session, a full {"chat_history"}
+    (ending with the new user message, optionally with a structured "context") starts one. Returns (api_key, session_id, session, message, error_response).
+    """
+    request_data = request.get_json()
+    if not request_data: return None, None, None, None, (jsonify({"error": "No data received"}), 400)
+    api_key = request_data.get('api_key')
+    if not api_key: return None, None, None, None, (jsonify({"error": "API Key is missing"}), 400)
+
+    session_id = request_data.get('session_id')
+    if session_id:
+        session = get_chat_session(session_id)
+        if session is None:
+            # Sessão expirada: o cliente volta a enviar o histórico completo
+            return None, None, None, None, (jsonify({"error": "Chat session not found or expired"}), 404)
+        message = request_data.get('message')
+        if not isinstance(message, str) or not message.strip():
+            return None, None, None, None, (jsonify({"error": "'message' must be a non-empty string"}), 400)
+        return api_key, session_id, session, message, None
+
+    chat_history = request_data.get('chat_history', [])
+    if not isinstance(chat_history, list) or not chat_history:
+        return None, None, None, None, (jsonify({"error": "Invalid or empty chat_history provided"}), 400)
+    if chat_history[-1].get('role') != 'user':
+        return None, None, None, None, (jsonify({"error": "The last chat_history message must come from the user"}), 400)
+    # Contexto inicial (user_inputs com a planta): campo "context" estruturado ou, no formato antigo, dentro da 1ª mensagem
+    context = request_data.get('context')
+    if context is not None:
+        if not isinstance(context, dict):
+            return None, None, None, None, (jsonify({"error": "'context' must be an object"}), 400)
+        ai_context = get_ai_context(context)
+    else:
+        ai_context, chat_history = split_initial_context(chat_history)
+    session_id, session = create_chat_session(chat_history[:-1], ai_context)
+    return api_key, session_id, session, chat_history[-1]['parts'][0]['text'], None
+
+def _sse_stream(events):
+    """Formats (event, data) pairs as Server-Sent Events; when the client disconnects the server closes this, which closes events."""
+    try:
+        for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    finally:
+        events.close()
 
+def _record_streamed_turn(events, session_id, session, message):
+    """Passes the reply events through, storing the finished turn in the chat session and adding session_id to 'done'."""
+    try:
+        for event, data in events:
+            if event == 'done':
+                session.record_turn(message, data["answer"])
+                data = {**data, "session_id": session_id}
+            yield event, data
+    finally:
+        events.close()
+
+@routes.route('/ask_ai', methods=['POST'])
+def ask_ai_route():
+    """Handles AI chat, including confidence checks and parameter/artifact updates (the reply includes the chat session_id)."""
+    current_app.logger.info("Received request for /ask_ai")
+    try:
+        api_key, session_id, session, message, error_response = _get_chat_request()
+        if error_response: return error_response
+        floorplan_grid = session.context.emoji_grid() if session.context else None
+        response_payload, status_code = ask_ai_reply(api_key, session.history_for(message), floorplan_grid=floorplan_grid)
+        if status_code == 200:
+            session.record_turn(message, response_payload["answer"])
+            response_payload["session_id"] = session_id
         # Return text answer, updates, and confidence flag
-        response_payload = {"answer": ai_text_response}
-        if updated_parameters:
-            response_payload["updated_parameters"] = updated_parameters
-        if new_artifact_data:
-            response_payload["new_artifact"] = new_artifact_data
-        if requires_confidence_input:
-            response_payload["requires_confidence_input"] = True
-            response_payload["confidence_topic"] = confidence_topic
-
         return jsonify(response_payload), status_code
+    except AIBusyError as e:
+        current_app.logger.warning(f"Rejected /ask_ai request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(AI_SETTINGS["busy_retry_after_s"])}
+    except Exception as e:
+        current_app.logger.error(f"Exception occurred processing /ask_ai request: {e}", exc_info=True)
+        return jsonify({"error": "An internal server error occurred processing your AI request."}), 500
 
+@routes.route('/ask_ai/stream', methods=['POST'])
+def ask_ai_stream_route():
+    """
+    Same as /ask_ai, but streams the reply as Server-Sent Events: 'token' events with text as the
+    model writes it (markers removed), then one 'done' event with the /ask_ai payload or an 'error' event.
+    """
+    current_app.logger.info("Received request for /ask_ai/stream")
+    try:
+        api_key, session_id, session, message, error_response = _get_chat_request()
+        if error_response: return error_response
+        floorplan_grid = session.context.emoji_grid() if session.context else None
+        events = _record_streamed_turn(stream_ai_reply(api_key, session.history_for(message), floorplan_grid=floorplan_grid), session_id, session, message)
+        return Response(_sse_stream(events), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except AIBusyError as e:
+        current_app.logger.warning(f"Rejected /ask_ai/stream request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(AI_SETTINGS["busy_retry_after_s"])}
     except Exception as e:
-        app.logger.error(f"Exception occurred processing /ask_ai request: {e}", exc_info=True)
+        current_app.logger.error(f"Exception occurred processing /ask_ai/stream request: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred processing your AI request."}), 500
 
-# --- Other routes (/health) remain the same ---
-@app.route('/health')
+@routes.route('/health')
 def health_check():
-    app.logger.debug("Health check endpoint called.")
+    current_app.logger.debug("Health check endpoint called.")
     return jsonify({"status": "ok"}), 200
 
+def create_app():
+    """Builds the Flask app (templates in frontend/, static files in /static) with all the routes."""
+    app = Flask(__name__,
+                template_folder=template_dir,
+                static_folder=static_dir, # Informa o Flask onde estão os ficheiros estáticos
+                static_url_path='/static') # URL base para aceder aos ficheiros estáticos
+    app.logger.setLevel(logging.INFO)
+    app.config['LOGGER_HANDLER_POLICY'] = 'always'
+    app.register_blueprint(routes)
+    return app
+
+logging.basicConfig(level=logging.INFO)
+app = create_app() # Para 'python app.py', 'flask run' e servidores WSGI (app:app)
+
 if __name__ == '__main__':
     app.logger.info("Starting Flask development server.")
     debug_mode = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
@@ -0,0 +1,242 @@
+# artifact_store.py
+# Artefactos gerados (.ino/.md) guardados por hash do conteúdo: escrita atómica numa thread de fundo, sem duplicados, com limpeza dos antigos
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from config import ARTIFACT_STORE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+ARTIFACTS_DIR = os.path.join(BASE_DIR, 'Artifacts')
+STORE_DIR = os.path.join(ARTIFACTS_DIR, 'store')
+
+_SHUTDOWN = object()
+
+
+def _safe_name(name):
+    """Only safe characters in a namespace (it comes from the request)."""
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(name)).strip(".") or "_"
+
+
+def _write_atomic(path, data):
+    """Writes bytes to a temporary file in the same directory and renames it over path (readers never see a partial file)."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for generated artifacts.
+
+    Each file's content is written once to objects/<hash[:2]>/<hash><ext>; identical content
+    (same code for another user or request) is not written again. Every namespace (one per
+    request, batch site or session) has a manifest.json mapping its file names to hashes, so
+    concurrent users never overwrite each other's files. save() only hashes the content and
+    queues the write: a single background thread does the disk work, with temp-file + rename
+    writes, and periodically evicts the least recently used objects and old namespaces.
+    """
+
+    def __init__(self, root=STORE_DIR, settings=ARTIFACT_STORE_SETTINGS):
+        self.root = root
+        self.settings = settings
+        self._queue = queue.Queue(maxsize=settings["queue_size"])
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._last_eviction = 0.0
+        self.writes = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def _object_path(self, content_hash, extension):
+        return os.path.join(self.root, 'objects', content_hash[:2], content_hash + extension)
+
+    def _manifest_path(self, namespace):
+        return os.path.join(self.root, 'namespaces', _safe_name(namespace), 'manifest.json')
+
+    def save(self, namespace, filename, content):
+        """
+        Queues one artifact file for writing under namespace. Returns its content hash
+        (sha256 hex) right away; the file is on disk once the writer thread gets to it.
+        """
+        data = content.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((namespace, filename, content_hash, os.path.splitext(filename)[1], data))
+        except queue.Full:
+            # Disco lento demais: perder a cópia em disco é melhor do que bloquear o pedido
+            self.dropped += 1
+            logger.warning(f"Artifact write queue full, dropped {filename} ({namespace}).")
+        return content_hash
+
+    def load(self, namespace, filename):
+        """Content of a stored artifact, or None (unknown, not written yet or evicted)."""
+        try:
+            with open(self._manifest_path(namespace), encoding='utf-8') as f:
+                entry = json.load(f).get(filename)
+            if not entry:
+                return None
+            with open(self._object_path(entry["sha256"], os.path.splitext(filename)[1]), encoding='utf-8') as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def flush(self, timeout_s=None):
+        """Waits until the queued writes are done (or timeout_s passes). Returns True if the queue is empty."""
+        deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        """Counters for monitoring."""
+        return {"queued": self._queue.qsize(), "writes": self.writes, "deduplicated": self.deduplicated,
+                "dropped": self.dropped, "evicted": self.evicted}
+
+    # --- Writer thread ---
+    def _ensure_writer(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer_loop, name='artifact-writer', daemon=True)
+                self._thread.start()
+
+    def _writer_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.settings["eviction_interval_s"])
+            except queue.Empty:
+                item = None
+            if item is _SHUTDOWN:
+                self._queue.task_done()
+                return
+            if item is not None:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    logger.error(f"Error writing artifact {item[1]} ({item[0]}): {e}")
+                finally:
+                    self._queue.task_done()
+            if time.monotonic() - self._last_eviction >= self.settings["eviction_interval_s"]:
+                self._last_eviction = time.monotonic()
+                try:
+                    self.evict()
+                except Exception as e:
+                    logger.error(f"Error evicting old artifacts: {e}")
+
+    def _write(self, namespace, filename, content_hash, extension, data):
+        path = self._object_path(content_hash, extension)
+        if os.path.exists(path):
+            os.utime(path) # Conteúdo repetido: não é reescrito, só conta como usado recentemente (para a limpeza)
+            self.deduplicated += 1
+        else:
+            _write_atomic(path, data)
+            self.writes += 1
+            logger.info(f"Saved artifact {filename} as {content_hash[:12]}{extension}.")
+        manifest_path = self._manifest_path(namespace)
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get(filename, {}).get("sha256") != content_hash:
+            manifest[filename] = {"sha256": content_hash, "size": os.path.getsize(path)}
+            _write_atomic(manifest_path, json.dumps(manifest, indent=2).encode('utf-8'))
+        else:
+            os.utime(manifest_path) # Namespace usado de novo: adia a limpeza
+
+    def evict(self):
+        """
+        Removes objects older than max_age_s, then the least recently used objects while the
+        store is above max_bytes, then namespaces not touched for max_age_s. The entries of the
+        other namespaces that point at a removed object are dropped from their manifests (and a
+        namespace left empty is removed), so a manifest never lists a file that load() can't
+        read. Runs on the writer thread.
+        """
+        now = time.time()
+        max_age_s, max_bytes = self.settings["max_age_s"], self.settings["max_bytes"]
+        objects = [] # (mtime, size, path)
+        objects_dir = os.path.join(self.root, 'objects')
+        if os.path.isdir(objects_dir):
+            for prefix in os.scandir(objects_dir):
+                if not prefix.is_dir():
+                    continue
+                for obj in os.scandir(prefix.path):
+                    if not obj.name.startswith('.tmp-'):
+                        stat = obj.stat()
+                        objects.append((stat.st_mtime, stat.st_size, obj.path))
+        objects.sort() # Menos usados primeiro
+        total_bytes = sum(size for _, size, _ in objects)
+        removed = set() # Nomes dos objetos apagados (hash + extensão)
+        for mtime, size, path in objects:
+            if now - mtime <= max_age_s and total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            removed.add(os.path.basename(path))
+        if removed:
+            self.evicted += len(removed)
+            logger.info(f"Evicted {len(removed)} old artifact(s); store now {total_bytes / 1e6:.1f} MB.")
+
+        namespaces_dir = os.path.join(self.root, 'namespaces')
+        if not os.path.isdir(namespaces_dir):
+            return
+        for entry in os.scandir(namespaces_dir):
+            manifest_path = os.path.join(entry.path, 'manifest.json')
+            try:
+                stat = os.stat(manifest_path)
+                manifest = {}
+                if now - stat.st_mtime <= max_age_s:
+                    with open(manifest_path, encoding='utf-8') as f:
+                        manifest = json.load(f)
+                kept = {name: item for name, item in manifest.items()
+                        if item["sha256"] + os.path.splitext(name)[1] not in removed}
+                if not kept:
+                    os.remove(manifest_path)
+                    os.rmdir(entry.path)
+                elif len(kept) < len(manifest):
+                    _write_atomic(manifest_path, json.dumps(kept, indent=2).encode('utf-8'))
+                    os.utime(manifest_path, (stat.st_atime, stat.st_mtime)) # Limpar não conta como uso do namespace
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+    def close(self, timeout_s=5.0):
+        """Finishes the queued writes and stops the writer thread (called at exit)."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_SHUTDOWN, timeout=timeout_s)
+        except queue.Full:
+            logger.warning(f"Artifact writer still busy at exit, {self._queue.qsize()} write(s) not done.")
+            return
+        self._thread.join(timeout_s)
+        self._thread = None
+
+
+artifact_store = ArtifactStore()
+atexit.register(artifact_store.close)
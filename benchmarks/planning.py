@@ -0,0 +1,272 @@
+# benchmarks/planning.py
+# Benchmark do motor de planeamento (lora_logic) com plantas sintéticas, com resultados em JSON para comparar entre commits
+"""
+Planning engine benchmark: times estimate_wall_loss, _calculate_lora_params,
+generate_recommendations (end to end, compact floor plan payload, no artifact writes),
+generate_coverage_map (gateway in the middle and in the last corner) and, on plans small enough,
+optimize_gateway_placement and plan_gateways (serial, cold sweep cache) on synthetic floor plans,
+and records the peak memory of each with tracemalloc.
+
+Scenarios are the product of --sizes (square grids, N x N cells), --sensors and --densities
+(fraction of wall cells). Plans are seeded, so every run and every commit sees the same input.
+
+    python benchmarks/planning.py                              # full matrix, writes benchmarks/results/planning-<commit>.json
+    python benchmarks/planning.py --quick                      # small matrix for a quick check
+    python benchmarks/planning.py --compare benchmarks/results/planning-abc1234.json
+    python benchmarks/planning.py --compare old.json --against new.json   # compare two saved runs only
+"""
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+from config import REGION_FREQUENCIES
+from lora_logic import (CELL_TYPES, estimate_wall_loss, encode_floorplan_grid, _calculate_lora_params, generate_recommendations, generate_coverage_map,
+                        optimize_gateway_placement, plan_gateways, _clear_sweep_cache)
+
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+DEFAULT_SIZES = (10, 100, 300, 1000)
+DEFAULT_SENSORS = (1, 50, 500, 5000)
+DEFAULT_DENSITIES = (0.02, 0.1, 0.3)
+QUICK_SIZES, QUICK_SENSORS, QUICK_DENSITIES = (10, 100), (1, 50), (0.1,)
+MAX_SENSOR_FRACTION = 0.5 # Cenários com mais sensores do que metade das células são ignorados
+WALL_LOSS_CALLS = 200 # Chamadas a estimate_wall_loss por medição (gateway -> sensores, em ciclo)
+MIN_SAMPLE_S = 0.05 # Funções rápidas são repetidas dentro de cada amostra até durar isto (ruído do relógio)
+REGRESSION_THRESHOLD = 1.25 # Mais lento do que 1.25x a referência (melhor tempo) conta como regressão
+SEED = 1234
+# A procura de gateways varre a grelha a partir de cada sensor: só em cenários até sensores x células = isto
+GATEWAY_SEARCH_MAX_SWEPT_CELLS = 5_000_000
+
+_WALL_CODES = np.array([CELL_TYPES.index(t) for t in ('drywall', 'brick', 'concrete')], dtype=np.uint8)
+_SENSOR_CODE, _GATEWAY_CODE = CELL_TYPES.index('sensor'), CELL_TYPES.index('gateway')
+
+
+def make_floorplan(size, sensors, density, seed=SEED):
+    """
+    Synthetic size x size plan: about density * cells wall cells (random drywall/brick/concrete
+    segments along rows and columns), the gateway in the middle and sensors on random free cells.
+    Returns (grid codes as a uint8 array, gateway position, sensor positions).
+    """
+    rng = np.random.default_rng([seed, size, sensors, int(density * 1000)])
+    grid = np.zeros((size, size), dtype=np.uint8)
+    target_walls = int(density * size * size)
+    while np.count_nonzero(grid) < target_walls:
+        length = int(rng.integers(1, max(2, size // 3)))
+        r, c = (int(x) for x in rng.integers(0, size, 2))
+        wall = _WALL_CODES[rng.integers(len(_WALL_CODES))]
+        if rng.random() < 0.5:
+            grid[r, c:c + length] = wall
+        else:
+            grid[r:r + length, c] = wall
+    gateway = {'row': size // 2, 'col': size // 2}
+    grid[gateway['row'], gateway['col']] = _GATEWAY_CODE
+    free = np.flatnonzero(grid.ravel() == 0)
+    cells = rng.choice(free, size=min(sensors, len(free)), replace=False)
+    grid.ravel()[cells] = _SENSOR_CODE
+    sensor_positions = [{'row': int(i // size), 'col': int(i % size)} for i in cells]
+    return grid, gateway, sensor_positions
+
+
+def build_payload(grid, gateway, sensor_positions):
+    """/generate_config payload for the plan, with the grid in the compact encoding the Pro wizard sends."""
+    rows, cols = grid.shape
+    return {
+        "region": "EU868", "size_sqm": rows * cols, "floors": 1, "walls_internal": 2, "wall_type": "brick",
+        "network_type": "multi_node", "owned_modules": ["heltec_wifi_lora_v2"], "has_gateway": "no",
+        "gateway_approach": "build_esp32", "existing_hw": [],
+        "floorplan_data": {"rows": rows, "cols": cols, "grid": encode_floorplan_grid(grid), "gateway": gateway, "sensors": sensor_positions},
+    }
+
+
+def _time_runs(fn, repeat):
+    """
+    Times fn like timeit: after a warm-up call, each of the repeat samples runs fn enough times
+    (loops) to last at least MIN_SAMPLE_S, with the garbage collector off. Returns the per-call
+    stats in seconds.
+    """
+    fn()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _sample_runs(fn, repeat)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _sample_runs(fn, repeat):
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= MIN_SAMPLE_S:
+            break
+        loops *= 10
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    return {"min_s": min(times), "median_s": statistics.median(times), "max_s": max(times), "loops": loops}
+
+
+def _peak_memory(fn):
+    """Peak memory (bytes) allocated by one call of fn, as seen by tracemalloc (NumPy buffers included)."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _cold(fn):
+    """fn with the sensor sweep cache emptied before each call, so every call sweeps again."""
+    def run():
+        _clear_sweep_cache()
+        return fn()
+    return run
+
+
+def run_scenario(size, sensors, density, repeat):
+    """Benchmarks the planning functions on one synthetic plan. Returns a list of result dicts."""
+    grid, gateway, sensor_positions = make_floorplan(size, sensors, density)
+    payload = build_payload(grid, gateway, sensor_positions)
+    floorplan_data = {**payload["floorplan_data"], "grid": grid} # Como fica depois de parse_floorplan_data
+    environment = {key: payload[key] for key in ('size_sqm', 'floors', 'walls_internal', 'wall_type')}
+    frequency = REGION_FREQUENCIES["EU868"]
+    targets = [sensor_positions[i % len(sensor_positions)] for i in range(WALL_LOSS_CALLS)]
+    # Gateway no canto oposto à origem da grelha: todas as células ficam antes dele
+    corner_payload = {**payload, "floorplan_data": {**payload["floorplan_data"], "gateway": {'row': size - 1, 'col': size - 1}}}
+
+    def wall_loss():
+        for target in targets:
+            estimate_wall_loss(grid, gateway, target)
+
+    cases = [
+        ("estimate_wall_loss", wall_loss, WALL_LOSS_CALLS),
+        ("_calculate_lora_params", lambda: _calculate_lora_params(environment, floorplan_data, "EU868", frequency), 1),
+        ("generate_recommendations", lambda: generate_recommendations(payload, save_artifacts=False), 1),
+        ("generate_coverage_map", lambda: generate_coverage_map(payload), 1),
+        ("generate_coverage_map (corner gateway)", lambda: generate_coverage_map(corner_payload), 1),
+    ]
+    if len(sensor_positions) * size * size <= GATEWAY_SEARCH_MAX_SWEPT_CELLS:
+        cases.append(("optimize_gateway_placement", _cold(lambda: optimize_gateway_placement(payload, parallel=False)), 1))
+        cases.append(("plan_gateways", _cold(lambda: plan_gateways(payload, max_sf=9, parallel=False)), 1))
+    scenario = {"size": size, "sensors": len(sensor_positions), "density": density,
+                "wall_cells": int(np.isin(grid, _WALL_CODES).sum())}
+    results = []
+    for name, fn, calls in cases:
+        timing = _time_runs(fn, repeat)
+        per_call = {key: value / calls if key.endswith("_s") else value for key, value in timing.items()}
+        results.append({"benchmark": name, **scenario, "calls_per_loop": calls, **per_call, "repeat": repeat,
+                        "peak_memory_bytes": _peak_memory(fn)})
+    return results
+
+
+def result_key(result):
+    """Identifies a measurement across runs: function and scenario."""
+    return f"{result['benchmark']}[{result['size']}x{result['size']},{result['sensors']} sensors,{result['density']:g} walls]"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares two result files by best time (least sensitive to noise) and peak memory. Prints one
+    line per shared measurement and returns the keys that got slower than threshold x the baseline.
+    """
+    baseline_by_key = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    print(f"{'benchmark':<70} {'base ms':>10} {'now ms':>10} {'ratio':>7} {'mem ratio':>9}")
+    for result in current["results"]:
+        key = result_key(result)
+        base = baseline_by_key.get(key)
+        if base is None:
+            continue
+        ratio = result["min_s"] / base["min_s"] if base["min_s"] else float('inf')
+        mem_ratio = result["peak_memory_bytes"] / base["peak_memory_bytes"] if base["peak_memory_bytes"] else float('inf')
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{key:<70} {base['min_s'] * 1000:>10.3f} {result['min_s'] * 1000:>10.3f} {ratio:>6.2f}x {mem_ratio:>8.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(key)
+    print(f"Baseline {baseline['meta']['commit']} vs {current['meta']['commit']}: {len(regressions)} regression(s) over {threshold:g}x.")
+    return regressions
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the LoRa planning engine on synthetic floor plans.")
+    parser.add_argument("--quick", action="store_true", help="small matrix (10x10 and 100x100, 1 and 50 sensors)")
+    parser.add_argument("--sizes", type=int, nargs="+", help=f"grid sizes N (N x N cells, default: {' '.join(map(str, DEFAULT_SIZES))})")
+    parser.add_argument("--sensors", type=int, nargs="+", help=f"sensor counts (default: {' '.join(map(str, DEFAULT_SENSORS))})")
+    parser.add_argument("--densities", type=float, nargs="+", help=f"wall cell fractions (default: {' '.join(map(str, DEFAULT_DENSITIES))})")
+    parser.add_argument("--repeat", type=int, default=5, help="timed samples per measurement, after one warm-up (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="results file (default: benchmarks/results/planning-<commit>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare with a previous results file")
+    parser.add_argument("--against", metavar="CURRENT", help="with --compare: compare this saved file instead of running")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="slowdown ratio counted as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.against:
+        if not args.compare:
+            parser.error("--against needs --compare")
+        return 1 if compare_results(_load(args.compare), _load(args.against), args.threshold) else 0
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    sensor_counts = args.sensors or (QUICK_SENSORS if args.quick else DEFAULT_SENSORS)
+    densities = args.densities or (QUICK_DENSITIES if args.quick else DEFAULT_DENSITIES)
+    scenarios = [(size, sensors, density) for size, sensors, density in itertools.product(sizes, sensor_counts, densities)
+                 if sensors <= MAX_SENSOR_FRACTION * size * size]
+
+    commit = _git_commit()
+    results = []
+    for i, (size, sensors, density) in enumerate(scenarios, start=1):
+        start = time.perf_counter()
+        scenario_results = run_scenario(size, sensors, density, args.repeat)
+        results += scenario_results
+        timings = ", ".join(f"{result['benchmark']} {result['median_s'] * 1000:.3f} ms" for result in scenario_results)
+        print(f"[{i}/{len(scenarios)}] {size}x{size}, {sensors} sensors, {density:g} walls: {timings} ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+    report = {
+        "meta": {"commit": commit, "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                 "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                 "cpu_count": os.cpu_count(), "repeat": args.repeat, "seed": SEED},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"planning-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} result(s) to {output}", file=sys.stderr)
+
+    if args.compare:
+        return 1 if compare_results(_load(args.compare), report, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# benchmarks/startup.py
+# Tempo de arranque de um processo novo da app (importar app.py e responder ao primeiro /health), comparado com um orçamento
+"""
+Cold start benchmark: each run is a fresh interpreter that imports app.py and serves the first
+/health request through the Flask test client. Fails (exit 1) if the median import time goes over
+the budget, or if startup loaded a module that should only load on first use (the Gemini SDK).
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --budget 0.5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+IMPORT_BUDGET_S = 0.6 # Mediana de 'import app' num processo novo
+LAZY_MODULES = ('google.generativeai',) # Só carregados no primeiro pedido ao assistente
+
+# Corre num interpretador novo; imprime uma linha JSON com as medições
+_CHILD_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/health')
+served = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "first_health_s": served - start, "health_status": response.status_code,
+                  "loaded_lazy_modules": [name for name in %r if name in sys.modules]}))
+"""
+
+
+def measure_once():
+    """Imports the app in a new interpreter. Returns its measurements."""
+    result = subprocess.run([sys.executable, "-c", _CHILD_CODE % (LAZY_MODULES,)], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold start time of the app process (import + first /health).")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start (default: %(default)s)")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_S, help="max median import time in seconds (default: %(default)s)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    measure_once() # Aquecer a cache do sistema de ficheiros e os .pyc
+    runs = [measure_once() for _ in range(args.runs)]
+    import_s = statistics.median(run["import_s"] for run in runs)
+    first_health_s = statistics.median(run["first_health_s"] for run in runs)
+    lazy_loaded = sorted({name for run in runs for name in run["loaded_lazy_modules"]})
+    failures = []
+    if import_s > args.budget:
+        failures.append(f"median import time {import_s:.3f}s is over the {args.budget:.3f}s budget")
+    if lazy_loaded:
+        failures.append(f"loaded at startup: {', '.join(lazy_loaded)}")
+    if any(run["health_status"] != 200 for run in runs):
+        failures.append("/health did not return 200")
+
+    summary = {"runs": args.runs, "budget_s": args.budget, "median_import_s": round(import_s, 4),
+               "median_first_health_s": round(first_health_s, 4), "lazy_modules_loaded": lazy_loaded, "failures": failures}
+    print(f"import app: {import_s * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms), first /health after {first_health_s * 1000:.0f} ms, median of {args.runs} run(s)")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# caching.py
+# Cache LRU/TTL genérica (thread-safe) e hash canónico de payloads, usada pelos vários caches do servidor
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_hash(payload):
+    """SHA-256 hex digest of a JSON-serializable payload, independent of key order and whitespace."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live per entry.
+
+    Holds at most maxsize entries (least recently used evicted first); entries older than
+    ttl_s seconds are treated as misses and dropped. Keeps hit/miss/eviction counters.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=128, ttl_s=None):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value (marking it as recently used) or default."""
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            if entry is not self._MISSING and entry[0] is not None and entry[0] <= time.monotonic():
+                del self._entries[key] # Expirada
+                entry = self._MISSING
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def __contains__(self, key):
+        """True if key is cached and not expired (does not touch the counters or the LRU order)."""
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            return entry is not self._MISSING and (entry[0] is None or entry[0] > time.monotonic())
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entries past maxsize."""
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Removes key and returns its value (or default)."""
+        with self._lock:
+            entry = self._entries.pop(key, self._MISSING)
+            return default if entry is self._MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """Counters for monitoring (hit_rate is None before the first lookup)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
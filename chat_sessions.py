@@ -0,0 +1,91 @@
+# chat_sessions.py
+# Conversas do assistente guardadas no servidor: o contexto inicial é enviado uma vez e o cliente só manda a nova mensagem
+import logging
+import secrets
+import threading
+from caching import LRUCache
+from config import AI_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4 # Estimativa grosseira (inglês/JSON), suficiente para o orçamento do histórico
+MAX_SUMMARY_QUESTIONS = 20
+MAX_SUMMARY_QUESTION_CHARS = 200
+
+_chat_sessions = LRUCache(maxsize=AI_SETTINGS["chat_session_limit"], ttl_s=AI_SETTINGS["chat_session_ttl_s"])
+
+
+def _message(role, text):
+    return {'role': role, 'parts': [{'text': text}]}
+
+
+def _message_text(message):
+    return ''.join(part.get('text', '') for part in message.get('parts', []))
+
+
+def estimate_tokens(messages):
+    """Approximate token count of chat messages (characters / CHARS_PER_TOKEN)."""
+    return sum(len(_message_text(message)) for message in messages) // CHARS_PER_TOKEN
+
+
+class ChatSession:
+    """
+    Server-side history of one AI conversation.
+
+    The initial context (AIContext) is kept apart and only added to the first message when the
+    history is sent. The first exchange (first question and the model's reply) is kept as is.
+    Later turns are kept while they fit in chat_history_token_budget; older ones are dropped in
+    user/model pairs and replaced by a short summary of the questions asked.
+    """
+
+    def __init__(self, chat_history, ai_context=None):
+        self.messages = [_message(m['role'], _message_text(m)) for m in chat_history]
+        self.context = ai_context # AIContext (ai_context.py) ou None; nunca é guardado como texto no histórico
+        self.omitted_questions = []
+        self.lock = threading.Lock()
+        self._compact()
+
+    def history_for(self, message):
+        """History to send to the model for a new user message (pinned exchange, summary, recent turns, message)."""
+        with self.lock:
+            history = self.messages[:2]
+            if self.omitted_questions:
+                summary = "Summary of the earlier conversation (older turns omitted). The user previously asked:\n" + \
+                          "\n".join(f"- {question}" for question in self.omitted_questions)
+                history += [_message('user', summary), _message('model', "Understood, I'll keep that in mind.")]
+            history = history + self.messages[2:] + [_message('user', message)]
+        if self.context is not None:
+            history[0] = _message('user', self.context.first_message(_message_text(history[0])))
+        return history
+
+    def record_turn(self, message, answer):
+        """Stores a completed user message / model answer pair and compacts the history."""
+        with self.lock:
+            self.messages += [_message('user', message), _message('model', answer)]
+            self._compact()
+
+    def _compact(self):
+        budget = AI_SETTINGS["chat_history_token_budget"]
+        # O par fixo (contexto) não conta para o orçamento; a última troca fica sempre
+        while len(self.messages) > 4 and estimate_tokens(self.messages[2:]) > budget:
+            dropped = self.messages[2:4] if self.messages[2]['role'] == 'user' and self.messages[3]['role'] == 'model' else self.messages[2:3]
+            del self.messages[2:2 + len(dropped)]
+            for message in dropped:
+                if message['role'] == 'user':
+                    question = _message_text(message).strip().replace('\n', ' ')
+                    self.omitted_questions.append(question[:MAX_SUMMARY_QUESTION_CHARS] + ('...' if len(question) > MAX_SUMMARY_QUESTION_CHARS else ''))
+            del self.omitted_questions[:-MAX_SUMMARY_QUESTIONS]
+
+
+def create_chat_session(chat_history, ai_context=None):
+    """Creates a session from the messages exchanged so far (without the context). Returns (session_id, session)."""
+    session = ChatSession(chat_history, ai_context)
+    session_id = secrets.token_urlsafe(16)
+    _chat_sessions.put(session_id, session)
+    logger.info(f"Created chat session {session_id[:6]}... ({len(session.messages)} message(s), ~{estimate_tokens(session.messages)} tokens).")
+    return session_id, session
+
+
+def get_chat_session(session_id):
+    """The session, or None when it doesn't exist (expired), so the client can resend the full history."""
+    return _chat_sessions.get(session_id)
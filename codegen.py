@@ -0,0 +1,78 @@
+# codegen.py
+# Código e instruções dos artefactos gerados a partir de templates Jinja (code_templates/), compilados uma vez no arranque
+import logging
+import os
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from caching import LRUCache
+from config import BOARD_TARGETS, DEFAULT_BOARD_TARGET
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'code_templates')
+RENDER_CACHE_SIZE = 1024 # Combinações (template, placa, parâmetros) já geradas
+
+_env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), undefined=StrictUndefined, autoescape=False, auto_reload=False,
+                   cache_size=-1, trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=True)
+# Todos os templates compilados já aqui: nenhum pedido lê ou compila ficheiros
+_templates = {name: _env.get_template(name) for name in _env.list_templates(extensions=['j2'])}
+_rendered = LRUCache(maxsize=RENDER_CACHE_SIZE)
+
+
+def render(template_name, board=None, **values):
+    """
+    Renders a precompiled template with the given values (hashable: str/int/float/None) and the
+    board target (key of BOARD_TARGETS, exposed to the template as 'board'). The output is
+    memoized on (template, board, values), so repeated parameter sets cost a dict lookup.
+    """
+    key = (template_name, board, tuple(sorted(values.items())))
+    text = _rendered.get(key)
+    if text is None:
+        context = dict(values, board=BOARD_TARGETS[board]) if board else values
+        text = _templates[template_name].render(**context)
+        _rendered.put(key, text)
+    return text
+
+
+def radio_values(params, region, frequency):
+    """Template values shared by every artifact: the radio parameters as they appear in the code."""
+    return {
+        "region": region,
+        "frequency": frequency,
+        "sf": params['spreading_factor'],
+        "bw": params['signal_bandwidth_khz'],
+        "cr": params['_coding_rate_raw'],
+        "sync_word": hex(params['_sync_word_raw']),
+        "tx_power": params['tx_power_dbm'],
+        "preamble": params['preamble_length'],
+    }
+
+
+def render_node_code(params, region, frequency, board=DEFAULT_BOARD_TARGET):
+    """Sensor node (sender) code for a board target."""
+    return render(BOARD_TARGETS[board]["sender_template"], board=board, **radio_values(params, region, frequency),
+                  sf_reason=params.get('spreading_factor_reason', ''), tx_reason=params.get('tx_power_reason', ''),
+                  sync_reason=params.get('sync_word_reason', ''), send_interval_ms=params.get('_send_interval_ms_raw', 10000),
+                  toa_ms=params.get('time_on_air_ms'), duty_cycle_pct=f"{params.get('duty_cycle_pct', 100):g}")
+
+
+def render_receiver_code(params, region, frequency, receiver_type="P2P", board=DEFAULT_BOARD_TARGET):
+    """P2P receiver or simple ESP32 gateway code for a board target."""
+    return render(BOARD_TARGETS[board]["receiver_template"], board=board, receiver_type=receiver_type,
+                  **radio_values(params, region, frequency))
+
+
+def render_bundle_readme(params, region, frequency, board, receiver_type="P2P"):
+    """README.md of a board's folder in the firmware bundle (board, pins and parameters)."""
+    return render('bundle_readme.md.j2', board=board, module_key=board, receiver_type=receiver_type,
+                  send_interval_ms=params.get('_send_interval_ms_raw', 10000), **radio_values(params, region, frequency))
+
+
+def render_instructions(template_name, params, region, frequency):
+    """Markdown setup instructions (gateway guides) from template_name."""
+    return render(template_name, **radio_values(params, region, frequency))
+
+
+def render_cache_stats():
+    """Hit/miss counters of the rendered output cache."""
+    return _rendered.stats()
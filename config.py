@@ -12,6 +12,29 @@ REGION_FREQUENCIES = {
     # Add more regions as needed
 }
 
+# Regional duty-cycle limits for the sub-bands used above (fraction of airtime per hour)
+# Regiões sem limite de duty cycle (US915/AU915 usam dwell time, KR920 usa LBT) ficam com 1.0
+REGION_DUTY_CYCLE = {
+    "EU868": 0.01, # ETSI EN 300 220, sub-band g1 (1%)
+    "US915": 1.0, # FCC Part 15: sem duty cycle, max 400 ms dwell time
+    "AS923": 0.01, # 1% na maioria dos países (ex: Japão com LBT)
+    "AU915": 1.0, # Sem duty cycle, max 400 ms dwell time
+    "KR920": 1.0, # Listen-before-talk em vez de duty cycle
+    "IN865": 1.0, # Sem duty cycle
+    "RU864": 0.01, # 1%
+}
+
+# Uplink channels (125 kHz) usually available to the nodes of each region
+REGION_UPLINK_CHANNELS = {
+    "EU868": 3, # 868.1 / 868.3 / 868.5 MHz (canais obrigatórios)
+    "US915": 8, # Uma sub-banda (ex: FSB2, como no TTN)
+    "AS923": 2, # 923.2 / 923.4 MHz
+    "AU915": 8, # Uma sub-banda
+    "KR920": 3, # 922.1 / 922.3 / 922.5 MHz
+    "IN865": 3, # 865.0625 / 865.4025 / 865.985 MHz
+    "RU864": 2, # 868.9 / 869.1 MHz
+}
+
 # Enhanced Hardware Suggestions with Categories and Links (Examples)
 # Using a more structured approach for easier processing
 HARDWARE_SUGGESTIONS = {
@@ -180,4 +203,131 @@ DEFAULT_LORA_PARAMS = {
     "default_tx_power_us_au": 20,
     "default_tx_power_as": 16,
     "default_tx_power_other": 14,
+    "min_tx_power_dbm": 2, # Potência mínima do SX127x (PA_BOOST)
+    "tx_power_step_db": 2, # Passo de redução de potência no ADR (como no LoRaWAN)
+    "payload_bytes": 20, # Tamanho típico de uma mensagem de sensor
+    "uplink_interval_s": 10, # Intervalo entre envios de cada sensor
+}
+
+# Placas para as quais se gera código (codegen.py, templates em code_templates/). Nova placa = nova entrada (e, se preciso, novo template)
+BOARD_TARGETS = {
+    "generic_sx1276": {
+        "name": "Generic SX1276 board",
+        "target": "Arduino / ESP32 / RP2040 etc. (Check RadioLib support)",
+        "radio_class": "SX1276", # Classe RadioLib do rádio
+        "module_pins": None, # Argumentos de Module(...); None deixa as macros PIN_LORA_* para o utilizador definir
+        # pin_example: vem da entrada heltec_wifi_lora_v2 (ver abaixo)
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    # Uma entrada por chave de LORA_MODULE_DETAILS (bundle de firmware dos módulos do utilizador)
+    "rfm95w": {
+        "name": "HopeRF RFM95W / Adafruit RFM95W",
+        "target": "Any RadioLib-supported MCU wired to an RFM95W (SPI)",
+        "radio_class": "SX1276",
+        "module_pins": None, # Depende da ligação ao microcontrolador
+        "pin_example": "SX1276 radio = new Module(5, 2, 14, RADIOLIB_NC); // ESP32 wired to CS 5, DIO0 2, RST 14",
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "heltec_wifi_lora_v2": {
+        "name": "Heltec WiFi LoRa 32 (V2)",
+        "target": "Heltec WiFi LoRa 32 (V2) - ESP32 Arduino core",
+        "radio_class": "SX1276",
+        "module_pins": "18, 26, 14, 35", # NSS, DIO0, RST, DIO1
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "heltec_wifi_lora_v3": {
+        "name": "Heltec WiFi LoRa 32 (V3)",
+        "target": "Heltec WiFi LoRa 32 (V3) - ESP32-S3 Arduino core",
+        "radio_class": "SX1262",
+        "module_pins": "8, 14, 12, 13", # NSS, DIO1, RST, BUSY
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "ttgo_lora32_v2": {
+        "name": "TTGO LoRa32 V2.1",
+        "target": "TTGO LoRa32 V2.1 (1.6) - ESP32 Arduino core",
+        "radio_class": "SX1276",
+        "module_pins": "18, 26, 23, 33", # NSS, DIO0, RST, DIO1
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "m5stack_lora": {
+        "name": "M5Stack LoRa Module",
+        "target": "M5Stack Core (ESP32) with the LoRa module - check your module version (SX1276 or SX1262)",
+        "radio_class": "SX1276",
+        "module_pins": None, # Os pinos mudam entre versões do módulo
+        "pin_example": "SX1276 radio = new Module(5, 36, 26, RADIOLIB_NC); // M5Stack LoRa868 (CS, IRQ, RST)",
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "dragino_lora_shield": {
+        "name": "Dragino LoRa Shield",
+        "target": "Arduino Uno/Mega with the Dragino LoRa Shield",
+        "radio_class": "SX1276",
+        "module_pins": "10, 2, 9, 6", # NSS, DIO0, RST, DIO1 (jumper do DIO1 no D6)
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "rak4631": {
+        "name": "RAK4631 WisBlock Core",
+        "target": "RAK4631 WisBlock Core - RAKwireless nRF52 Arduino core",
+        "radio_class": "SX1262",
+        "module_pins": "42, 47, 38, 46", # NSS, DIO1, RST, BUSY
+        "setup_lines": ["radio.setDio2AsRfSwitch(true);"], # O DIO2 controla o switch de antena
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "adafruit_feather_lora": {
+        "name": "Adafruit Feather LoRa Boards",
+        "target": "Adafruit Feather RFM95 (32u4 / M0 / ESP32) - check your variant's pins",
+        "radio_class": "SX1276",
+        "module_pins": None, # CS 8 e RST 4 em todas; o DIO0 muda (7 no 32u4, 3 no M0)
+        "pin_example": "SX1276 radio = new Module(8, 3, 4, RADIOLIB_NC); // Feather M0 RFM95 (CS, DIO0, RST)",
+        "sender_template": "radiolib_sender.ino.j2",
+        "receiver_template": "radiolib_receiver.ino.j2",
+    },
+    "rak3172": {
+        "name": "RAK3172 Module / RAK3272 Breakout",
+        "target": "Host MCU (ESP32 by default) driving a RAK3172 over UART with RUI3 AT commands",
+        "at_variant": "rui3", # Módulos STM32WLE5: o host fala com o módulo por comandos AT (modo P2P)
+        "at_baud": 115200,
+        "sender_template": "at_modem_sender.ino.j2",
+        "receiver_template": "at_modem_receiver.ino.j2",
+    },
+    "seeed_lora_e5": {
+        "name": "Seeed Studio LoRa-E5 Module / Grove LoRa-E5",
+        "target": "Host MCU (ESP32 by default) driving a LoRa-E5 over UART with AT commands (TEST mode)",
+        "at_variant": "lora_e5",
+        "at_baud": 9600,
+        "sender_template": "at_modem_sender.ino.j2",
+        "receiver_template": "at_modem_receiver.ino.j2",
+    },
+}
+# O exemplo da placa genérica usa os pinos da Heltec V2 definidos acima, para nunca os contradizer
+BOARD_TARGETS["generic_sx1276"]["pin_example"] = f"SX1276 radio = new Module({BOARD_TARGETS['heltec_wifi_lora_v2']['module_pins']}); // Heltec V2"
+DEFAULT_BOARD_TARGET = "generic_sx1276"
+
+# Limites do assistente de IA (Gemini)
+AI_SETTINGS = {
+    "max_concurrent_requests": 8, # Pedidos ao Gemini em simultâneo; acima disto a API responde 503
+    "request_timeout_s": 120, # Tempo máximo de uma resposta (inclui o streaming)
+    "busy_retry_after_s": 5, # Retry-After enviado com o 503
+    "model_pool_size": 32, # Clientes Gemini (um por chave de API) mantidos em memória
+    "model_pool_ttl_s": 3600,
+    "chat_session_limit": 256, # Conversas guardadas no servidor (LRU)
+    "chat_session_ttl_s": 3600,
+    "chat_history_token_budget": 6000, # Acima disto as mensagens mais antigas dão lugar a um resumo
+    "context_cache_size": 64, # Contextos iniciais (planta + configuração) já lidos, por hash do conteúdo
+    "context_cache_ttl_s": 3600,
+}
+
+# Artefactos gerados guardados em disco (artifact_store.py, em Artifacts/store/)
+ARTIFACT_STORE_SETTINGS = {
+    "max_bytes": 256 * 1024 * 1024, # Acima disto os ficheiros menos usados são apagados
+    "max_age_s": 7 * 24 * 3600, # Ficheiros e namespaces sem uso há mais tempo são apagados
+    "eviction_interval_s": 300, # Intervalo entre limpezas (feitas pela thread de escrita)
+    "queue_size": 1024, # Escritas pendentes; com a fila cheia a cópia em disco é descartada
 }
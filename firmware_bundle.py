@@ -0,0 +1,102 @@
+# firmware_bundle.py
+# Bundle de firmware (zip) com o código de cada módulo do utilizador, gerado em paralelo e escrito diretamente na resposta
+import io
+import json
+import logging
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from codegen import render_node_code, render_receiver_code, render_bundle_readme
+from config import BOARD_TARGETS, DEFAULT_BOARD_TARGET
+
+logger = logging.getLogger(__name__)
+
+MAX_RENDER_WORKERS = 8
+
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+
+def _get_render_executor():
+    """Shared thread pool for rendering bundle files (created on first use)."""
+    global _render_executor
+    if _render_executor is None:
+        with _render_executor_lock:
+            if _render_executor is None:
+                _render_executor = ThreadPoolExecutor(max_workers=MAX_RENDER_WORKERS, thread_name_prefix='firmware-render')
+    return _render_executor
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, non-seekable sink for zipfile: collects the bytes written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def bundle_boards(owned_modules):
+    """Board targets for the bundle: the owned modules that have one (in order), or the generic board."""
+    boards = [key for key in dict.fromkeys(owned_modules or []) if key in BOARD_TARGETS]
+    return boards or [DEFAULT_BOARD_TARGET]
+
+
+def bundle_name(config_json):
+    """Root folder (and zip file) name, e.g. lora_firmware_EU868_sf9."""
+    parameters = config_json.get("parameters", {})
+    return f"lora_firmware_{config_json.get('region', 'EU868')}_sf{parameters.get('spreading_factor', 'x')}"
+
+
+def _bundle_jobs(config_json):
+    """(path inside the zip, render function, args) for every file of the bundle."""
+    params = config_json["parameters"]
+    region, frequency = config_json.get("region", "EU868"), config_json.get("frequency_mhz", 868.0)
+    gateway_setup = config_json.get("gateway_setup") or {}
+    receiver_type = "ESP32 Gateway" if gateway_setup.get("approach") == 'build_esp32' else "P2P"
+    root = bundle_name(config_json)
+    jobs = []
+    for board in bundle_boards(config_json.get("owned_modules")):
+        jobs += [
+            (f"{root}/{board}/README.md", render_bundle_readme, (params, region, frequency, board, receiver_type)),
+            (f"{root}/{board}/{board}_sender/{board}_sender.ino", render_node_code, (params, region, frequency, board)),
+            (f"{root}/{board}/{board}_receiver/{board}_receiver.ino", render_receiver_code, (params, region, frequency, receiver_type, board)),
+        ]
+    return jobs
+
+
+def stream_firmware_bundle(config_json):
+    """
+    Yields a zip archive (bytes chunks) with a folder per board target of config_json's owned
+    modules: sender and receiver sketches with the board's radio class and pins (or its AT
+    command variant) plus a README. Files are rendered concurrently and each one is compressed
+    into the stream as soon as it is ready; nothing touches the disk.
+    """
+    jobs = _bundle_jobs(config_json)
+    executor = _get_render_executor()
+    futures = {executor.submit(render, *args): path for path, render, args in jobs}
+    sink = _ZipStream()
+    try:
+        with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            frontend_params = {k: v for k, v in config_json["parameters"].items() if not k.startswith('_')}
+            archive.writestr(f"{bundle_name(config_json)}/parameters.json", json.dumps(frontend_params, indent=2))
+            yield sink.drain()
+            for future in as_completed(futures):
+                archive.writestr(futures[future], future.result())
+                yield sink.drain()
+        yield sink.drain() # Diretório central do zip
+        logger.info(f"Streamed firmware bundle with {len(jobs)} file(s).")
+    finally:
+        # Cliente desligou a meio: não renderizar o resto
+        for future in futures:
+            future.cancel()
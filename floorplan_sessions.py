@@ -0,0 +1,160 @@
+# floorplan_sessions.py
+# Sessões do editor Pro: a planta fica no servidor e o cliente só envia as células alteradas (delta API)
+import logging
+import secrets
+import threading
+import numpy as np
+from caching import LRUCache
+from lora_logic import (CELL_TYPES, encode_grid, estimate_wall_losses, trace_path_cells, get_gateway_positions, parse_floorplan_data,
+                        _has_grid, _positions_to_array, _get_link_settings, _calculate_lora_params)
+
+logger = logging.getLogger(__name__)
+
+MAX_EDITS_PER_REQUEST = 100_000
+_sessions = LRUCache(maxsize=64, ttl_s=30 * 60) # Sessões abandonadas expiram ao fim de 30 min
+
+
+class RevisionConflict(Exception):
+    """The edits were made on top of a different revision than the session's current one."""
+
+
+class FloorPlanSession:
+    """
+    Server-side copy of one editor floor plan with its gateway->sensor links.
+
+    Keeps an inverted index from each grid cell to the links whose wall loss it can affect
+    (trace_path_cells), so a batch of cell edits only re-traces the links crossing those
+    cells. Adding, moving or removing a device changes the set of links and rebuilds them.
+    """
+
+    def __init__(self, data):
+        self.settings, errors = _get_link_settings(data)
+        floorplan_data, floorplan_errors = parse_floorplan_data(data.get('floorplan_data'))
+        errors.extend(floorplan_errors)
+        grid = floorplan_data.get('grid')
+        if not _has_grid(grid):
+            errors.append("Floor plan grid is missing or invalid.")
+        if errors:
+            raise ValueError("; ".join(errors))
+        self.grid_codes = encode_grid(grid).copy()
+        self.gateways = [{'row': int(p['row']), 'col': int(p['col'])} for p in get_gateway_positions(floorplan_data)]
+        self.sensors = [{'row': int(p['row']), 'col': int(p['col'])} for p in floorplan_data.get('sensors', [])]
+        self.revision = 0
+        self.lock = threading.Lock()
+        self._rebuild_links()
+
+    def _rebuild_links(self):
+        """Traces every link and rebuilds the cell -> link index (sorted by cell for searchsorted)."""
+        sensor_count = len(self.sensors)
+        self.wall_loss_db = np.zeros((len(self.gateways), sensor_count))
+        link_ids, cells = [], []
+        for g, gateway_pos in enumerate(self.gateways):
+            self.wall_loss_db[g] = estimate_wall_losses(self.grid_codes, gateway_pos, self.sensors)
+            sensor_idx, flat_cells = trace_path_cells(self.grid_codes.shape, gateway_pos, self.sensors)
+            link_ids.append(g * sensor_count + sensor_idx)
+            cells.append(flat_cells)
+        link_ids = np.concatenate(link_ids) if link_ids else np.empty(0, dtype=np.int64)
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        order = np.argsort(cells, kind='stable')
+        self._index_cells, self._index_links = cells[order], link_ids[order]
+
+    def _links_crossing(self, flat_cells):
+        """Ids (gateway * sensors + sensor) of the links whose loss depends on any of flat_cells."""
+        lo = np.searchsorted(self._index_cells, flat_cells, side='left')
+        hi = np.searchsorted(self._index_cells, flat_cells, side='right')
+        if not (hi > lo).any():
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate([self._index_links[a:b] for a, b in zip(lo, hi) if b > a]))
+
+    def apply_edits(self, edits, base_revision):
+        """
+        Applies [{'row', 'col', 'type'}] cell edits made on top of base_revision.
+        Returns the number of links re-traced; raises RevisionConflict or ValueError.
+        """
+        if base_revision != self.revision:
+            raise RevisionConflict(f"Session is at revision {self.revision}, edits are based on {base_revision}.")
+        if len(edits) > MAX_EDITS_PER_REQUEST:
+            raise ValueError(f"Too many edits ({len(edits)} > {MAX_EDITS_PER_REQUEST}).")
+        rows, cols = self.grid_codes.shape
+        changed = {}
+        for edit in edits:
+            try:
+                row, col, cell_type = int(edit['row']), int(edit['col']), edit['type']
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Invalid edit: {edit}")
+            if not (0 <= row < rows and 0 <= col < cols) or cell_type not in CELL_TYPES:
+                raise ValueError(f"Invalid edit: {edit}")
+            changed[(row, col)] = CELL_TYPES.index(cell_type) # A última edição de cada célula ganha
+        changed = {pos: code for pos, code in changed.items() if self.grid_codes[pos] != code}
+        self.revision += 1
+        if not changed:
+            return 0
+
+        old_codes = {pos: self.grid_codes[pos] for pos in changed}
+        for pos, code in changed.items():
+            self.grid_codes[pos] = code
+
+        # Dispositivos: a ordem dos sensores segue o editor (removidos saem, novos vão para o fim)
+        device_codes = (CELL_TYPES.index('gateway'), CELL_TYPES.index('sensor'))
+        if any(code in device_codes or old_codes[pos] in device_codes for pos, code in changed.items()):
+            self.gateways = [p for p in self.gateways if self.grid_codes[p['row'], p['col']] == device_codes[0]]
+            self.sensors = [p for p in self.sensors if self.grid_codes[p['row'], p['col']] == device_codes[1]]
+            for (row, col), code in changed.items():
+                if code == device_codes[0] and {'row': row, 'col': col} not in self.gateways:
+                    self.gateways.append({'row': row, 'col': col})
+                elif code == device_codes[1] and {'row': row, 'col': col} not in self.sensors:
+                    self.sensors.append({'row': row, 'col': col})
+            self._rebuild_links()
+            return self.wall_loss_db.size
+
+        # Só paredes: re-traçar apenas as ligações que passam pelas células alteradas
+        links = self._links_crossing(np.array([row * cols + col for row, col in changed]))
+        sensor_count = len(self.sensors)
+        for g, gateway_pos in enumerate(self.gateways):
+            sensor_idx = links[links // sensor_count == g] % sensor_count if sensor_count else links[:0]
+            if sensor_idx.size:
+                self.wall_loss_db[g, sensor_idx] = estimate_wall_losses(self.grid_codes, gateway_pos, _positions_to_array(self.sensors)[sensor_idx])
+        return int(links.size)
+
+    def summary(self):
+        """Current link margins: network SF and worst margin from _calculate_lora_params (on the session's wall losses) and per-sensor margin at that SF."""
+        result = {"revision": self.revision, "gateways": self.gateways, "sensor_count": len(self.sensors),
+                  "spreading_factor": None, "worst_link_margin_db": None, "sensor_margins_db": [], "sensor_gateways": []}
+        if not self.gateways or not self.sensors:
+            return result
+        settings = self.settings
+        floorplan_data = {'grid': self.grid_codes, 'gateways': self.gateways, 'sensors': self.sensors}
+        params, errors, _ = _calculate_lora_params({'floors': settings["floors"]}, floorplan_data, settings["region"],
+                                                   settings["frequency_mhz"], wall_loss_db=self.wall_loss_db)
+        if errors: # Com gateways e sensores só um erro interno do cálculo chega aqui
+            raise RuntimeError("; ".join(errors))
+        result.update({
+            "spreading_factor": params["spreading_factor"],
+            "worst_link_margin_db": params["worst_link_margin_db"],
+            "sensor_margins_db": params["_sensor_margins_raw"],
+            "sensor_gateways": params.get("sensor_gateways", [1] * len(self.sensors)), # Só vem com vários gateways
+        })
+        return result
+
+def create_session(data):
+    """Creates a session from a /generate_config-style payload. Returns (session_id, summary)."""
+    session = FloorPlanSession(data)
+    session_id = secrets.token_urlsafe(16)
+    _sessions.put(session_id, session)
+    logger.info(f"Created floor plan session {session_id[:6]}... ({session.grid_codes.shape[0]}x{session.grid_codes.shape[1]}, {len(session.sensors)} sensor(s)).")
+    return session_id, session.summary()
+
+
+def apply_session_edits(session_id, edits, base_revision):
+    """
+    Applies cell edits to a session. Returns the summary plus 'links_updated', or None when the
+    session doesn't exist (expired), so the client can start a new one with the full plan.
+    """
+    session = _sessions.get(session_id)
+    if session is None:
+        return None
+    with session.lock:
+        links_updated = session.apply_edits(edits, base_revision)
+        result = session.summary()
+    result["links_updated"] = links_updated
+    return result
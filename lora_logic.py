@@ -3,8 +3,19 @@ import logging
 import math
 import os
 import json #for potential future use, though not strictly needed now
+import base64
+import binascii
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 # Import new module details from config
-from config import REGION_FREQUENCIES, HARDWARE_SUGGESTIONS, DEFAULT_LORA_PARAMS, LORA_MODULE_DETAILS
+from caching import LRUCache, canonical_hash
+from artifact_store import artifact_store
+from codegen import render_node_code, render_receiver_code, render_instructions
+from config import REGION_FREQUENCIES, REGION_DUTY_CYCLE, HARDWARE_SUGGESTIONS, DEFAULT_LORA_PARAMS, LORA_MODULE_DETAILS, DEFAULT_BOARD_TARGET
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -23,53 +34,29 @@ WALL_LOSS_DB = {
 # Perda estimada por piso (em dB)
 FLOOR_LOSS_DB = 21 # https://ar5iv.labs.arxiv.org/html/1909.03900 isto é para um chão de concreto
 
-# Define the directory to save artifacts relative to this file's location
-# Ensures it works correctly regardless of where app.py is run from
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-ARTIFACTS_DIR = os.path.join(BASE_DIR, 'Artifacts')
+# Spreading Factors avaliados (do mais rápido para o mais lento)
+SPREADING_FACTORS = tuple(range(7, 13))
+# Margem mínima (dB) para considerar um link fiável
+MIN_SAFE_MARGIN = 5.0
 
-def _ensure_artifacts_dir_exists():
-    """Creates the Artifacts directory if it doesn't exist."""
-    if not os.path.exists(ARTIFACTS_DIR):
-        try:
-            os.makedirs(ARTIFACTS_DIR)
-            logger.info(f"Created artifacts directory: {ARTIFACTS_DIR}")
-        except OSError as e:
-            logger.error(f"Error creating artifacts directory {ARTIFACTS_DIR}: {e}")
-            # Decide how to handle this: maybe return False or raise exception
-            return False
-    return True
-
-def _save_artifact_to_file(artifact):
-    """Saves the content of a generated artifact to a file in the Artifacts directory."""
-    if not _ensure_artifacts_dir_exists():
-        logger.warning("Artifacts directory doesn't exist or couldn't be created. Skipping file save.")
-        return # Don't proceed if directory isn't available
-
-    if not artifact or 'filename' not in artifact or 'content' not in artifact:
-        logger.warning("Attempted to save invalid artifact structure.")
-        return
-
-    filename = artifact['filename']
-    content = artifact['content']
-    # Sanitize filename slightly (replace spaces, ensure valid extension)
-    # You might want more robust sanitization depending on expected inputs
-    filename = filename.replace(" ", "_").lower()
+def _artifact_filename(artifact):
+    """File name of an artifact, sanitized and with the extension of its type."""
+    filename = artifact['filename'].replace(" ", "_").lower()
     if artifact.get('type') == 'code' and not filename.endswith(('.ino', '.cpp', '.c', '.h')):
          filename += '.ino' # Default to .ino for C++ code if no extension
     elif artifact.get('type') == 'instructions' and not filename.endswith('.md'):
          filename += '.md'
+    return filename
 
-    filepath = os.path.join(ARTIFACTS_DIR, filename)
-
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
-        logger.info(f"Successfully saved artifact to: {filepath}")
-    except IOError as e:
-        logger.error(f"Error writing artifact file {filepath}: {e}")
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while saving artifact {filepath}: {e}")
+def _save_artifact_to_file(artifact, namespace):
+    """
+    Queues the content of a generated artifact for the artifact store under namespace (one per
+    request or batch site). The write happens on the store's background thread; see artifact_store.py.
+    """
+    if not artifact or 'filename' not in artifact or 'content' not in artifact:
+        logger.warning("Attempted to save invalid artifact structure.")
+        return
+    artifact_store.save(namespace, _artifact_filename(artifact), artifact['content'])
 
 def get_rx_sensitivity(sf, bw_khz):
     # Valores MUITO aproximados - CONSULTAR DATASHEETS!
@@ -83,6 +70,17 @@ def get_rx_sensitivity(sf, bw_khz):
     logger.debug(f"Calculated Rx Sensitivity for SF{sf}, BW{bw_khz}: {sensitivity:.2f} dBm")
     return sensitivity
 
+def time_on_air_ms(sf, bw_khz, cr_denominator, preamble_length, payload_bytes, explicit_header=True, crc=True):
+    """Semtech LoRa time-on-air (SX127x datasheet / AN1200.13) of one packet, in ms. Accepts scalar or array SF."""
+    sf = np.asarray(sf, dtype=float)
+    t_sym_ms = (2 ** sf) / bw_khz
+    low_dr_optimize = (t_sym_ms > 16).astype(float) # Obrigatório para SF11/SF12 @ 125kHz
+    payload_symbols = 8 + np.maximum(
+        np.ceil((8 * payload_bytes - 4 * sf + 28 + 16 * crc - 20 * (not explicit_header)) / (4 * (sf - 2 * low_dr_optimize))) * cr_denominator,
+        0)
+    toa = (preamble_length + 4.25 + payload_symbols) * t_sym_ms
+    return float(toa) if toa.ndim == 0 else toa
+
 # Função para calcular distância em linha reta na grelha (assumindo 1m por célula)
 def calculate_distance(pos1, pos2):
     if not pos1 or not pos2: return 0
@@ -90,39 +88,307 @@ def calculate_distance(pos1, pos2):
     # Multiplica por 1 (assumindo 1m por célula)
     return math.sqrt((pos1['row'] - pos2['row'])**2 + (pos1['col'] - pos2['col'])**2) * 1.0
 
-# TODO Função SIMPLES para estimar perda por paredes (conta paredes entre pontos)
-# NOTA: Isto é uma GRANDE simplificação. Mas não tá facil fazer isto.
-def estimate_wall_loss(grid, pos1, pos2):
-    if not grid or not pos1 or not pos2: return 0
-    loss = 0
+# Tipos de célula da planta, codificados como uint8 (o código é o índice no tuplo)
+CELL_TYPES = ('empty', 'drywall', 'brick', 'concrete', 'gateway', 'sensor')
+_CELL_CODES = {cell_type: code for code, cell_type in enumerate(CELL_TYPES)}
+# Perda (dB) de cada código de célula - tipos desconhecidos contam como 'empty'
+CELL_LOSS_DB = np.array([WALL_LOSS_DB.get(cell_type, 0) for cell_type in CELL_TYPES], dtype=float)
+# Limite de células (caminhos x passos) processadas de uma vez, para limitar a memória
+_TRACE_CHUNK_CELLS = 1_000_000
+
+def encode_grid(grid):
+    """Encodes the floor plan grid (list of rows of type strings) into a compact uint8 array of CELL_TYPES codes."""
+    if isinstance(grid, np.ndarray):
+        return grid.astype(np.uint8, copy=False)
     rows = len(grid)
     cols = len(grid[0]) if rows > 0 else 0
-    r1, c1 = pos1['row'], pos1['col']
-    r2, c2 = pos2['row'], pos2['col']
-
-    # Simplificação: Contar paredes nas linhas e colunas entre os pontos
-    # Contar paredes horizontais atravessadas
-    for r in range(min(r1, r2), max(r1, r2) + 1):
-         # Verifica a parede na coluna do ponto de partida (aproximação)
-         if 0 <= r < rows and 0 <= c1 < cols:
-             wall_type = grid[r][c1]
-             if wall_type in WALL_LOSS_DB and wall_type != 'empty':
-                 loss += WALL_LOSS_DB[wall_type] / 2 # Divide por 2 (heurística grosseira)
-
-    # Contar paredes verticais atravessadas
-    for c in range(min(c1, c2), max(c1, c2) + 1):
-         # Verifica a parede na linha do ponto de chegada (aproximação)
-          if 0 <= r2 < rows and 0 <= c < cols:
-             wall_type = grid[r2][c]
-             if wall_type in WALL_LOSS_DB and wall_type != 'empty':
-                 loss += WALL_LOSS_DB[wall_type] / 2 # Divide por 2
-
-    # Remover a perda da própria célula (se for parede) - já contado acima
-    # Esta lógica é muito básica e pode ser melhorada (ex: Bresenham's line algorithm)
+    codes = np.fromiter((_CELL_CODES.get(cell, 0) for row in grid for cell in row), dtype=np.uint8, count=rows * cols)
+    return codes.reshape(rows, cols)
+
+# --- Codificação compacta da planta ---
+# grid = {"encoding": FLOORPLAN_ENCODING, "types": [...], "cells": base64 de pares de bytes (índice em types, repetições 1-255)},
+# percorrendo a grelha linha a linha; rows/cols vêm do próprio floorplan_data
+FLOORPLAN_ENCODING = 'rle-u8-b64'
+MAX_FLOORPLAN_CELLS = 4_000_000 # Uma grelha comprimida pequena pode expandir muito: limite antes de descomprimir
+
+def encode_floorplan_grid(grid):
+    """Encodes a grid (list of rows of type strings or CELL_TYPES codes) in the compact run-length form."""
+    flat = encode_grid(grid).ravel()
+    if flat.size:
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(flat)) + 1))
+        lengths = np.diff(np.append(starts, flat.size))
+        pieces = -(-lengths // 255) # Corridas com mais de 255 células são partidas
+        runs = np.full(int(pieces.sum()), 255, dtype=np.int64)
+        runs[np.cumsum(pieces) - 1] = lengths - 255 * (pieces - 1)
+        pairs = np.stack([np.repeat(flat[starts], pieces), runs], axis=1).astype(np.uint8)
+    else:
+        pairs = np.empty((0, 2), dtype=np.uint8)
+    return {"encoding": FLOORPLAN_ENCODING, "types": list(CELL_TYPES), "cells": base64.b64encode(pairs.tobytes()).decode('ascii')}
+
+def decode_floorplan_grid(encoded, rows, cols):
+    """Decodes the compact grid into a (rows, cols) uint8 array of CELL_TYPES codes. Raises ValueError if invalid."""
+    if encoded.get('encoding') != FLOORPLAN_ENCODING:
+        raise ValueError(f"Unsupported floor plan encoding: {encoded.get('encoding')}")
+    rows, cols = int(rows), int(cols)
+    if rows < 0 or cols < 0 or rows * cols > MAX_FLOORPLAN_CELLS:
+        raise ValueError(f"Invalid floor plan size {rows}x{cols} (max {MAX_FLOORPLAN_CELLS} cells).")
+    types = encoded.get('types') or []
+    unknown = [cell_type for cell_type in types if cell_type not in _CELL_CODES]
+    if unknown:
+        raise ValueError(f"Unknown cell types in floor plan: {unknown}")
+    type_codes = np.array([_CELL_CODES[cell_type] for cell_type in types], dtype=np.uint8)
+    try:
+        raw = base64.b64decode(encoded.get('cells', ''), validate=True)
+    except (binascii.Error, TypeError) as e:
+        raise ValueError(f"Invalid floor plan cells: {e}")
+    if len(raw) % 2:
+        raise ValueError("Invalid floor plan cells: odd number of bytes.")
+    pairs = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 2)
+    if (pairs[:, 0] >= len(types)).any():
+        raise ValueError("Invalid floor plan cells: type index outside the type table.")
+    if int(pairs[:, 1].sum(dtype=np.int64)) != rows * cols:
+        raise ValueError(f"Floor plan cells don't match its size {rows}x{cols}.")
+    return np.repeat(type_codes[pairs[:, 0]], pairs[:, 1]).reshape(rows, cols)
+
+def _has_grid(grid):
+    """True if the floor plan has a non-empty grid (list of rows or decoded array)."""
+    return grid is not None and len(grid) > 0
+
+def compact_floorplan(floorplan_data):
+    """Copy of floorplan_data with the grid in the compact encoding and its rows/cols (needed to decode it), for JSON responses."""
+    if not isinstance(floorplan_data, dict) or not _has_grid(floorplan_data.get('grid')) or isinstance(floorplan_data['grid'], dict):
+        return floorplan_data
+    grid_codes = encode_grid(floorplan_data['grid'])
+    return {**floorplan_data, 'rows': grid_codes.shape[0], 'cols': grid_codes.shape[1], 'grid': encode_floorplan_grid(grid_codes)}
+
+def _positions_to_array(positions):
+    """Converts a list of {'row', 'col'} dicts (or an (N, 2) array) into an (N, 2) int array."""
+    if isinstance(positions, np.ndarray):
+        return positions.astype(np.int64, copy=False).reshape(-1, 2)
+    return np.array([(p['row'], p['col']) for p in positions], dtype=np.int64).reshape(-1, 2)
+
+def _lookup_cells(grid_codes, rr, cc, rows, cols):
+    """Looks up grid codes at (rr, cc); cells outside the grid count as 'empty'."""
+    inside = (rr >= 0) & (rr < rows) & (cc >= 0) & (cc < cols)
+    codes = grid_codes[np.clip(rr, 0, rows - 1), np.clip(cc, 0, cols - 1)]
+    return np.where(inside, codes, _CELL_CODES['empty']).astype(np.uint8, copy=False)
+
+# Ordem canónica dos passos ao longo de um eixo: round(2**32 / razão de ouro), "Fibonacci hashing"
+_STEP_ORDER_MULTIPLIER = 2654435769
+
+def _step_keys(steps):
+    """
+    Canonical order of the steps along an axis (step i goes from coordinate i to i + 1): a fixed
+    permutation of the integers (Fibonacci hashing), which spreads nearby steps evenly.
+    """
+    return (np.asarray(steps, dtype=np.int64) * _STEP_ORDER_MULTIPLIER) & 0xFFFFFFFF
+
+def _count_smaller_before(keys):
+    """For each of the (distinct) keys, how many of the keys before it are smaller. O(n log^2 n)."""
+    n = len(keys)
+    counts = np.zeros(n, dtype=np.int64)
+    values = np.argsort(np.argsort(keys, kind='stable'), kind='stable')
+    # Dois valores diferem pela primeira vez num bit: o menor tem lá 0 e o maior 1, com o mesmo prefixo acima
+    for bit in range(int(n).bit_length()):
+        prefix = values >> (bit + 1)
+        order = np.argsort(prefix, kind='stable')
+        high = (values[order] >> bit) & 1
+        zeros_before = np.cumsum(1 - high) - (1 - high)
+        group_starts = np.flatnonzero(np.diff(prefix[order], prepend=-1))
+        zeros_before -= np.repeat(zeros_before[group_starts], np.diff(np.append(group_starts, n)))
+        counts[order] += high * zeros_before
+    return counts
+
+def _axis_step_ranks(origin_coord, lo, hi):
+    """
+    For every offset d in lo..hi (lo <= 0 <= hi) from origin_coord along one axis: how many of
+    the steps between the origin and the step into d come before that step in the canonical
+    order (_step_keys). Returns (ranks indexed by d - lo, lo).
+    """
+    after = _count_smaller_before(_step_keys(origin_coord + np.arange(hi)))
+    before = _count_smaller_before(_step_keys(origin_coord - 1 - np.arange(-lo)))
+    return np.concatenate([before[::-1], [0], after]), lo
+
+def _predecessor_offsets(dr, dc, row_step_ranks, col_step_ranks):
+    """
+    Returns the offset (relative to the origin) of the cell one step back towards the origin on
+    the line from the origin to the cell at (dr, dc) (see _trace_paths), given the
+    _axis_step_ranks of the origin along rows and columns. The line to a cell's predecessor
+    is the line to the cell without its last step, so the predecessors of all cells form a
+    tree rooted at the origin.
+    """
+    (row_ranks, row_lo), (col_ranks, col_lo) = row_step_ranks, col_step_ranks
+    col_major = np.abs(dc) >= np.abs(dr)
+    # O último passo é diagonal se estiver entre os |menor| primeiros da ordem canónica
+    rank = np.where(col_major, col_ranks[dc - col_lo], row_ranks[dr - row_lo])
+    diagonal = rank < np.where(col_major, np.abs(dr), np.abs(dc))
+    return dr - np.sign(dr) * np.where(col_major, diagonal, 1), dc - np.sign(dc) * np.where(col_major, 1, diagonal)
+
+def _trace_paths(origin, targets, max_steps):
+    """
+    Cells (rows, cols arrays of shape (N, max_steps)) of the line of sight from each target
+    (column 0) back to origin.
+
+    The line moves one cell per step along its major axis, and |minor| of its steps are
+    diagonal: those that come first in the canonical order (_step_keys) among the steps it
+    spans. The order only depends on where a step is, not on the origin, so the line from A to
+    B visits the same cells as the line from B to A, and any part of a line is the line
+    between its ends (consistent digital segments, at most a couple of cells off the true
+    line).
+    """
+    r0, c0 = origin['row'], origin['col']
+    dr, dc = targets[:, 0] - r0, targets[:, 1] - c0
+    col_major = (np.abs(dc) >= np.abs(dr))[:, np.newaxis]
+    major, minor = np.where(col_major[:, 0], dc, dr), np.where(col_major[:, 0], dr, dc)
+    length, diagonals = np.abs(major)[:, np.newaxis], np.abs(minor)[:, np.newaxis]
+    # Passos ao longo do eixo maior, da origem para fora (os que passam do fim ficam no fim da ordem)
+    outward = np.arange(max_steps - 1)
+    steps = np.where(col_major, c0, r0) + np.where(major[:, np.newaxis] >= 0, outward, -1 - outward)
+    keys = np.where(outward < length, _step_keys(steps), 1 << 32)
+    threshold = np.take_along_axis(np.sort(keys, axis=1), np.maximum(diagonals - 1, 0), axis=1) if max_steps > 1 else keys
+    is_diagonal = (keys <= threshold) & (diagonals > 0)
+    minor_offsets = np.concatenate([np.zeros_like(length), np.cumsum(is_diagonal, axis=1)], axis=1)
+
+    # Coluna 0 no alvo; depois de chegar à origem o caminho fica parado nela
+    along = np.maximum(length - np.arange(max_steps), 0)
+    minor_at = np.sign(minor)[:, np.newaxis] * np.take_along_axis(minor_offsets, along, axis=1)
+    major_at = np.sign(major)[:, np.newaxis] * along
+    return r0 + np.where(col_major, minor_at, major_at), c0 + np.where(col_major, major_at, minor_at)
+
+def trace_path_cells(grid_shape, origin, targets):
+    """
+    Returns every grid cell whose contents can change the wall loss from origin to each target:
+    the path cells plus BOTH corner cells of each diagonal step (estimate_wall_losses picks the
+    less obstructive corner, so either may matter). The set only depends on the geometry.
+    Returns (target_indices, flat_cell_indices) pairs as two arrays, without duplicates.
+    """
+    targets = _positions_to_array(targets)
+    if len(targets) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows, cols = grid_shape
+    offsets = targets - (origin['row'], origin['col'])
+    rr, cc = _trace_paths(origin, targets, int(np.max(np.abs(offsets))) + 1)
+    all_r = np.concatenate([rr, rr[:, 1:], rr[:, :-1]], axis=1)
+    all_c = np.concatenate([cc, cc[:, :-1], cc[:, 1:]], axis=1)
+    target_idx = np.broadcast_to(np.arange(len(targets))[:, np.newaxis], all_r.shape)
+    inside = (all_r >= 0) & (all_r < rows) & (all_c >= 0) & (all_c < cols)
+    pairs = np.unique(target_idx[inside] * (rows * cols) + (all_r * cols + all_c)[inside])
+    return pairs // (rows * cols), pairs % (rows * cols)
+
+def estimate_wall_losses(grid_codes, origin, targets):
+    """
+    Ray-traces the line of sight from origin to every target over the encoded grid and
+    returns the wall loss (dB) of each path as an array.
+
+    Each path is walked along a consistent digital line (see _trace_paths), so the
+    loss from A to B is the loss from B to A. On diagonal steps the two corner cells are also
+    checked and the less obstructive one is taken, so signals can't leak through diagonal
+    walls (supercover-style). A contiguous run of the same wall material counts as a single
+    wall crossing with its full WALL_LOSS_DB value, including a run under either end.
+    """
+    targets = _positions_to_array(targets)
+    losses = np.zeros(len(targets), dtype=float)
+    if grid_codes.size == 0 or len(targets) == 0:
+        return losses
+    rows, cols = grid_codes.shape
+    r0, c0 = origin['row'], origin['col']
+    offsets = targets - (r0, c0)
+    # Um caminho fica dentro do retângulo das suas pontas: sem pontas fora da grelha não é preciso verificar limites
+    if (targets.min(initial=0) >= 0 and targets[:, 0].max() < rows and targets[:, 1].max() < cols
+            and 0 <= r0 < rows and 0 <= c0 < cols):
+        flat_codes = grid_codes.ravel()
+        lookup = lambda rr, cc: flat_codes[rr * cols + cc]
+    else:
+        lookup = lambda rr, cc: _lookup_cells(grid_codes, rr, cc, rows, cols)
+    origin_loss = CELL_LOSS_DB[lookup(np.array([r0]), np.array([c0]))[0]]
+
+    # Caminhos agrupados por comprimento (até ao dobro do mais curto de cada bloco), para não traçar passos vazios
+    lengths = np.max(np.abs(offsets), axis=1)
+    order = np.argsort(lengths, kind='stable')
+    sorted_lengths = lengths[order]
+    start = 0
+    while start < len(order):
+        group_end = int(np.searchsorted(sorted_lengths, 2 * sorted_lengths[start] + 1, side='right'))
+        stop = min(group_end, start + max(1, _TRACE_CHUNK_CELLS // (2 * (2 * int(sorted_lengths[start]) + 2))))
+        idx = order[start:stop]
+        max_steps = int(sorted_lengths[stop - 1]) + 1
+        rr, cc = _trace_paths(origin, targets[idx], max_steps)
+        cell_codes = lookup(rr, cc)
+        # Células de canto nos passos diagonais (a de menor perda)
+        corner_a = lookup(rr[:, 1:], cc[:, :-1])
+        corner_b = lookup(rr[:, :-1], cc[:, 1:])
+        corner_codes = np.where(CELL_LOSS_DB[corner_a] <= CELL_LOSS_DB[corner_b], corner_a, corner_b)
+        diagonal = (rr[:, 1:] != rr[:, :-1]) & (cc[:, 1:] != cc[:, :-1])
+        corner_codes = np.where(diagonal, corner_codes, cell_codes[:, 1:])
+
+        # Sequência célula, canto, célula, canto, ... do alvo até à origem.
+        # Uma célula conta como parede atravessada quando difere da anterior (mais perto da origem); a corrida da origem conta à parte.
+        sequence = np.empty((cell_codes.shape[0], 2 * max_steps - 1), dtype=np.uint8)
+        sequence[:, 0::2] = cell_codes
+        sequence[:, 1::2] = corner_codes
+        entering = sequence[:, :-1] != sequence[:, 1:]
+        losses[idx] = np.where(entering, CELL_LOSS_DB[sequence[:, :-1]], 0.0).sum(axis=1) + origin_loss
+        start = stop
+
+    return losses
+
+def estimate_wall_loss(grid, pos1, pos2):
+    """Estimates the wall loss (dB) on the line of sight between two grid positions."""
+    if grid is None or len(grid) == 0 or not pos1 or not pos2: return 0
+    loss = float(estimate_wall_losses(encode_grid(grid), pos1, [pos2])[0])
     logger.debug(f"Estimated wall loss between {pos1} and {pos2}: {loss:.1f} dB")
     return loss
 
 
+def sweep_wall_losses(grid_codes, origin):
+    """
+    Computes the wall loss (dB) from origin to EVERY cell of the grid in one shared sweep.
+
+    Instead of tracing a separate ray per cell, cells are processed ring by ring outward
+    from the origin (Chebyshev distance). Each cell inherits the accumulated loss of its
+    predecessor - the cell one step back towards the origin on its line of sight, always on
+    the previous ring - plus the cost of that single step. Paths, corner and wall-run rules
+    are the same as estimate_wall_losses(), so both give identical losses.
+    """
+    rows, cols = grid_codes.shape
+    losses = np.zeros((rows, cols), dtype=float)
+    if grid_codes.size == 0:
+        return losses
+    r0, c0 = origin['row'], origin['col']
+
+    dr, dc = np.meshgrid(np.arange(rows) - r0, np.arange(cols) - c0, indexing='ij')
+    ring = np.maximum(np.abs(dr), np.abs(dc))
+    pred_dr, pred_dc = _predecessor_offsets(dr, dc, _axis_step_ranks(r0, min(-r0, 0), max(rows - 1 - r0, 0)),
+                                            _axis_step_ranks(c0, min(-c0, 0), max(cols - 1 - c0, 0)))
+    pred_r = np.clip(r0 + pred_dr, 0, rows - 1)
+    pred_c = np.clip(c0 + pred_dc, 0, cols - 1)
+    cell_r = np.broadcast_to(np.arange(rows)[:, np.newaxis], (rows, cols))
+    cell_c = np.broadcast_to(np.arange(cols)[np.newaxis, :], (rows, cols))
+
+    # Custo de cada passo predecessor -> célula (independente dos outros passos)
+    pred_codes = grid_codes[pred_r, pred_c]
+    corner_a = grid_codes[pred_r, cell_c]
+    corner_b = grid_codes[cell_r, pred_c]
+    corner_codes = np.where(CELL_LOSS_DB[corner_a] <= CELL_LOSS_DB[corner_b], corner_a, corner_b)
+    diagonal = (pred_r != cell_r) & (pred_c != cell_c)
+    corner_codes = np.where(diagonal, corner_codes, pred_codes)
+    step_loss = (np.where(corner_codes != pred_codes, CELL_LOSS_DB[corner_codes], 0.0)
+                 + np.where(grid_codes != corner_codes, CELL_LOSS_DB[grid_codes], 0.0))
+
+    # Acumular anel a anel (o predecessor está sempre no anel anterior), a partir da corrida de parede da origem
+    flat_losses = losses.ravel()
+    flat_step = step_loss.ravel()
+    flat_pred = (pred_r * cols + pred_c).ravel()
+    order = np.argsort(ring.ravel(), kind='stable')
+    ring_sizes = np.bincount(ring.ravel())
+    bounds = np.cumsum(ring_sizes)
+    if 0 <= r0 < rows and 0 <= c0 < cols:
+        losses[r0, c0] = CELL_LOSS_DB[grid_codes[r0, c0]]
+    for ring_idx in range(1, len(ring_sizes)):
+        cells = order[bounds[ring_idx - 1]:bounds[ring_idx]]
+        flat_losses[cells] = flat_losses[flat_pred[cells]] + flat_step[cells]
+    return losses
+
 def estimate_ple(environment_data):
     # Lógica inicial para estimar o Path Loss Exponent (PLE)
     # Refinar esta lógica com base em mais pesquisa ou dados empíricos
@@ -158,8 +424,91 @@ def estimate_ple(environment_data):
     logger.debug(f"Estimated PLE based on {environment_data}: {estimated_ple:.2f}")
     return estimated_ple
 
-def _calculate_lora_params(environment_data, floorplan_data, region, frequency):
-    """Calculates recommended LoRa parameters based on environment AND floor plan."""
+def _get_regional_tx_power(region):
+    """Returns the default Tx power (dBm) for a region."""
+    if region in ["EU868", "RU864", "IN865"]: return DEFAULT_LORA_PARAMS['default_tx_power_eu']
+    if region in ["US915", "AU915"]: return DEFAULT_LORA_PARAMS['default_tx_power_us_au']
+    if region == "AS923": return DEFAULT_LORA_PARAMS['default_tx_power_as']
+    return DEFAULT_LORA_PARAMS['default_tx_power_other']
+
+def get_gateway_positions(floorplan_data):
+    """Returns the gateway positions of a floor plan: the 'gateways' list plus the legacy single 'gateway'."""
+    positions = list(floorplan_data.get('gateways') or [])
+    gateway = floorplan_data.get('gateway')
+    if gateway and gateway not in positions:
+        positions.insert(0, gateway)
+    return positions
+
+def _compute_link_budget(grid_codes, gateway_positions, sensor_positions, floors, frequency_mhz, bw_khz, tx_power_dbm, antenna_gain_dbi, wall_loss_db=None):
+    """
+    Computes the link budget for all sensors x all Spreading Factors in a single pass.
+    grid_codes is the floor plan encoded with encode_grid().
+    Distance, FSPL and wall/floor loss don't depend on the SF, so they are computed once
+    per sensor; only the receiver sensitivity varies along the SF axis.
+    With several gateways, each sensor is assigned to the one with the lowest path loss
+    ("gateway_index").
+    Returns a dict of NumPy arrays (per-sensor arrays have shape (N,), margins (len(SPREADING_FACTORS), N)).
+    """
+    sensors = _positions_to_array(sensor_positions)
+    gateways = _positions_to_array(gateway_positions)
+
+    distances_m = np.hypot(sensors[np.newaxis, :, 0] - gateways[:, 0:1], sensors[np.newaxis, :, 1] - gateways[:, 1:2]) * 1.0 # 1m por célula
+    distances_m = np.maximum(distances_m, REFERENCE_DISTANCE_M) # Mínimo 1m para cálculo de perda
+
+    # FSPL com PLE=2 relativo a PL0 (Friis @ REFERENCE_DISTANCE_M)
+    pl0_db = 20 * math.log10(REFERENCE_DISTANCE_M) + 20 * math.log10(frequency_mhz) + 32.44
+    fspl_db = pl0_db + 10 * 2.0 * np.log10(distances_m / REFERENCE_DISTANCE_M)
+
+    if wall_loss_db is None: # Quem já as tem (ex: sessões do editor) passa as perdas (gateway x sensor) calculadas
+        wall_loss_db = np.stack([estimate_wall_losses(grid_codes, gateway_pos, sensors) for gateway_pos in gateway_positions])
+    floor_loss_db = (floors - 1) * FLOOR_LOSS_DB # Simplista: perda por cada piso adicional
+
+    # Cada sensor fica com o gateway de menor perda
+    gateway_index = (fspl_db + wall_loss_db).argmin(axis=0)
+    sensor_idx = np.arange(len(sensors))
+    distances_m = distances_m[gateway_index, sensor_idx]
+    fspl_db = fspl_db[gateway_index, sensor_idx]
+    wall_loss_db = wall_loss_db[gateway_index, sensor_idx]
+
+    path_loss_db = fspl_db + wall_loss_db + floor_loss_db
+    prx_dbm = tx_power_dbm + antenna_gain_dbi - path_loss_db
+
+    sensitivities_dbm = np.array([get_rx_sensitivity(sf, bw_khz) for sf in SPREADING_FACTORS])
+    margins_db = prx_dbm[np.newaxis, :] - sensitivities_dbm[:, np.newaxis]
+
+    return {
+        "pl0_db": pl0_db,
+        "gateway_index": gateway_index,
+        "distance_m": distances_m,
+        "fspl_db": fspl_db,
+        "wall_loss_db": wall_loss_db,
+        "floor_loss_db": floor_loss_db,
+        "path_loss_db": path_loss_db,
+        "prx_dbm": prx_dbm,
+        "sensitivity_dbm": sensitivities_dbm,
+        "margin_db": margins_db,
+    }
+
+def _assign_adaptive_rates(margins_db, tx_power_dbm):
+    """
+    ADR-style per-sensor assignment from the (SF x sensor) margin matrix: each sensor gets the
+    lowest SF with margin >= MIN_SAFE_MARGIN, then its remaining excess margin is traded for
+    lower TX power in tx_power_step_db steps (down to min_tx_power_dbm). Sensors with no viable
+    SF stay on the highest SF at full power. Returns (sf_indices, tx_powers_dbm, margins_db).
+    """
+    viable = margins_db >= MIN_SAFE_MARGIN
+    sf_indices = np.where(viable.any(axis=0), viable.argmax(axis=0), len(SPREADING_FACTORS) - 1)
+    sensor_margins = margins_db[sf_indices, np.arange(margins_db.shape[1])]
+    step_db = DEFAULT_LORA_PARAMS['tx_power_step_db']
+    max_reduction_db = max(tx_power_dbm - DEFAULT_LORA_PARAMS['min_tx_power_dbm'], 0)
+    reductions_db = np.clip(np.floor((sensor_margins - MIN_SAFE_MARGIN) / step_db) * step_db, 0, max_reduction_db)
+    return sf_indices, tx_power_dbm - reductions_db, sensor_margins - reductions_db
+
+def _calculate_lora_params(environment_data, floorplan_data, region, frequency, payload_bytes=DEFAULT_LORA_PARAMS['payload_bytes'], wall_loss_db=None):
+    """
+    Calculates recommended LoRa parameters based on environment AND floor plan.
+    wall_loss_db (gateway x sensor), when given, replaces the wall tracing (see _compute_link_budget).
+    """
     params = {}
     errors = []
     reasoning = [] # Renomeado para clareza
@@ -171,10 +520,10 @@ def _calculate_lora_params(environment_data, floorplan_data, region, frequency):
 
         # Dados da Planta
         grid = floorplan_data.get('grid')
-        gateway_pos = floorplan_data.get('gateway')
+        gateway_positions = get_gateway_positions(floorplan_data)
         sensor_positions = floorplan_data.get('sensors', [])
 
-        if not grid or not gateway_pos:
+        if not _has_grid(grid) or not gateway_positions:
             errors.append("Floor plan data (grid or gateway position) is missing or invalid. Using basic estimation.")
             # --- Populate FULL default params ---
             params = {
@@ -222,92 +571,76 @@ def _calculate_lora_params(environment_data, floorplan_data, region, frequency):
         preamble_length = DEFAULT_LORA_PARAMS['preamble_length']
         sync_word_raw = DEFAULT_LORA_PARAMS['private_sync_word']
         sync_word_hex = hex(sync_word_raw)
-        tx_power_dbm = DEFAULT_LORA_PARAMS['default_tx_power_other'] # Obter Tx Power baseado na região
-        if region in ["EU868", "RU864", "IN865"]: tx_power_dbm = DEFAULT_LORA_PARAMS['default_tx_power_eu']
-        elif region in ["US915", "AU915"]: tx_power_dbm = DEFAULT_LORA_PARAMS['default_tx_power_us_au']
-        elif region == "AS923": tx_power_dbm = DEFAULT_LORA_PARAMS['default_tx_power_as']
+        tx_power_dbm = _get_regional_tx_power(region) # Obter Tx Power baseado na região
 
         gt_dbi = DEFAULT_ANTENNA_GAIN_DBI
         gr_dbi = DEFAULT_ANTENNA_GAIN_DBI
         frequency_mhz = frequency
-        frequency_hz = frequency_mhz * 1_000_000
 
         reasoning.append(f"Initial Params: Region={region}, Freq={frequency_mhz}MHz, BW={bw_khz}kHz, TxPwr={tx_power_dbm}dBm, AntGain={gt_dbi+gr_dbi}dBi")
-        reasoning.append(f"Floor Plan: {len(grid)}x{len(grid[0]) if grid else 0} grid, Gateway @ {gateway_pos}, {len(sensor_positions)} Sensor(s)")
-
-        # Calcular PL0 (Path Loss a 1 metro usando Friis)
-        pl0_db = 20 * math.log10(REFERENCE_DISTANCE_M) + 20 * math.log10(frequency_mhz) + 32.44
-        reasoning.append(f"Reference Path Loss (PL0 @ {REFERENCE_DISTANCE_M}m): {pl0_db:.2f} dB")
-
-        best_sf = None
-        worst_margin_overall = 999 # Queremos a *menor* margem positiva
-        selected_margin = -999 # Margem correspondente ao best_sf
-
-        # Iterar pelos Spreading Factors possíveis
-        for sf_attempt in range(7, 13):
-            rx_sensitivity_dbm = get_rx_sensitivity(sf_attempt, bw_khz)
-            worst_margin_for_this_sf = 999 # Pior margem para *este* SF
-            sensor_with_worst_margin = None
-
-            reasoning.append(f"--- Analyzing SF{sf_attempt} (Sensitivity: {rx_sensitivity_dbm:.1f} dBm) ---")
-
-            # Calcular margem para CADA sensor
-            for i, sensor_pos in enumerate(sensor_positions):
-                distance_m = calculate_distance(gateway_pos, sensor_pos)
-                if distance_m < REFERENCE_DISTANCE_M: distance_m = REFERENCE_DISTANCE_M # Mínimo 1m para cálculo de perda
-
-                # Calcular FSPL (Free Space Path Loss)
-                fspl_db = pl0_db + 10 * 2.0 * math.log10(distance_m / REFERENCE_DISTANCE_M) # PLE=2 para FSPL
-
-                # Estimar perda adicional por paredes e pisos
-                wall_loss = estimate_wall_loss(grid, gateway_pos, sensor_pos)
-                floor_loss = (floors - 1) * FLOOR_LOSS_DB # Simplista: perda por cada piso adicional
-                # Poderia adicionar um fator de 'clutter' aqui baseado no environment_data
-
-                total_path_loss_db = fspl_db + wall_loss + floor_loss
-                # Alternativa: Usar um modelo Log-distance com PLE > 2 E adicionar wall_loss
-                # ple_clutter = 2.5 # Exemplo
-                # total_path_loss_db = pl0_db + 10 * ple_clutter * math.log10(distance_m / REFERENCE_DISTANCE_M) + wall_loss + floor_loss
-
-
-                # Calcular Potência Recebida e Margem
-                prx_dbm = tx_power_dbm + gt_dbi + gr_dbi - total_path_loss_db
-                link_margin_db = prx_dbm - rx_sensitivity_dbm
-
-                reasoning.append(f"  Sensor {i+1} @ {sensor_pos}: Dist={distance_m:.1f}m, FSPL={fspl_db:.1f}, WallLoss={wall_loss:.1f}, FloorLoss={floor_loss:.1f} -> PL={total_path_loss_db:.1f}dB -> Prx={prx_dbm:.1f}dBm -> Margin={link_margin_db:.1f}dB")
-
-                # Atualizar a pior margem para este SF
-                if link_margin_db < worst_margin_for_this_sf:
-                    worst_margin_for_this_sf = link_margin_db
-                    sensor_with_worst_margin = i + 1
-
-            reasoning.append(f"  Worst margin for SF{sf_attempt}: {worst_margin_for_this_sf:.1f} dB (Sensor {sensor_with_worst_margin})")
-
-            # Lógica de Seleção: Escolher o SF mais baixo que funciona para TODOS os sensores
-            # Considerar uma margem mínima (ex: 5 dB)
-            MIN_SAFE_MARGIN = 5.0
-            if worst_margin_for_this_sf >= MIN_SAFE_MARGIN:
-                if best_sf is None: # Encontrou o primeiro SF viável (o mais rápido)
-                    best_sf = sf_attempt
-                    selected_margin = worst_margin_for_this_sf
-                    # Não faz break, continua a verificar SFs maiores para ver se dão margens melhores (acho que não é necessário)
-            # Guardar a margem do SF mais alto caso nenhum atinja a margem segura
-            if sf_attempt == 12 and best_sf is None:
-                 best_sf = 12
-                 selected_margin = worst_margin_for_this_sf
+        grid_codes = encode_grid(grid) # Codificada uma única vez por pedido
+        multi_gateway = len(gateway_positions) > 1
+        if multi_gateway:
+            reasoning.append(f"Floor Plan: {grid_codes.shape[0]}x{grid_codes.shape[1]} grid, {len(gateway_positions)} Gateways @ {gateway_positions}, {len(sensor_positions)} Sensor(s) (each assigned to its best gateway)")
+        else:
+            reasoning.append(f"Floor Plan: {grid_codes.shape[0]}x{grid_codes.shape[1]} grid, Gateway @ {gateway_positions[0]}, {len(sensor_positions)} Sensor(s)")
+
+        # Link budget de todos os sensores x todos os SFs de uma só vez
+        budget = _compute_link_budget(grid_codes, gateway_positions, sensor_positions, floors, frequency_mhz, bw_khz, tx_power_dbm, gt_dbi + gr_dbi, wall_loss_db)
+        reasoning.append(f"Reference Path Loss (PL0 @ {REFERENCE_DISTANCE_M}m): {budget['pl0_db']:.2f} dB")
+
+        margins_db = budget["margin_db"]
+        worst_margins = margins_db.min(axis=1) # Pior margem por SF
+        worst_sensors = margins_db.argmin(axis=1) + 1
+
+        # Texto por sensor (igual para todos os SFs, exceto a margem)
+        gateway_labels = [f" (GW {g+1})" if multi_gateway else "" for g in budget['gateway_index']]
+        sensor_notes = [
+            f"  Sensor {i+1} @ {sensor_pos}{gateway_labels[i]}: Dist={budget['distance_m'][i]:.1f}m, FSPL={budget['fspl_db'][i]:.1f}, WallLoss={budget['wall_loss_db'][i]:.1f}, FloorLoss={budget['floor_loss_db']:.1f} -> PL={budget['path_loss_db'][i]:.1f}dB -> Prx={budget['prx_dbm'][i]:.1f}dBm -> Margin="
+            for i, sensor_pos in enumerate(sensor_positions)
+        ]
+        for sf_idx, sf_attempt in enumerate(SPREADING_FACTORS):
+            reasoning.append(f"--- Analyzing SF{sf_attempt} (Sensitivity: {budget['sensitivity_dbm'][sf_idx]:.1f} dBm) ---")
+            reasoning.extend(f"{note}{margin:.1f}dB" for note, margin in zip(sensor_notes, margins_db[sf_idx]))
+            reasoning.append(f"  Worst margin for SF{sf_attempt}: {worst_margins[sf_idx]:.1f} dB (Sensor {worst_sensors[sf_idx]})")
+
+        # Lógica de Seleção: Escolher o SF mais baixo que funciona para TODOS os sensores
+        # Caso nenhum atinja a margem segura, fica o SF mais alto
+        viable = np.flatnonzero(worst_margins >= MIN_SAFE_MARGIN)
+        sf_idx = int(viable[0]) if viable.size else len(SPREADING_FACTORS) - 1
+        best_sf = SPREADING_FACTORS[sf_idx]
+        selected_margin = float(worst_margins[sf_idx])
 
 
         # Finalizar seleção e adicionar notas
-        if best_sf is None: # Caso raro, se o loop não correu ou algo falhou
-            best_sf = 12
-            selected_margin = -999
-            reasoning.append(f"Warning: Could not determine a suitable SF. Defaulting to SF{best_sf}. Check sensor placement and walls.")
-        elif selected_margin < MIN_SAFE_MARGIN:
+        if selected_margin < MIN_SAFE_MARGIN:
              reasoning.append(f"Warning: Selected SF{best_sf} but link margin ({selected_margin:.1f} dB) is below the recommended {MIN_SAFE_MARGIN} dB. Range might be unreliable for the furthest/most obstructed sensor. Consider moving the gateway or using a higher SF if possible.")
         else:
              reasoning.append(f"Selected SF{best_sf} as the lowest SF providing sufficient margin ({selected_margin:.1f} dB >= {MIN_SAFE_MARGIN} dB) for all sensors.")
 
 
+        # ADR: SF e potência por sensor a partir das mesmas margens
+        uplink_interval_s = DEFAULT_LORA_PARAMS['uplink_interval_s']
+        sensor_sf_idx, sensor_tx_dbm, sensor_margins = _assign_adaptive_rates(margins_db, tx_power_dbm)
+        sf_airtimes_ms = time_on_air_ms(np.array(SPREADING_FACTORS), bw_khz, cr_denominator, preamble_length, payload_bytes)
+        single_airtime_ms = sf_airtimes_ms[sf_idx] * len(sensor_positions)
+        adaptive_airtime_ms = sf_airtimes_ms[sensor_sf_idx].sum()
+        # Energia Tx relativa (tempo no ar x potência em mW)
+        single_energy = single_airtime_ms * 10 ** (tx_power_dbm / 10)
+        adaptive_energy = (sf_airtimes_ms[sensor_sf_idx] * 10 ** (sensor_tx_dbm / 10)).sum()
+        adr_summary = {
+            "payload_bytes": payload_bytes,
+            "uplink_interval_s": uplink_interval_s,
+            "single_sf_airtime_ms": round(float(single_airtime_ms), 1), # Soma de um envio de cada sensor
+            "adaptive_airtime_ms": round(float(adaptive_airtime_ms), 1),
+            "airtime_saving_pct": round(float(100 * (1 - adaptive_airtime_ms / single_airtime_ms)), 1),
+            "single_sf_channel_load_pct": round(float(100 * single_airtime_ms / (uplink_interval_s * 1000)), 2),
+            "adaptive_channel_load_pct": round(float(100 * adaptive_airtime_ms / (uplink_interval_s * 1000)), 2),
+            "tx_energy_saving_pct": round(float(100 * (1 - adaptive_energy / single_energy)), 1),
+        }
+        reasoning.append(f"Adaptive (ADR) assignment: {np.bincount(sensor_sf_idx, minlength=len(SPREADING_FACTORS)).tolist()} sensor(s) on SF{SPREADING_FACTORS[0]}-SF{SPREADING_FACTORS[-1]}, TX power reduced on {int((sensor_tx_dbm < tx_power_dbm).sum())} sensor(s).")
+        reasoning.append(f"Adaptive airtime per round ({payload_bytes}B payload): {adaptive_airtime_ms:.1f} ms vs {single_airtime_ms:.1f} ms with SF{best_sf} for all ({adr_summary['airtime_saving_pct']}% less); channel load @ {uplink_interval_s}s interval: {adr_summary['adaptive_channel_load_pct']}% vs {adr_summary['single_sf_channel_load_pct']}%.")
+
         # Guardar os parâmetros finais
         params["frequency_mhz"] = frequency_mhz
         params["spreading_factor"] = best_sf
@@ -319,10 +652,21 @@ def _calculate_lora_params(environment_data, floorplan_data, region, frequency):
         # Adicionar parâmetros informativos
         params["worst_link_margin_db"] = round(selected_margin, 1) # Renomeado
         params["antenna_gain_dbi"] = gt_dbi + gr_dbi
+        if multi_gateway:
+            params["gateway_count"] = len(gateway_positions)
+            params["sensor_gateways"] = [int(g) + 1 for g in budget['gateway_index']] # Gateway (1-based) atribuído a cada sensor
+
+        params["per_sensor"] = [
+            {"sensor": i + 1, "spreading_factor": SPREADING_FACTORS[sensor_sf_idx[i]], "tx_power_dbm": int(sensor_tx_dbm[i]),
+             "margin_db": round(float(sensor_margins[i]), 1), "time_on_air_ms": round(float(sf_airtimes_ms[sensor_sf_idx[i]]), 1)}
+            for i in range(len(sensor_positions))
+        ]
+        params["adr_summary"] = adr_summary
 
         # Adicionar parâmetros 'raw' para geração de código
         params["_coding_rate_raw"] = cr_denominator
         params["_sync_word_raw"] = sync_word_raw
+        params["_sensor_margins_raw"] = [round(float(m), 1) for m in margins_db[sf_idx]] # Margem de cada sensor no SF da rede
 
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding floor plan JSON: {e}", exc_info=True)
@@ -347,119 +691,80 @@ def _calculate_lora_params(environment_data, floorplan_data, region, frequency):
     return params, errors, reasoning
 
 
-def _generate_node_code(params, region, frequency):
-    """Generates the Arduino/ESP32 C++ code for the sensor node."""
-    sf=params['spreading_factor']; bw=params['signal_bandwidth_khz']; cr=params['_coding_rate_raw']; sync_word=params['_sync_word_raw']; tx_power=params['tx_power_dbm']; preamble=params['preamble_length']; sf_reason=params.get('spreading_factor_reason',''); tx_reason=params.get('tx_power_reason',''); sync_reason=params.get('sync_word_reason','')
-    code = f"""// --- LoRa Sender Node Code ---
-// Library: RadioLib (https://github.com/jgromes/RadioLib)
-// Target: Arduino / ESP32 / RP2040 etc. (Check RadioLib support)
-
-#include <RadioLib.h>
-
-// !!! IMPORTANT !!! DEFINE YOUR BOARD'S LORA PIN CONFIGURATION HERE:
-// Example: SX1276 radio = new Module(18, 26, 14, 34); // Heltec V2
-SX1276 radio = new Module(PIN_LORA_SS, PIN_LORA_DIO0, PIN_LORA_RST, PIN_LORA_DIO1);
-
-// --- Configuration Based on Your Inputs ---
-float frequency = {frequency}f;        // Frequency for region: {region}
-int spreadingFactor = {sf};           // Spreading Factor ({sf_reason})
-float bandwidth = {bw}.0f;      // Signal Bandwidth: {bw}kHz
-int codingRate = {cr};            // Coding Rate: 4/{cr}
-byte syncWord = {hex(sync_word)};           // Sync Word ({sync_reason})
-int txPower = {tx_power};             // TX Power: {tx_power}dBm ({tx_reason})
-int preambleLength = {preamble};   // Preamble Length: {preamble}
-
-long packetCounter = 0;
-
-void setup() {{
-  Serial.begin(115200);
-  Serial.println("LoRa Sender Init...");
-  int state = radio.begin(frequency);
-  if (state != RADIOLIB_ERR_NONE) {{ Serial.print("Init Failed: "); Serial.println(state); while (true); }}
-  Serial.println("Applying parameters...");
-  radio.setSpreadingFactor({sf}); radio.setBandwidth({bw}); radio.setCodingRate({cr});
-  radio.setSyncWord({hex(sync_word)}); radio.setOutputPower({tx_power}); radio.setPreambleLength({preamble});
-  Serial.println("Starting loop.");
-}}
-
-void loop() {{
-  packetCounter++;
-  String message = "Hello LoRa! Cnt:" + String(packetCounter);
-  Serial.print("Sending: "); Serial.print(message); Serial.print(" ... ");
-  int state = radio.transmit((byte*)message.c_str(), message.length());
-  if (state == RADIOLIB_ERR_NONE) Serial.println("Success!");
-  else {{ Serial.print("Fail "); Serial.println(state); }}
-  delay(10000);
-}}
-"""
-    return code
-
-def _generate_receiver_code(params, region, frequency, type="P2P"):
+def _get_payload_bytes(data):
+    """Reads the optional 'payload_bytes' input (1-255, LoRa max). Returns (payload_bytes, errors)."""
+    payload_bytes = data.get('payload_bytes')
+    if payload_bytes in (None, ''):
+        return DEFAULT_LORA_PARAMS['payload_bytes'], []
+    try:
+        payload_bytes = int(payload_bytes)
+        if not 1 <= payload_bytes <= 255: raise ValueError
+        return payload_bytes, []
+    except (ValueError, TypeError):
+        return DEFAULT_LORA_PARAMS['payload_bytes'], [f"Invalid payload_bytes: {payload_bytes} (expected 1-255)"]
+
+def _add_airtime_params(params, region, payload_bytes):
+    """Adds time-on-air and the regional duty-cycle limits (max messages/hour, send interval) to params."""
+    toa_ms = time_on_air_ms(
+        params.get('spreading_factor', 7),
+        params.get('signal_bandwidth_khz', DEFAULT_LORA_PARAMS['bandwidth_khz']),
+        params.get('_coding_rate_raw', DEFAULT_LORA_PARAMS['coding_rate_denominator']),
+        params.get('preamble_length', DEFAULT_LORA_PARAMS['preamble_length']),
+        payload_bytes)
+    duty_cycle = REGION_DUTY_CYCLE.get(region, 0.01) # Na dúvida, assumir o limite mais restritivo
+    # Intervalo mínimo para cumprir o duty cycle (ex: 1% -> 99x o tempo no ar em silêncio)
+    send_interval_ms = max(DEFAULT_LORA_PARAMS['uplink_interval_s'] * 1000, math.ceil(toa_ms / duty_cycle))
+    params["payload_bytes"] = payload_bytes
+    params["time_on_air_ms"] = round(toa_ms, 1)
+    params["duty_cycle_pct"] = duty_cycle * 100
+    params["max_messages_per_hour"] = int(3600 * 1000 * duty_cycle // toa_ms)
+    params["send_interval_s"] = round(send_interval_ms / 1000, 1)
+    params["_send_interval_ms_raw"] = send_interval_ms
+    return params
+
+def _generate_node_code(params, region, frequency, board=DEFAULT_BOARD_TARGET):
+    """Generates the Arduino/ESP32 C++ code for the sensor node (template in code_templates/, see codegen.py)."""
+    return render_node_code(params, region, frequency, board)
+
+def _generate_receiver_code(params, region, frequency, type="P2P", board=DEFAULT_BOARD_TARGET):
     """Generates the Arduino/ESP32 C++ code for a P2P Receiver or simple ESP32 Gateway."""
-    sf=params['spreading_factor']; bw=params['signal_bandwidth_khz']; cr=params['_coding_rate_raw']; sync_word=params['_sync_word_raw']; preamble=params['preamble_length']; title_comment=f"LoRa {type} Receiver Code"; init_message=f"LoRa {type} Receiver Initializing..."; log_prefix=f"[LoRa {type}]"; forwarding_todo="// TODO: Forward data (MQTT/HTTP)" if type=="ESP32 Gateway" else ""
-    code = f"""// --- {title_comment} ---
-// Library: RadioLib
-#include <RadioLib.h>
-
-// !!! IMPORTANT !!! DEFINE YOUR BOARD'S LORA PINS HERE
-// Example: SX1276 radio = new Module(8, 14, 12, 13); // Heltec V3
-SX1276 radio = new Module(PIN_LORA_SS, PIN_LORA_DIO0, PIN_LORA_RST, PIN_LORA_DIO1);
-
-// --- Configuration (MUST MATCH SENDER/NODES) ---
-float frequency = {frequency}f; int spreadingFactor = {sf}; float bandwidth = {bw}.0f;
-int codingRate = {cr}; byte syncWord = {hex(sync_word)}; int preambleLength = {preamble};
-
-void setup() {{
-  Serial.begin(115200);
-  Serial.println("{init_message}");
-  int state = radio.begin(frequency);
-  if (state != RADIOLIB_ERR_NONE) {{ Serial.print("Init Failed: "); Serial.println(state); while (true); }}
-  radio.setSpreadingFactor({sf}); radio.setBandwidth({bw}); radio.setCodingRate({cr});
-  radio.setSyncWord({hex(sync_word)}); radio.setPreambleLength({preamble});
-  Serial.println("{log_prefix} Starting receive...");
-}}
-
-void loop() {{
-  byte byteArr[256]; int state = radio.receive(byteArr, 0); int len = radio.getPacketLength();
-  if (state == RADIOLIB_ERR_NONE) {{
-    Serial.print("{log_prefix} RX OK! RSSI:"); Serial.print(radio.getRSSI()); Serial.print(" SNR:"); Serial.print(radio.getSNR()); Serial.print(" Len:"); Serial.print(len);\n    Serial.print(" Data:'"); for(int i=0; i<len; i++) Serial.print((char)byteArr[i]); Serial.println("'");
-    {forwarding_todo}
-  }} else if (state == RADIOLIB_ERR_CRC_MISMATCH) Serial.println("{log_prefix} CRC Error!");
-  // else if (state != RADIOLIB_ERR_RX_TIMEOUT) {{ Serial.print("{log_prefix} RX Fail:"); Serial.println(state); }}
-}}
-"""
-    return code
+    return render_receiver_code(params, region, frequency, type, board)
 
 def _generate_rpi_instructions(params, region, frequency):
     """Generates Markdown instructions for setting up a Raspberry Pi gateway."""
-    param_summary=f"* Freq: {frequency}MHz ({region})\n* SF: SF{params['spreading_factor']} (Nodes)\n* BW: {params['signal_bandwidth_khz']}kHz\n* Sync: {params['sync_word']}"
-    instructions = f"""### Raspberry Pi LoRa Gateway Setup Guide
-
-**Refer to docs for your specific LoRa HAT/module & software.**
-
-**1. Hardware:** Connect HAT/Module & Antenna to Pi. Enable SPI if needed (`sudo raspi-config`).
-
-**2. OS & Updates:** Install Raspberry Pi OS, connect to internet, run `sudo apt update && sudo apt upgrade -y`.
+    return render_instructions('rpi_gateway_setup.md.j2', params, region, frequency)
 
-**3. Gateway Software (Choose ONE):**
-    * **A) ChirpStack Gateway OS:** Flash image, follow ChirpStack docs. (Recommended for LoRaWAN)
-    * **B) Manual Packet Forwarder:** Clone repo, compile, configure `global_conf.json` / `local_conf.json` (freq, EUI, server), run service.
-    * **C) Manufacturer Software:** Follow vendor instructions (e.g., RAK Pi OS).
-
-**4. Config Reminder:** Ensure gateway uses correct region/freq plan & Network Server details.
-
-**5. Node Parameters:**
-{param_summary}
-
-**6. Testing:** Check gateway logs & Network Server UI for node packets.
-"""
-    return instructions
+def parse_floorplan_data(floorplan_raw):
+    """
+    Parses the floor plan payload (JSON string or already-parsed dict). A grid in the compact
+    encoding is decoded into a NumPy array of CELL_TYPES codes. Returns (floorplan_data, errors).
+    """
+    if not floorplan_raw:
+        return {}, []
+    if isinstance(floorplan_raw, dict):
+        floorplan_data = floorplan_raw
+    else:
+        try:
+            floorplan_data = json.loads(floorplan_raw)
+            logger.info("Successfully parsed floor plan data.")
+        except (json.JSONDecodeError, TypeError):
+            logger.error("Failed to parse floor plan JSON string.")
+            return {}, ["Invalid floor plan data format."]
+    if isinstance(floorplan_data, dict) and isinstance(floorplan_data.get('grid'), dict):
+        try:
+            grid = decode_floorplan_grid(floorplan_data['grid'], floorplan_data.get('rows'), floorplan_data.get('cols'))
+        except (ValueError, TypeError) as e:
+            logger.error(f"Failed to decode compact floor plan grid: {e}")
+            return {}, [f"Invalid floor plan data format: {e}"]
+        floorplan_data = {**floorplan_data, 'grid': grid}
+    return floorplan_data, []
 
 # --- Main Function ---
-def generate_recommendations(data):
+def generate_recommendations(data, save_artifacts=True, artifact_namespace=None):
     """
     Processes user input and generates LoRa recommendations, code, or instructions.
-    Saves generated artifacts to the 'Artifacts' directory.
+    Saves generated artifacts to the artifact store under artifact_namespace (a new one per call
+    if not given), unless save_artifacts is False.
     Adds details about user's selected modules.
     """
     recommendations = {
@@ -488,25 +793,24 @@ def generate_recommendations(data):
     }
 
     # --- Parse Floor Plan Data --- << MOVED THIS BLOCK UP
-    floorplan_data = {} # Initialize with an empty dict
-    floorplan_json_string = data.get('floorplan_data')
-    if floorplan_json_string:
-        try:
-            floorplan_data = json.loads(floorplan_json_string)
-            logger.info("Successfully parsed floor plan data.")
-        except json.JSONDecodeError:
-            logger.error("Failed to parse floor plan JSON string.")
-            all_errors.append("Invalid floor plan data format.")
-            # floorplan_data remains empty, _calculate_lora_params should handle this
+    # floorplan_data fica vazio se o parse falhar, _calculate_lora_params trata disso
+    floorplan_data, floorplan_errors = parse_floorplan_data(data.get('floorplan_data'))
+    all_errors.extend(floorplan_errors)
 
     # --- Calculate Parameters (using Environment and Floor Plan) --- << NOW floorplan_data is defined
+    payload_bytes, payload_errors = _get_payload_bytes(data)
+    all_errors.extend(payload_errors)
     params, param_errors, param_reasoning = _calculate_lora_params(
         environment_input_data, # Passa dados do ambiente
         floorplan_data,         # Passa dados da planta parseados (or {} if parsing failed)
         region,
-        frequency
+        frequency,
+        payload_bytes
     )
     all_errors.extend(param_errors)
+    _add_airtime_params(params, region, payload_bytes) # Tempo no ar e limites de duty cycle
+    duty_cycle_note = f"the {params['duty_cycle_pct']:g}% duty cycle of {region}" if params['duty_cycle_pct'] < 100 else f"{region} (no duty-cycle limit)"
+    param_reasoning.append(f"Time on air ({payload_bytes}B payload @ SF{params.get('spreading_factor', 7)}): {params['time_on_air_ms']} ms -> max {params['max_messages_per_hour']} messages/hour under {duty_cycle_note}; node send interval set to {params['send_interval_s']} s.")
 
     # Remover parâmetros internos antes de enviar para o frontend
     frontend_params = {k: v for k, v in params.items() if not k.startswith('_') and k not in ['error_message', 'warning_message']}
@@ -518,7 +822,7 @@ def generate_recommendations(data):
 
     # Manter os parâmetros 'raw' necessários para a geração de código no config_json
     recommendations["config_json"]["parameters"] = params.copy() # Guardar tudo internamente
-    recommendations["config_json"]["floorplan"] = floorplan_data # Guardar planta parseada
+    recommendations["config_json"]["floorplan"] = compact_floorplan(floorplan_data) # Guardar planta parseada (grelha compacta)
 
     # --- Layout Advice (Step 2 related) ---
     sf = params.get('spreading_factor', 7)
@@ -598,7 +902,8 @@ def generate_recommendations(data):
         "title": "Sensor Node Code (Arduino/ESP32 - RadioLib)"
     }
     recommendations["artifacts"]["code_arduino_node"] = node_artifact
-    _save_artifact_to_file(node_artifact) # Save the node code
+    artifact_namespace = artifact_namespace or secrets.token_hex(8)
+    if save_artifacts: _save_artifact_to_file(node_artifact, artifact_namespace) # Save the node code
 
     gateway_artifact = None # Initialize
     if network_type == 'p2p':
@@ -625,21 +930,21 @@ def generate_recommendations(data):
     elif network_type == 'multi_node' and (has_gateway or (gateway_approach and not gateway_approach.startswith('build_'))):
         gateway_artifact = {
             "type": "instructions", "language": "markdown", "filename": "dedicated_gateway_setup.md",
-            "content": f"No specific code is generated for pre-built/dedicated gateways.\n\n1.  **Follow Manufacturer Instructions:** Set up your gateway according to the documentation provided by the vendor.\n2.  **Configure LoRa Parameters:** Ensure the gateway is configured for your region ({region}) and frequency ({frequency} MHz).\n3.  **Network Server Connection:** Connect the gateway to your chosen LoRaWAN Network Server (e.g., The Things Network, ChirpStack) following their guides.\n4.  **Match Node Parameters:** Ensure the Network Server knows device parameters (like Sync Word: {params['sync_word']}) if needed.",
+            "content": render_instructions('dedicated_gateway_setup.md.j2', params, region, frequency),
             "title": "Dedicated Gateway Setup Notes",
             "notes": "Configuration happens via the gateway's interface or the Network Server."
         }
     elif network_type == 'multi_node' and gateway_approach and gateway_approach.startswith('build_') and gateway_approach not in ['build_rpi', 'build_esp32']:
          gateway_artifact = {
             "type": "instructions", "language": "markdown", "filename": "sbc_pc_gateway_setup.md",
-            "content": f"Setting up a gateway on a generic SBC or PC involves installing a packet forwarder and connecting it to a LoRaWAN Network Server.\n\n1.  **Install OS:** Use a suitable Linux distribution.\n2.  **Connect LoRa Module:** Connect your SPI or USB LoRa module.\n3.  **Install Packet Forwarder:** Choose compatible software (e.g., Semtech UDP Packet Forwarder, ChirpStack Gateway Bridge).\n4.  **Configure:** Set region ({region}), frequency ({frequency} MHz), server address, gateway EUI.\n5.  **Run Service:** Start the packet forwarder.\n\nRefer to documentation for your specific LoRa module and chosen packet forwarder software.",
+            "content": render_instructions('sbc_pc_gateway_setup.md.j2', params, region, frequency),
             "title": "SBC/PC Gateway Setup Notes",
             "notes": "Requires manual installation and configuration of packet forwarding software."
         }
 
     if gateway_artifact:
         recommendations["artifacts"]["gateway_receiver"] = gateway_artifact
-        _save_artifact_to_file(gateway_artifact) # Save the gateway/receiver artifact
+        if save_artifacts: _save_artifact_to_file(gateway_artifact, artifact_namespace) # Save the gateway/receiver artifact
 
     # Update config_json with artifact metadata (not full content)
     recommendations["config_json"]["artifacts"] = {
@@ -649,3 +954,549 @@ def generate_recommendations(data):
 
     logger.info("Finished generating recommendations and saving artifacts.")
     return recommendations, all_errors
+
+# --- Recommendation Cache ---
+# Entradas de que generate_recommendations depende (o resto do pedido, ex: api_key, não conta)
+RECOMMENDATION_INPUT_KEYS = ('region', 'size_sqm', 'floors', 'walls_internal', 'wall_type', 'floorplan_data', 'network_type',
+                             'owned_modules', 'has_gateway', 'gateway_approach', 'existing_hw', 'payload_bytes')
+RECOMMENDATION_CACHE_VERSION = 3 # Incrementar quando a lógica muda o resultado (invalida ETags antigos)
+recommendation_cache = LRUCache(maxsize=256, ttl_s=3600)
+
+def recommendation_cache_key(data):
+    """
+    Canonical hash of the RECOMMENDATION_INPUT_KEYS of the request body, exactly as received,
+    used as cache key and ETag. Nothing is parsed, so an ETag match (304) or a cache hit costs
+    one hash; requests that differ only in key order or whitespace share the key, while the
+    same floor plan in another encoding is just a miss.
+    """
+    return canonical_hash({"_version": RECOMMENDATION_CACHE_VERSION, **{key: data[key] for key in RECOMMENDATION_INPUT_KEYS if key in data}})
+
+def generate_recommendations_cached(data, cache_key=None):
+    """
+    generate_recommendations behind recommendation_cache. A hit skips both the computation and
+    the artifact writes. Returns (recommendations, errors, cache_key, hit); the cached objects are
+    shared between callers and must not be modified.
+    """
+    cache_key = cache_key or recommendation_cache_key(data)
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Recommendation cache hit ({cache_key[:12]}).")
+        return cached[0], cached[1], cache_key, True
+    recommendations, errors = generate_recommendations(data, artifact_namespace=cache_key) # Mesmas entradas, mesmos ficheiros
+    recommendation_cache.put(cache_key, (recommendations, errors))
+    return recommendations, errors, cache_key, False
+
+# --- Response Shaping ---
+# O resultado completo fica no cache; cada pedido escolhe o que recebe e o resto é pedido depois pelo id (chave do cache)
+RESPONSE_SECTIONS = ('layout', 'hardware', 'parameters', 'parameter_notes', 'artifacts', 'config_json')
+REASONING_LEVELS = ('full', 'summary') # summary: sem as linhas por sensor e por SF
+LAZY_PARTS = ('per_sensor', 'floorplan', 'hardware_suggestions', 'artifact_content')
+_SENSOR_NOTE_PREFIX = "  Sensor "
+
+def get_response_options(data):
+    """
+    Response options of a /generate_config request: 'sections' (default: all), 'reasoning'
+    ('full' or 'summary') and 'lazy' (heavy parts to leave out). Returns (options, errors).
+    """
+    errors = []
+    sections = data.get('sections', list(RESPONSE_SECTIONS))
+    if not isinstance(sections, list) or any(section not in RESPONSE_SECTIONS for section in sections):
+        errors.append(f"'sections' must be a list of: {', '.join(RESPONSE_SECTIONS)}.")
+        sections = list(RESPONSE_SECTIONS)
+    reasoning = data.get('reasoning', 'full')
+    if reasoning not in REASONING_LEVELS:
+        errors.append(f"'reasoning' must be one of: {', '.join(REASONING_LEVELS)}.")
+        reasoning = 'full'
+    lazy = data.get('lazy', [])
+    if not isinstance(lazy, list) or any(part not in LAZY_PARTS for part in lazy):
+        errors.append(f"'lazy' must be a list of: {', '.join(LAZY_PARTS)}.")
+        lazy = []
+    options = {"sections": [section for section in RESPONSE_SECTIONS if section in sections], "reasoning": reasoning, "lazy": sorted(set(lazy))}
+    return options, errors
+
+def is_default_response(options):
+    """True when the options ask for the full result (the response is the cached dict as is)."""
+    return options["sections"] == list(RESPONSE_SECTIONS) and options["reasoning"] == 'full' and not options["lazy"]
+
+def shape_recommendations(recommendations, options):
+    """
+    Copy of a (cached, shared) recommendations dict with only the requested parts. Returns
+    (shaped, omitted): omitted lists the ids of the parts left out that get_recommendation_part
+    can still return ('parameter_notes', 'per_sensor', 'floorplan', 'hardware_suggestions', 'artifacts/<key>').
+    """
+    sections, lazy = options["sections"], options["lazy"]
+    shaped = {section: recommendations[section] for section in sections if section in recommendations}
+    omitted = []
+
+    notes = recommendations.get("parameter_notes", [])
+    if "parameter_notes" in shaped and options["reasoning"] == 'summary':
+        shaped["parameter_notes"] = [note for note in notes if not note.startswith(_SENSOR_NOTE_PREFIX)]
+        if len(shaped["parameter_notes"]) < len(notes):
+            omitted.append("parameter_notes")
+
+    if "per_sensor" in lazy and "per_sensor" in recommendations.get("parameters", {}):
+        # config_json leva a sua própria cópia dos parâmetros
+        if "parameters" in shaped:
+            shaped["parameters"] = {key: value for key, value in shaped["parameters"].items() if key != "per_sensor"}
+        if "config_json" in shaped and "parameters" in shaped["config_json"]:
+            config_parameters = {key: value for key, value in shaped["config_json"]["parameters"].items() if key != "per_sensor"}
+            shaped["config_json"] = {**shaped["config_json"], "parameters": config_parameters}
+        omitted.append("per_sensor")
+
+    if "config_json" in shaped:
+        for part in ("floorplan", "hardware_suggestions"):
+            if part in lazy and part in shaped["config_json"]:
+                shaped["config_json"] = {key: value for key, value in shaped["config_json"].items() if key != part}
+                omitted.append(part)
+
+    if "artifact_content" in lazy and "artifacts" in shaped:
+        shaped["artifacts"] = {key: {field: value for field, value in artifact.items() if field != "content"}
+                               for key, artifact in shaped["artifacts"].items()}
+        omitted.extend(f"artifacts/{key}" for key in shaped["artifacts"])
+    return shaped, omitted
+
+def get_recommendation_part(recommendations, part):
+    """One heavy part of a recommendations dict by id (see shape_recommendations); None if it doesn't exist."""
+    if part == "parameter_notes":
+        return recommendations.get("parameter_notes")
+    if part == "per_sensor":
+        return recommendations.get("parameters", {}).get("per_sensor")
+    if part in ("floorplan", "hardware_suggestions"):
+        return recommendations.get("config_json", {}).get(part)
+    if part.startswith("artifacts/"):
+        return recommendations.get("artifacts", {}).get(part[len("artifacts/"):])
+    return None
+
+# --- Batch Generation ---
+MAX_BATCH_SITES = 1000
+
+def _generate_batch_site(index, site):
+    """Generates the recommendations of one batch site (runs in a pool worker, never writes artifacts)."""
+    site_id = site.get('site_id', f"site_{index + 1}")
+    try:
+        recommendations, errors = generate_recommendations(site, save_artifacts=False)
+    except Exception as e:
+        logger.error(f"Error generating recommendations for batch site {site_id}: {e}", exc_info=True)
+        recommendations, errors = {}, [f"Internal error: {e}"]
+    return {"index": index, "site_id": site_id, "recommendations": recommendations, "errors": errors}
+
+def generate_recommendations_batch(sites, save_artifacts=False, parallel=True, max_workers=None):
+    """
+    Generates recommendations for many sites (list of /generate_config payloads) on the shared
+    process pool, or on a pool of its own when max_workers differs from the CPU count. Yields
+    one result per site as soon as it finishes (completion order; 'index' points back to the
+    input). Artifacts are only written when save_artifacts is set, after each result is
+    yielded and from this process, to the artifact store under the namespace given in the
+    result ('artifact_namespace': batch-<batch id>-<site_id>).
+    """
+    batch_id = secrets.token_hex(4)
+    futures = []
+    own_pool = None
+    if parallel and len(sites) > 1 and (max_workers or os.cpu_count() or 1) > 1:
+        # O pool partilhado já tem um processo por CPU: só um número diferente precisa de pool próprio
+        own_pool = ProcessPoolExecutor(max_workers=max_workers) if max_workers and max_workers != (os.cpu_count() or 1) else None
+        pool = own_pool or _get_process_pool()
+        futures = [pool.submit(_generate_batch_site, index, site) for index, site in enumerate(sites)]
+        results = (future.result() for future in as_completed(futures))
+    else:
+        results = (_generate_batch_site(index, site) for index, site in enumerate(sites))
+    try:
+        for result in results:
+            if save_artifacts:
+                result["artifact_namespace"] = f"batch-{batch_id}-{result['site_id']}"
+            yield result
+            if save_artifacts:
+                for artifact in result["recommendations"].get("artifacts", {}).values():
+                    _save_artifact_to_file(artifact, result["artifact_namespace"])
+    finally:
+        # Se o consumidor parar a meio (ex: cliente desligou), não calcular os sites em falta
+        for future in futures:
+            future.cancel()
+        if own_pool is not None:
+            own_pool.shutdown(wait=False, cancel_futures=True)
+    logger.info(f"Finished batch of {len(sites)} site(s).")
+
+
+def _get_link_settings(data):
+    """Extracts the radio/environment settings shared by the planning endpoints. Returns (settings, errors)."""
+    errors = []
+    region = data.get('region', 'EU868')
+    frequency = REGION_FREQUENCIES.get(region, 868.0)
+    if region not in REGION_FREQUENCIES: errors.append(f"Invalid region: {region}")
+    try:
+        floors = int(data.get('floors') or 1)
+    except (ValueError, TypeError):
+        floors = 1
+    bw_khz = DEFAULT_LORA_PARAMS['bandwidth_khz']
+    settings = {
+        "region": region,
+        "frequency_mhz": frequency,
+        "floors": floors,
+        "bw_khz": bw_khz,
+        "tx_power_dbm": _get_regional_tx_power(region),
+        "antenna_gain_dbi": DEFAULT_ANTENNA_GAIN_DBI * 2,
+        "pl0_db": 20 * math.log10(REFERENCE_DISTANCE_M) + 20 * math.log10(frequency) + 32.44,
+        "floor_loss_db": (floors - 1) * FLOOR_LOSS_DB,
+        "sensitivity_dbm": np.array([get_rx_sensitivity(sf, bw_khz) for sf in SPREADING_FACTORS]),
+    }
+    return settings, errors
+
+def _free_space_loss(settings, distances_m):
+    """FSPL (PLE=2, relative to PL0) for an array of distances in metres."""
+    distances_m = np.maximum(distances_m, REFERENCE_DISTANCE_M)
+    return settings["pl0_db"] + 10 * 2.0 * np.log10(distances_m / REFERENCE_DISTANCE_M)
+
+# --- Coverage Map ---
+def generate_coverage_map(data):
+    """
+    Computes the best achievable SF and link margin for every cell of the floor plan,
+    relative to the placed gateway. Takes the same payload as generate_recommendations().
+    Returns (coverage, errors).
+    """
+    settings, errors = _get_link_settings(data)
+    region, frequency = settings["region"], settings["frequency_mhz"]
+
+    floorplan_data, floorplan_errors = parse_floorplan_data(data.get('floorplan_data'))
+    errors.extend(floorplan_errors)
+    grid = floorplan_data.get('grid')
+    gateway_positions = get_gateway_positions(floorplan_data)
+    if not _has_grid(grid) or not gateway_positions:
+        errors.append("Floor plan data (grid or gateway position) is missing or invalid.")
+        return {}, errors
+
+    grid_codes = encode_grid(grid)
+    rows, cols = grid_codes.shape
+    # Com vários gateways, cada célula fica com o de menor perda
+    path_loss_db = np.full((rows, cols), np.inf)
+    for gateway_pos in gateway_positions:
+        distances_m = np.hypot(np.arange(rows)[:, np.newaxis] - gateway_pos['row'], np.arange(cols)[np.newaxis, :] - gateway_pos['col'])
+        np.minimum(path_loss_db, _free_space_loss(settings, distances_m) + sweep_wall_losses(grid_codes, gateway_pos), out=path_loss_db)
+    path_loss_db += settings["floor_loss_db"]
+    prx_dbm = settings["tx_power_dbm"] + settings["antenna_gain_dbi"] - path_loss_db
+
+    sensitivities_dbm = settings["sensitivity_dbm"]
+    viable = (prx_dbm[np.newaxis, :, :] - sensitivities_dbm[:, np.newaxis, np.newaxis]) >= MIN_SAFE_MARGIN
+    covered = viable.any(axis=0)
+    # Primeiro SF viável por célula (ou o SF mais alto, para reportar a margem)
+    sf_idx = np.where(covered, viable.argmax(axis=0), len(SPREADING_FACTORS) - 1)
+    margin_db = prx_dbm - sensitivities_dbm[sf_idx]
+    best_sf = np.asarray(SPREADING_FACTORS)[sf_idx]
+
+    sf_cell_counts = {str(sf): int(np.count_nonzero(covered & (best_sf == sf))) for sf in SPREADING_FACTORS}
+    sf_cell_counts["none"] = int(np.count_nonzero(~covered))
+    coverage = {
+        "rows": rows,
+        "cols": cols,
+        "gateway": gateway_positions[0],
+        "gateways": gateway_positions,
+        "region": region,
+        "frequency_mhz": frequency,
+        "min_safe_margin_db": MIN_SAFE_MARGIN,
+        "best_sf": np.where(covered, best_sf, 0).tolist(), # 0 = nenhum SF atinge a margem segura
+        "margin_db": np.round(margin_db, 1).tolist(),
+        "sf_cell_counts": sf_cell_counts,
+    }
+    logger.info(f"Generated coverage map for {rows}x{cols} grid ({sf_cell_counts['none']} uncovered cells).")
+    return coverage, errors
+
+
+# --- Gateway Placement Optimizer ---
+GATEWAY_OBJECTIVES = ('margin', 'sf')
+# Sensores por tarefa enviada ao process pool
+_SWEEP_BATCH_SIZE = 16
+# Abaixo deste número de sensores (a varrer), o pool não compensa o overhead
+_MIN_PARALLEL_SWEEPS = 32
+# Cache LRU das varreduras por sensor (perda por paredes do sensor até todas as células)
+_SWEEP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_sweep_cache = OrderedDict()
+_sweep_cache_bytes = 0
+_sweep_cache_lock = threading.Lock()
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool():
+    """Returns the shared process pool used by the planning searches and batch runs (created on first use)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+            logger.info(f"Started planning process pool with {os.cpu_count() or 1} workers.")
+        return _process_pool
+
+def _clear_sweep_cache():
+    """Empties the sensor sweep cache (benchmarks time cold searches with it)."""
+    global _sweep_cache_bytes
+    with _sweep_cache_lock:
+        _sweep_cache.clear()
+        _sweep_cache_bytes = 0
+
+def _array_digest(array):
+    """Short content hash of a NumPy array (shape + bytes), used as cache key."""
+    digest = hashlib.sha1(str(array.shape).encode())
+    digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def _sweep_batch(grid_codes, origins):
+    """Wall-loss sweeps (float32) from each origin cell to the whole grid. Runs inside the process pool."""
+    return np.stack([sweep_wall_losses(grid_codes, {'row': int(r), 'col': int(c)}).astype(np.float32) for r, c in origins])
+
+def _sensor_loss_rows(grid_codes, sensors, parallel=True):
+    """
+    Per-cell wall-loss rows: rows[i] is the sweep from sensor i to every grid cell.
+    Rows are cached per (grid, sensor cell) so repeated searches on the same plan only
+    sweep new sensors; misses are spread over the process pool.
+    """
+    global _sweep_cache_bytes
+    grid_digest = _array_digest(grid_codes)
+    rows = np.empty((len(sensors),) + grid_codes.shape, dtype=np.float32)
+    missing = []
+    with _sweep_cache_lock:
+        for i, (r, c) in enumerate(sensors):
+            key = (grid_digest, int(r), int(c))
+            if key in _sweep_cache:
+                _sweep_cache.move_to_end(key)
+                rows[i] = _sweep_cache[key]
+            else:
+                missing.append(i)
+    if not missing:
+        return rows
+
+    origins = sensors[missing]
+    batches = [origins[i:i + _SWEEP_BATCH_SIZE] for i in range(0, len(origins), _SWEEP_BATCH_SIZE)]
+    if parallel and len(origins) >= _MIN_PARALLEL_SWEEPS and (os.cpu_count() or 1) > 1:
+        results = list(_get_process_pool().map(_sweep_batch, [grid_codes] * len(batches), batches))
+    else:
+        results = [_sweep_batch(grid_codes, batch) for batch in batches]
+    rows[missing] = np.concatenate(results)
+
+    with _sweep_cache_lock:
+        for i, (r, c) in zip(missing, origins):
+            key = (grid_digest, int(r), int(c))
+            if key not in _sweep_cache:
+                _sweep_cache[key] = rows[i].copy()
+                _sweep_cache_bytes += rows[i].nbytes
+        while _sweep_cache and _sweep_cache_bytes > _SWEEP_CACHE_MAX_BYTES:
+            _, evicted = _sweep_cache.popitem(last=False)
+            _sweep_cache_bytes -= evicted.nbytes
+    return rows
+
+def _required_sf_index(settings, worst_path_loss_db):
+    """Index (in SPREADING_FACTORS) of the lowest SF reaching MIN_SAFE_MARGIN for the given worst path loss(es); len(SPREADING_FACTORS) if none does."""
+    worst_prx = settings["tx_power_dbm"] + settings["antenna_gain_dbi"] - np.asarray(worst_path_loss_db, dtype=float)
+    viable = (worst_prx[..., np.newaxis] - settings["sensitivity_dbm"]) >= MIN_SAFE_MARGIN
+    return np.where(viable.any(axis=-1), viable.argmax(axis=-1), len(SPREADING_FACTORS))
+
+def _gateway_path_losses(settings, grid_codes, gateway_pos, sensors):
+    """Exact path loss (dB) from a gateway cell to every sensor, traced from the gateway side as in _calculate_lora_params."""
+    distances = np.hypot(sensors[:, 0] - gateway_pos['row'], sensors[:, 1] - gateway_pos['col'])
+    return _free_space_loss(settings, distances) + estimate_wall_losses(grid_codes, gateway_pos, sensors) + settings["floor_loss_db"]
+
+def _score_gateway_position(settings, objective, path_loss_row):
+    """Ranking cost (lower is better) and report entry for one gateway position."""
+    worst_idx = int(path_loss_row.argmax())
+    worst_pl = float(path_loss_row[worst_idx])
+    sf_idx = int(_required_sf_index(settings, worst_pl))
+    report_sf_idx = min(sf_idx, len(SPREADING_FACTORS) - 1)
+    margins = settings["tx_power_dbm"] + settings["antenna_gain_dbi"] - path_loss_row - settings["sensitivity_dbm"][report_sf_idx]
+    entry = {
+        "required_sf": SPREADING_FACTORS[sf_idx] if sf_idx < len(SPREADING_FACTORS) else None,
+        "worst_margin_db": round(float(margins[worst_idx]), 1),
+        "mean_margin_db": round(float(margins.mean()), 1),
+        "worst_sensor": worst_idx + 1,
+    }
+    cost = (worst_pl,) if objective == 'margin' else (sf_idx, float(path_loss_row.mean()))
+    return cost, entry
+
+def _free_cells_mask(grid_codes, sensors):
+    """Cells where a gateway can be placed: empty (or current gateway) cells without a sensor."""
+    free = (grid_codes == _CELL_CODES['empty']) | (grid_codes == _CELL_CODES['gateway'])
+    rows, cols = grid_codes.shape
+    inside = (sensors[:, 0] >= 0) & (sensors[:, 0] < rows) & (sensors[:, 1] >= 0) & (sensors[:, 1] < cols)
+    free[sensors[inside, 0], sensors[inside, 1]] = False
+    return free
+
+def optimize_gateway_placement(data, top_n=5, objective='margin', parallel=True):
+    """
+    Searches every empty cell for the gateway position that maximizes the worst-case
+    sensor margin (objective='margin') or minimizes the required network SF, ties broken
+    by the mean path loss (objective='sf'). Returns ({"positions": top N, ...}, errors).
+
+    All candidates are scored at once from one wall-loss sweep per sensor (cached, and
+    spread over a process pool), instead of tracing every candidate/sensor pair. Wall losses
+    are symmetric, so a sensor's sweep gives the same path loss as tracing from the candidate
+    and the ranking is exact; the short list of the best candidates is then traced from the
+    gateway side for the report, so its margins match what /generate_config computes.
+    """
+    settings, errors = _get_link_settings(data)
+    if objective not in GATEWAY_OBJECTIVES:
+        errors.append(f"Invalid objective: {objective} (expected one of {', '.join(GATEWAY_OBJECTIVES)})")
+    try:
+        top_n = max(1, int(top_n))
+    except (ValueError, TypeError):
+        errors.append(f"Invalid top_n: {top_n}")
+    floorplan_data, floorplan_errors = parse_floorplan_data(data.get('floorplan_data'))
+    errors.extend(floorplan_errors)
+    grid = floorplan_data.get('grid')
+    sensor_positions = floorplan_data.get('sensors', [])
+    if not _has_grid(grid) or not sensor_positions:
+        errors.append("Floor plan data (grid or sensor positions) is missing or invalid.")
+    if errors:
+        return {}, errors
+
+    grid_codes = encode_grid(grid)
+    sensors = _positions_to_array(sensor_positions)
+    free = _free_cells_mask(grid_codes, sensors)
+    if not free.any():
+        return {}, ["No empty cell available for the gateway."]
+
+    # Pior perda e perda média de cada célula (como gateway) para todos os sensores
+    loss_rows = _sensor_loss_rows(grid_codes, sensors, parallel=parallel)
+    cell_r, cell_c = np.indices(grid_codes.shape)
+    worst_pl = np.full(grid_codes.shape, -np.inf)
+    total_pl = np.zeros(grid_codes.shape)
+    for (r, c), loss_row in zip(sensors, loss_rows):
+        path_loss = _free_space_loss(settings, np.hypot(cell_r - r, cell_c - c)) + loss_row
+        np.maximum(worst_pl, path_loss, out=worst_pl)
+        total_pl += path_loss
+    worst_pl += settings["floor_loss_db"]
+    mean_pl = total_pl / len(sensors) + settings["floor_loss_db"]
+
+    # As mesmas perdas que o traçado do lado do gateway: só a lista curta é reavaliada para o relatório
+    candidates = np.argwhere(free)
+    cand_worst = worst_pl[free]
+    if objective == 'margin':
+        order = np.argsort(cand_worst, kind='stable')
+    else:
+        order = np.lexsort((mean_pl[free], _required_sf_index(settings, cand_worst)))
+    shortlist = candidates[order[:max(4 * top_n, 32)]]
+
+    scored = []
+    for r, c in shortlist:
+        cost, entry = _score_gateway_position(settings, objective, _gateway_path_losses(settings, grid_codes, {'row': int(r), 'col': int(c)}, sensors))
+        scored.append((cost, int(r), int(c), entry))
+    scored.sort(key=lambda item: item[:3])
+
+    result = {
+        "objective": objective,
+        "positions": [{"rank": rank + 1, "row": r, "col": c, **entry} for rank, (_, r, c, entry) in enumerate(scored[:top_n])],
+        "candidates_total": int(len(candidates)),
+        "candidates_rescored": int(len(shortlist)),
+        "min_safe_margin_db": MIN_SAFE_MARGIN,
+    }
+    gateway_pos = floorplan_data.get('gateway')
+    if gateway_pos:
+        _, entry = _score_gateway_position(settings, objective, _gateway_path_losses(settings, grid_codes, gateway_pos, sensors))
+        result["current_gateway"] = {"row": gateway_pos['row'], "col": gateway_pos['col'], **entry}
+    logger.info(f"Gateway placement search ({objective}): {len(candidates)} candidates, {len(shortlist)} re-scored.")
+    return result, []
+
+# --- Multi-Gateway Planner ---
+def plan_gateways(data, max_sf=12, max_gateways=None, parallel=True):
+    """
+    Finds a small set of gateway positions so that every sensor gets at least
+    MIN_SAFE_MARGIN at SF <= max_sf, and assigns each sensor to its best gateway.
+    Returns (plan, errors).
+
+    Greedy set cover over a sensor x candidate-cell margin matrix built from the cached
+    per-sensor sweeps (see _sensor_loss_rows; wall losses are symmetric, so these are the
+    gateway-side losses of the final scoring): each round picks the cell covering the most
+    still-uncovered sensors (ties broken by their total margin), then picks made redundant
+    by later ones are dropped. Greedy set cover stays within a ln(N) factor of the minimum.
+    """
+    settings, errors = _get_link_settings(data)
+    try:
+        max_sf = int(max_sf)
+        if max_sf not in SPREADING_FACTORS: raise ValueError
+    except (ValueError, TypeError):
+        errors.append(f"Invalid max_sf: {max_sf} (expected {SPREADING_FACTORS[0]}-{SPREADING_FACTORS[-1]})")
+    if max_gateways is not None:
+        try:
+            max_gateways = max(1, int(max_gateways))
+        except (ValueError, TypeError):
+            errors.append(f"Invalid max_gateways: {max_gateways}")
+    floorplan_data, floorplan_errors = parse_floorplan_data(data.get('floorplan_data'))
+    errors.extend(floorplan_errors)
+    grid = floorplan_data.get('grid')
+    sensor_positions = floorplan_data.get('sensors', [])
+    if not _has_grid(grid) or not sensor_positions:
+        errors.append("Floor plan data (grid or sensor positions) is missing or invalid.")
+    if errors:
+        return {}, errors
+
+    grid_codes = encode_grid(grid)
+    sensors = _positions_to_array(sensor_positions)
+    free = _free_cells_mask(grid_codes, sensors)
+    candidates = np.argwhere(free)
+    if len(candidates) == 0:
+        return {}, ["No empty cell available for the gateways."]
+
+    # Matriz de margens sensor x candidato @ max_sf a partir das varreduras por sensor. As perdas de parede são
+    # simétricas e a margem é calculada com a mesma expressão da avaliação final (lado do gateway), por isso a
+    # cobertura decidida aqui é exatamente a que o plano reporta
+    sf_sensitivity = settings["sensitivity_dbm"][SPREADING_FACTORS.index(max_sf)]
+    loss_rows = _sensor_loss_rows(grid_codes, sensors, parallel=parallel)
+    margins = np.empty((len(sensors), len(candidates)), dtype=np.float32)
+    covers = np.empty((len(sensors), len(candidates)), dtype=bool)
+    for i, ((r, c), loss_row) in enumerate(zip(sensors, loss_rows)):
+        distances = np.hypot(candidates[:, 0] - r, candidates[:, 1] - c)
+        path_loss = _free_space_loss(settings, distances) + loss_row[free] + settings["floor_loss_db"]
+        margin_row = settings["tx_power_dbm"] + settings["antenna_gain_dbi"] - path_loss - sf_sensitivity
+        margins[i] = margin_row
+        covers[i] = margin_row >= MIN_SAFE_MARGIN
+
+    # Poda: candidatos que não cobrem nenhum sensor nunca são escolhidos
+    useful = covers.any(axis=0)
+    candidates, margins, covers = candidates[useful], margins[:, useful], covers[:, useful]
+    uncoverable = ~covers.any(axis=1)
+
+    chosen = []
+    uncovered = ~uncoverable
+    while uncovered.any() and (max_gateways is None or len(chosen) < max_gateways):
+        counts = covers[uncovered].sum(axis=0)
+        ties = np.flatnonzero(counts == counts.max())
+        tie_margins = np.where(covers[uncovered][:, ties], margins[uncovered][:, ties], 0).sum(axis=0)
+        pick = int(ties[tie_margins.argmax()])
+        chosen.append(pick)
+        uncovered &= ~covers[:, pick]
+    # Remover gateways redundantes (todos os seus sensores já cobertos pelos outros)
+    for pick in list(reversed(chosen)):
+        others = [k for k in chosen if k != pick]
+        if others and not (covers[:, pick] & ~covers[:, others].any(axis=1)).any():
+            chosen.remove(pick)
+
+    plan = {
+        "max_sf": max_sf,
+        "min_safe_margin_db": MIN_SAFE_MARGIN,
+        "candidates_total": int(free.sum()),
+        "gateway_count": len(chosen),
+        "gateways": [],
+        "assignments": [],
+        "uncoverable_sensors": [int(i) + 1 for i in np.flatnonzero(uncoverable)],
+        "uncovered_sensors": [int(i) + 1 for i in np.flatnonzero(uncovered & ~uncoverable)], # Só com max_gateways
+        "below_margin_sensors": [],
+    }
+    if not chosen:
+        return plan, []
+
+    # Atribuição e margens finais, calculadas do lado do gateway (como em _calculate_lora_params)
+    gateway_positions = [{'row': int(candidates[k][0]), 'col': int(candidates[k][1])} for k in chosen]
+    path_losses = np.stack([_gateway_path_losses(settings, grid_codes, gateway_pos, sensors) for gateway_pos in gateway_positions])
+    assigned = path_losses.argmin(axis=0)
+    best_pl = path_losses[assigned, np.arange(len(sensors))]
+    final_margins = settings["tx_power_dbm"] + settings["antenna_gain_dbi"] - best_pl - sf_sensitivity
+    for g, gateway_pos in enumerate(gateway_positions):
+        members = np.flatnonzero(assigned == g)
+        sf_idx = int(_required_sf_index(settings, best_pl[members].max())) if members.size else 0
+        plan["gateways"].append({
+            **gateway_pos,
+            "sensors": [int(i) + 1 for i in members],
+            "required_sf": SPREADING_FACTORS[sf_idx] if sf_idx < len(SPREADING_FACTORS) else None,
+            "worst_margin_db": round(float(final_margins[members].min()), 1) if members.size else None,
+        })
+    plan["assignments"] = [
+        {"sensor": i + 1, "gateway": int(assigned[i]) + 1, "margin_db": round(float(final_margins[i]), 1)}
+        for i in range(len(sensors))
+    ]
+    plan["below_margin_sensors"] = [int(i) + 1 for i in np.flatnonzero(final_margins < MIN_SAFE_MARGIN)]
+    logger.info(f"Gateway plan for SF<={max_sf}: {len(chosen)} gateway(s), {len(plan['uncoverable_sensors'])} uncoverable sensor(s).")
+    return plan, []
@@ -0,0 +1,173 @@
+# lora_wizard.py
+# Linha de comandos para planear muitos sites a partir de ficheiros, sem servidor web (não importa Flask nem o SDK do Gemini)
+"""
+Offline bulk planning: generates the recommendations of many sites on all CPU cores.
+
+    python lora_wizard.py sites/ -o output/ --jobs 8
+    python lora_wizard.py sites.jsonl -o output/ --artifacts --firmware
+
+Sites are /generate_config payloads: one per .json file of a directory (site_id = file name,
+a file may also hold a list or {"sites": [...]}), or one per line of a .jsonl file. Each site
+gets output/<site_id>/recommendations.json (plus its artifacts and firmware.zip if asked), and
+output/summary.json lists the selected parameters and errors of every site.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from lora_logic import generate_recommendations_batch, _artifact_filename
+from firmware_bundle import stream_firmware_bundle
+
+
+def _safe_site_id(site_id):
+    """Only safe characters in the site folder name."""
+    return re.sub(r'[^A-Za-z0-9._-]', '_', str(site_id)).strip('.') or '_'
+
+
+def _sites_from_json(payload, default_id):
+    """Sites of one JSON document: an object, a list of objects or {"sites": [...]}."""
+    if isinstance(payload, dict) and isinstance(payload.get('sites'), list):
+        payload = payload['sites']
+    if isinstance(payload, dict):
+        return [{'site_id': default_id, **payload}]
+    if isinstance(payload, list) and all(isinstance(site, dict) for site in payload):
+        return [{'site_id': f"{default_id}_{i + 1}", **site} for i, site in enumerate(payload)]
+    raise ValueError("expected an object, a list of objects or {\"sites\": [...]}")
+
+
+def load_sites(path):
+    """Reads the site payloads from a directory of .json files or from a .jsonl file. Raises ValueError on bad input."""
+    sites = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(path, name), encoding='utf-8') as f:
+                    sites += _sites_from_json(json.load(f), os.path.splitext(name)[0])
+            except ValueError as e:
+                raise ValueError(f"{name}: {e}")
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    site = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{line_number}: {e}")
+                if not isinstance(site, dict):
+                    raise ValueError(f"{path}:{line_number}: expected a JSON object")
+                sites.append({'site_id': f"site_{line_number}", **site})
+    duplicates = sorted(site_id for site_id, count in Counter(_safe_site_id(site['site_id']) for site in sites).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"duplicate site_id(s): {', '.join(duplicates[:10])}")
+    return sites
+
+
+def write_site_output(output_dir, result, write_artifacts, write_firmware):
+    """Writes one batch result to output_dir/<site_id>/. Returns its summary entry."""
+    site_dir = os.path.join(output_dir, _safe_site_id(result["site_id"]))
+    os.makedirs(site_dir, exist_ok=True)
+    recommendations = result["recommendations"]
+    with open(os.path.join(site_dir, 'recommendations.json'), 'w', encoding='utf-8') as f:
+        json.dump({"recommendations": recommendations, "errors": result["errors"]}, f, indent=2)
+    if write_artifacts:
+        artifacts_dir = os.path.join(site_dir, 'artifacts')
+        os.makedirs(artifacts_dir, exist_ok=True)
+        for artifact in recommendations.get("artifacts", {}).values():
+            with open(os.path.join(artifacts_dir, _artifact_filename(artifact)), 'w', encoding='utf-8') as f:
+                f.write(artifact["content"])
+    config_json = recommendations.get("config_json", {})
+    if write_firmware and "parameters" in config_json:
+        with open(os.path.join(site_dir, 'firmware.zip'), 'wb') as f:
+            for chunk in stream_firmware_bundle(config_json):
+                f.write(chunk)
+    parameters = recommendations.get("parameters", {})
+    return {
+        "site_id": result["site_id"],
+        "ok": bool(recommendations),
+        "spreading_factor": parameters.get("spreading_factor"),
+        "tx_power_dbm": parameters.get("tx_power_dbm"),
+        "worst_link_margin_db": parameters.get("worst_link_margin_db"),
+        "errors": result["errors"],
+    }
+
+
+class Progress:
+    """Progress on stderr: one updating line on a terminal, a line every ~5% otherwise (CI logs)."""
+
+    def __init__(self, total, enabled=True):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.enabled = enabled
+        self.interactive = sys.stderr.isatty()
+        self.step = max(1, total // 20)
+        self.start = time.monotonic()
+
+    def update(self, ok):
+        self.done += 1
+        self.failed += 0 if ok else 1
+        if not self.enabled or (not self.interactive and self.done % self.step and self.done != self.total):
+            return
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        line = f"[{self.done}/{self.total}] {100 * self.done / self.total:.0f}% | {self.failed} failed | {rate:.1f} sites/s | ETA {eta:.0f}s"
+        if self.interactive:
+            sys.stderr.write("\r" + line + ("\n" if self.done == self.total else ""))
+        else:
+            sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="lora-wizard", description="Plan LoRa networks for many sites from JSON files (offline, no web server).")
+    parser.add_argument("input", help="directory of .json site files or a .jsonl file (one site per line)")
+    parser.add_argument("-o", "--output", default="lora_wizard_output", help="output directory (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: all CPU cores, %(default)s)")
+    parser.add_argument("--artifacts", action="store_true", help="also write the generated code/instruction files of each site")
+    parser.add_argument("--firmware", action="store_true", help="also write each site's firmware bundle (firmware.zip)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log the planning details")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    if args.jobs < 1:
+        print("error: --jobs must be at least 1", file=sys.stderr)
+        return 2
+    try:
+        sites = load_sites(args.input)
+    except (OSError, ValueError) as e:
+        print(f"error: could not read sites: {e}", file=sys.stderr)
+        return 2
+    if not sites:
+        print(f"error: no sites found in {args.input}", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+    progress = Progress(len(sites), enabled=not args.quiet)
+    summary = [None] * len(sites)
+    results = generate_recommendations_batch(sites, parallel=args.jobs > 1, max_workers=args.jobs)
+    for result in results:
+        summary[result["index"]] = write_site_output(args.output, result, args.artifacts, args.firmware)
+        progress.update(summary[result["index"]]["ok"])
+
+    with open(os.path.join(args.output, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    failed = sum(1 for entry in summary if not entry["ok"])
+    if not args.quiet:
+        print(f"Planned {len(sites) - failed}/{len(sites)} site(s) in {time.monotonic() - progress.start:.1f}s -> {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
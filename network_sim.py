@@ -0,0 +1,182 @@
+# network_sim.py
+# Simulador de eventos discretos da capacidade da rede (ALOHA puro, como no LoRaWAN classe A)
+import logging
+import math
+import numpy as np
+from config import REGION_FREQUENCIES, REGION_UPLINK_CHANNELS, DEFAULT_LORA_PARAMS
+from lora_logic import (SPREADING_FACTORS, time_on_air_ms, parse_floorplan_data, _calculate_lora_params,
+                        _add_airtime_params, _get_payload_bytes)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DURATION_S = 24 * 3600 # Um dia simulado
+DEFAULT_JITTER = 0.1 # +/-10% no intervalo de envio (relógios dos nós não são perfeitos)
+MAX_SIMULATED_NODES = 100_000
+_WINDOW_EVENTS = 2_000_000 # Eventos processados de cada vez (limita a memória)
+
+
+def _node_spreading_factors(params, node_count):
+    """SF of each simulated node: the per-sensor (ADR) SFs repeated cyclically, or the network SF."""
+    per_sensor = [entry["spreading_factor"] for entry in params.get("per_sensor") or []]
+    if not per_sensor:
+        per_sensor = [params.get("spreading_factor", 7)]
+    return [per_sensor[i % len(per_sensor)] for i in range(node_count)]
+
+
+def _window_collisions(starts, ends, slots, busy_until, busy_lost):
+    """
+    Marks the lost packets of one window of events. Sorted by (slot, start), a packet is lost
+    when it starts before the latest end of the earlier packets in its slot (including the one
+    carried over from the previous window in busy_until) or when the next packet starts before
+    it ends. Updates busy_until/busy_lost in place and returns (lost, carried_losses_per_slot).
+    """
+    span = float(max(ends.max(), busy_until.max())) + 1.0
+    order = np.argsort(slots * span + starts)
+    starts, ends, slots = starts[order], ends[order], slots[order]
+    keyed_ends = slots * span + ends # Chaves por slot para o cummax não passar de um slot para o outro
+    prior_end = np.empty_like(keyed_ends)
+    prior_end[0] = -np.inf
+    prior_end[1:] = np.maximum.accumulate(keyed_ends)[:-1]
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = slots[1:] != slots[:-1]
+    prior_end = np.where(first, slots * span + busy_until[slots], np.maximum(prior_end, slots * span + busy_until[slots]))
+    hits_prior = slots * span + starts < prior_end
+    hits_next = np.zeros(len(starts), dtype=bool)
+    hits_next[:-1] = ~first[1:] & (starts[1:] < ends[:-1])
+    lost = hits_prior | hits_next
+
+    # Pacote carregado da janela anterior perde-se se o primeiro pacote do slot começar antes do seu fim
+    carried = np.zeros(len(busy_until), dtype=np.int64)
+    carry_hit = first & hits_prior & ~busy_lost[slots]
+    carried[slots[carry_hit]] = 1
+
+    # Novo estado por slot: o pacote que termina mais tarde. Se não for o último do slot, o último
+    # começa antes do seu fim e ambos estão perdidos; se ainda for o pacote carregado, foi atingido
+    last = np.ones(len(starts), dtype=bool)
+    last[:-1] = slots[1:] != slots[:-1]
+    touched = slots[last]
+    group_max_end = np.maximum.reduceat(ends, np.flatnonzero(first)) # Exato (sem a chave do slot)
+    extends = group_max_end > busy_until[touched]
+    busy_lost[touched] = ~extends | lost[last] | (ends[last] < group_max_end)
+    busy_until[touched] = np.maximum(busy_until[touched], group_max_end)
+    lost_sorted = np.empty_like(lost)
+    lost_sorted[order] = lost
+    return lost_sorted, carried
+
+
+def simulate_network(params, node_count, channels=3, duration_s=DEFAULT_DURATION_S, jitter=DEFAULT_JITTER, seed=0):
+    """
+    Simulates node_count nodes sending periodic uplinks (pure ALOHA) for duration_s seconds.
+
+    params are the outputs of _calculate_lora_params + _add_airtime_params (SF/per_sensor,
+    bandwidth, coding rate, preamble, payload_bytes and the send interval). Every uplink picks a
+    random channel; two packets collide when they overlap on the same (channel, SF), different
+    SFs are treated as orthogonal and capture effect is ignored (pessimistic).
+
+    Event-driven, without time steps: only transmissions are generated (next send = previous
+    + jittered interval), in windows of ~_WINDOW_EVENTS events that are ordered and checked for
+    collisions with numpy, carrying the per-slot channel state across windows.
+    """
+    rng = np.random.default_rng(seed)
+    interval_s = params.get("_send_interval_ms_raw", DEFAULT_LORA_PARAMS['uplink_interval_s'] * 1000) / 1000
+    airtimes_s = time_on_air_ms(np.array(SPREADING_FACTORS), params.get("signal_bandwidth_khz", DEFAULT_LORA_PARAMS['bandwidth_khz']),
+                                params.get("_coding_rate_raw", DEFAULT_LORA_PARAMS['coding_rate_denominator']),
+                                params.get("preamble_length", DEFAULT_LORA_PARAMS['preamble_length']),
+                                params.get("payload_bytes", DEFAULT_LORA_PARAMS['payload_bytes'])) / 1000
+    node_sf_idx = np.array([SPREADING_FACTORS.index(sf) for sf in _node_spreading_factors(params, node_count)])
+    node_airtimes = airtimes_s[node_sf_idx]
+    sf_count = len(SPREADING_FACTORS)
+    busy_until = np.full(channels * sf_count, -1.0) # Por slot (canal, SF): fim do pacote que termina mais tarde
+    busy_lost = np.zeros(channels * sf_count, dtype=bool) # ... e se esse pacote já foi contado como perdido
+    sent_per_sf = np.zeros(sf_count, dtype=np.int64)
+    lost_per_sf = np.zeros(sf_count, dtype=np.int64)
+    busy_time = 0.0
+
+    # Primeiro envio de cada nó uniformemente distribuído num intervalo
+    next_send = rng.uniform(0, interval_s, node_count)
+    window_s = max(interval_s, _WINDOW_EVENTS * interval_s / node_count)
+    window_start = 0.0
+    while window_start < duration_s:
+        window_end = min(window_start + window_s, duration_s)
+        starts, nodes = [], []
+        pending = np.flatnonzero(next_send < window_end)
+        while pending.size:
+            starts.append(next_send[pending])
+            nodes.append(pending)
+            next_send[pending] += interval_s * rng.uniform(1 - jitter, 1 + jitter, pending.size)
+            pending = pending[next_send[pending] < window_end]
+        window_start = window_end
+        if not starts:
+            continue
+        starts, nodes = np.concatenate(starts), np.concatenate(nodes)
+        sf_idx = node_sf_idx[nodes]
+        slots = rng.integers(0, channels, len(nodes)) * sf_count + sf_idx
+        lost, carried = _window_collisions(starts, starts + node_airtimes[nodes], slots, busy_until, busy_lost)
+        sent_per_sf += np.bincount(sf_idx, minlength=sf_count)
+        lost_per_sf += np.bincount(sf_idx[lost], minlength=sf_count) + carried.reshape(channels, sf_count).sum(axis=0)
+        busy_time += float(node_airtimes[nodes].sum())
+
+    sent = int(sent_per_sf.sum())
+    lost = int(lost_per_sf.sum())
+    # Carga oferecida por canal (Erlang) e PDR teórico do ALOHA puro, e^(-2G), para comparação
+    offered_load = float(node_airtimes.sum()) / interval_s / channels
+    return {
+        "nodes": node_count,
+        "channels": channels,
+        "duration_s": duration_s,
+        "send_interval_s": round(interval_s, 1),
+        "packets_sent": sent,
+        "packets_delivered": sent - lost,
+        "collisions": lost,
+        "pdr": round((sent - lost) / sent, 4) if sent else None,
+        "collision_rate": round(lost / sent, 4) if sent else None,
+        "channel_utilization": round(busy_time / (duration_s * channels), 4), # Tempo no ar / tempo disponível (> 1 quando saturado)
+        "offered_load_erlang": round(offered_load, 4),
+        "aloha_pdr_estimate": round(math.exp(-2 * offered_load / len(np.unique(node_sf_idx))), 4), # Supõe SFs igualmente carregados
+        "per_sf": {
+            f"SF{sf}": {"packets_sent": int(sent_per_sf[i]), "pdr": round(float(1 - lost_per_sf[i] / sent_per_sf[i]), 4)}
+            for i, sf in enumerate(SPREADING_FACTORS) if sent_per_sf[i]
+        },
+    }
+
+
+def simulate_capacity(params, node_counts, channels=3, duration_s=DEFAULT_DURATION_S, jitter=DEFAULT_JITTER, seed=0):
+    """Runs simulate_network for each node count, showing how PDR and utilization scale with the network size."""
+    results = []
+    for node_count in node_counts:
+        result = simulate_network(params, node_count, channels, duration_s, jitter, seed)
+        logger.info(f"Simulated {node_count} nodes: PDR={result['pdr']}, utilization={result['channel_utilization']}")
+        results.append(result)
+    return results
+
+
+def simulate_site(data):
+    """
+    Simulates the network of a site: payload of /generate_config plus optional 'node_counts'
+    (defaults to the number of sensors and a few multiples of it), 'duration_h' and 'channels'.
+    Returns (results, errors).
+    """
+    errors = []
+    region = data.get('region', 'EU868')
+    payload_bytes, payload_errors = _get_payload_bytes(data)
+    errors.extend(payload_errors)
+    floorplan_data, floorplan_errors = parse_floorplan_data(data.get('floorplan_data'))
+    errors.extend(floorplan_errors)
+    environment_data = {key: data.get(key) for key in ('size_sqm', 'floors', 'walls_internal', 'wall_type')}
+    params, param_errors, _ = _calculate_lora_params(environment_data, floorplan_data, region, REGION_FREQUENCIES.get(region, 868.0), payload_bytes)
+    errors.extend(param_errors)
+    if errors: # Inclui planta sem sensores (_calculate_lora_params não calcula as ligações)
+        return [], errors
+    _add_airtime_params(params, region, payload_bytes)
+
+    sensor_count = len(floorplan_data['sensors'])
+    try:
+        node_counts = [int(n) for n in data.get('node_counts') or [sensor_count * k for k in (1, 10, 100)]]
+        if not all(1 <= n <= MAX_SIMULATED_NODES for n in node_counts): raise ValueError
+        duration_s = float(data.get('duration_h') or DEFAULT_DURATION_S / 3600) * 3600
+        if not 0 < duration_s <= 7 * 24 * 3600: raise ValueError
+        channels = int(data.get('channels') or REGION_UPLINK_CHANNELS.get(region, 1))
+        if channels < 1: raise ValueError
+    except (ValueError, TypeError):
+        return [], [f"Invalid simulation settings (node_counts 1-{MAX_SIMULATED_NODES}, duration_h up to 168, channels >= 1)."]
+    return simulate_capacity(params, node_counts, channels, duration_s), []
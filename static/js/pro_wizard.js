@@ -33,6 +33,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const selectedToolIndicator = document.getElementById('selected-tool-indicator');
     const floorplanDataInput = document.getElementById('floorplan_data');
     const jsonOutputElement = document.getElementById('json-output');
+    const liveLinkStatus = document.getElementById('live-link-status');
     // AI Chat Modal Elements
     const aiResponseModal = document.getElementById('ai-response-modal');
     const aiChatHistory = document.getElementById('ai-chat-history');
@@ -53,7 +54,9 @@ document.addEventListener('DOMContentLoaded', () => {
      // Variáveis de estado globais
      let currentConfigJson = {};
      let currentRecommendations = {};
+     let currentOmittedParts = {}; // Partes pedidas só quando necessárias: id -> URL (ex: parameter_notes completas)
      let currentChatHistory = [];
+     let aiChatSessionId = null; // Conversa guardada no servidor: depois da 1ª resposta só se envia a nova mensagem
      let currentAIContext = {};
      let artifactCounter = 0;
      let pendingConfidenceTopic = null;
@@ -65,6 +68,12 @@ document.addEventListener('DOMContentLoaded', () => {
      let gatewayPosition = null;
      let sensorPositions = [];
      let isMouseDown = false;
+     // Sessão do editor no servidor (delta API): só as células alteradas são enviadas
+     let liveSessionId = null;
+     let liveRevision = 0;
+     let pendingEdits = [];
+     let liveSyncTimer = null;
+     let liveSyncInFlight = false;
 
 
     // --- Event Listeners ---
@@ -101,6 +110,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     } else { console.error("Has Gateway radio buttons not found"); }
 
+    // Região/pisos fazem parte da sessão do editor: mudar recria-a com a planta completa
+    ['region', 'floors'].forEach(id => {
+        const input = document.getElementById(id);
+        if (input) input.addEventListener('change', () => { liveSessionId = null; scheduleLiveSync(); });
+    });
+
     // Listener específico para a Toolbar (para seleção de ferramentas)
     if (toolbar) {
         console.log("Attaching click listener to toolbar:", toolbar);
@@ -178,6 +193,8 @@ document.addEventListener('DOMContentLoaded', () => {
         data.environment = { size_sqm: data.size_sqm, floors: data.floors, walls_internal: data.walls_internal, wall_type: data.wall_type, details: data.environment_details };
         delete data.grid_rows; delete data.grid_cols;
         if (data.has_gateway === 'yes') { delete data.gateway_approach; delete data.existing_hw; }
+        // Raciocínio resumido (o detalhe por sensor só é pedido ao abrir os detalhes); a planta e o hardware já existem do lado do cliente
+        data.reasoning = 'summary'; data.lazy = ['floorplan', 'hardware_suggestions'];
 
         console.log("Sending data (API Key omitted):", {...data, api_key: '***'});
 
@@ -190,10 +207,15 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!finalResultsSection) throw new Error("Results section became unavailable after fetch.");
 
             currentRecommendations = result.recommendations || {};
+            currentOmittedParts = result.omitted || {};
             currentConfigJson = currentRecommendations.config_json || {};
             if (floorplanDataInput && floorplanDataInput.value && !currentConfigJson.floorplan) {
                  try { currentConfigJson.floorplan = JSON.parse(floorplanDataInput.value); } catch(e) { console.error("Could not parse floorplan data for config export"); }
             }
+            if (!currentConfigJson.hardware_suggestions && currentRecommendations.hardware) currentConfigJson.hardware_suggestions = currentRecommendations.hardware;
+            // Firmware de cada módulo escolhido, gerada pelo servidor a partir do resultado em cache
+            const firmwareBundleLink = document.getElementById('firmware-bundle-link');
+            if (firmwareBundleLink && result.result_id) { firmwareBundleLink.href = `/generate_config/${result.result_id}/firmware.zip`; firmwareBundleLink.classList.remove('hidden'); }
 
             displayResults(currentRecommendations);
             finalResultsSection.classList.remove('hidden');
@@ -231,7 +253,9 @@ document.addEventListener('DOMContentLoaded', () => {
         } else if (toggleDetailsButton) {
             console.log("Toggle details button clicked");
              const notesContainer = document.getElementById('parameter-notes');
-             if (notesContainer) {
+             if (notesContainer && notesContainer.classList.contains('hidden') && currentOmittedParts.parameter_notes) {
+                 loadFullParameterNotes(toggleDetailsButton);
+             } else if (notesContainer) {
                  const isHidden = notesContainer.classList.toggle('hidden');
                  toggleDetailsButton.textContent = isHidden ? 'Show Calculation Details »' : 'Hide Calculation Details «';
              } else { console.error("Parameter notes container not found for toggle."); }
@@ -257,6 +281,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Limpa histórico e contexto ANTES de preencher
         currentChatHistory = [];
+        aiChatSessionId = null;
         if (aiChatHistory) aiChatHistory.innerHTML = ''; else console.error("AI Chat history element not found for clearing");
         
         // Obter a planta ATUALIZADA do input escondido
@@ -299,9 +324,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (currentAIContext.data.type === 'code') { initialQuestion += ` If you provide code examples, ensure they are well-commented.`; }
             }
 
-            // Adicionar ao histórico e mostrar
-            const firstUserMessage = `Initial Context: ${JSON.stringify(currentAIContext)} \n First Question: ${initialQuestion}`;
-            currentChatHistory.push({ role: 'user', parts: [{ text: firstUserMessage }] });
+            // Adicionar ao histórico e mostrar (o contexto segue à parte, no campo 'context' do pedido)
+            currentChatHistory.push({ role: 'user', parts: [{ text: initialQuestion }] });
             displayChatMessage('user', `Asking about ${context}...`); // Mostra mensagem simples
 
             // Abrir modal e chamar backend
@@ -320,6 +344,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     function handleGeneralAIChat() {
         console.log("Starting general AI chat.");
+        aiChatSessionId = null; // O histórico (carregado ou novo) é enviado por inteiro no primeiro pedido
         if (aiChatHistory) aiChatHistory.innerHTML = ''; else console.error("AI Chat history element not found for clearing");
 
         if (currentChatHistory && currentChatHistory.length > 0) {
@@ -331,9 +356,9 @@ document.addEventListener('DOMContentLoaded', () => {
         } else {
             console.log("Starting fresh chat.");
             currentChatHistory = []; // Garante que está vazio
+            currentAIContext = {}; // Limpa contexto específico (uma conversa que continua mantém o seu)
             displayChatMessage('model', "Ask me anything about LoRa for smart homes or DIY projects!");
         }
-        currentAIContext = {}; // Limpa contexto específico
         if (aiResponseModal) aiResponseModal.classList.remove('hidden'); else console.error("AI Response Modal not found");
         if (aiChatInput) aiChatInput.focus(); else console.error("AI Chat input not found");
         setChatInputEnabled(true);
@@ -379,16 +404,85 @@ document.addEventListener('DOMContentLoaded', () => {
         pendingConfidenceTopic = null;
 
         try {
-            const payload = { api_key: apiKey, chat_history: currentChatHistory };
-            console.log("Sending to /ask_ai:", { api_key_present: !!apiKey, chat_history_length: payload.chat_history.length });
-            const response = await fetch('/ask_ai', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) });
-            const result = await response.json();
-            if (thinkingMsg) thinkingMsg.remove(); // Remove "Thinking..." message
+            const lastUserMessage = currentChatHistory[currentChatHistory.length - 1]?.parts?.[0]?.text || '';
+            const sendAskRequest = (payload) => fetch('/ask_ai/stream', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) });
+            let response;
+            if (aiChatSessionId) {
+                console.log("Sending to /ask_ai/stream:", { api_key_present: !!apiKey, session_id: aiChatSessionId });
+                response = await sendAskRequest({ api_key: apiKey, session_id: aiChatSessionId, message: lastUserMessage });
+                if (response.status === 404) aiChatSessionId = null; // Sessão expirou no servidor: reenviar o histórico completo
+            }
+            if (!aiChatSessionId) {
+                console.log("Sending to /ask_ai/stream:", { api_key_present: !!apiKey, chat_history_length: currentChatHistory.length });
+                const newSessionPayload = { api_key: apiKey, chat_history: currentChatHistory };
+                if (currentAIContext && Object.keys(currentAIContext).length > 0) newSessionPayload.context = currentAIContext;
+                response = await sendAskRequest(newSessionPayload);
+            }
+            if (!response.ok) {
+                const errorResult = await response.json().catch(() => ({}));
+                throw new Error(errorResult.error || errorResult.answer || `HTTP error! Status: ${response.status}`);
+            }
 
-            if (!response.ok) { throw new Error(result.error || result.answer || `HTTP error! Status: ${response.status}`); }
+            // A resposta chega por Server-Sent Events: 'token' com texto à medida que é gerado, depois 'done' (ou 'error')
+            let result = null;
+            let streamedText = '';
+            let replyMsg = null;
+            let renderPending = false;
+            const renderReply = () => {
+                renderPending = false;
+                const contentDiv = replyMsg?.querySelector('.markdown-content');
+                if (!contentDiv) return;
+                try { contentDiv.innerHTML = marked.parse(streamedText); } catch (e) { contentDiv.textContent = streamedText; }
+                aiChatHistory.scrollTop = aiChatHistory.scrollHeight;
+            };
+            const handleEvent = (frame) => {
+                let eventName = 'message';
+                const dataLines = [];
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+                });
+                if (!dataLines.length) return;
+                const data = JSON.parse(dataLines.join('\n'));
+                if (eventName === 'token') {
+                    streamedText += data.text;
+                    if (!replyMsg) {
+                        if (thinkingMsg) thinkingMsg.remove(); // Primeiro texto: substitui o "Thinking..."
+                        replyMsg = displayChatMessage('model', '');
+                    }
+                    if (!renderPending) { renderPending = true; requestAnimationFrame(renderReply); } // No máximo um render por frame
+                } else if (eventName === 'done') {
+                    result = data;
+                } else if (eventName === 'error') {
+                    throw new Error(data.error || 'AI stream error');
+                }
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    handleEvent(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                }
+            }
+            if (buffer.trim()) handleEvent(buffer);
+            if (!result) throw new Error('The AI response ended unexpectedly.');
+            if (result.session_id) aiChatSessionId = result.session_id;
 
             const aiResponseText = result.answer || "Sorry, I didn't get a response.";
-            displayChatMessage('model', aiResponseText);
+            if (replyMsg) {
+                streamedText = aiResponseText; // Texto final (já sem marcadores, com as notas)
+                renderReply();
+            } else {
+                if (thinkingMsg) thinkingMsg.remove(); // Remove "Thinking..." message
+                displayChatMessage('model', aiResponseText);
+            }
             currentChatHistory.push({ role: 'model', parts: [{ text: aiResponseText }] });
 
             // Handle Confidence Check
@@ -565,6 +659,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 const loadedHistory = JSON.parse(e.target.result);
                 if (Array.isArray(loadedHistory) && loadedHistory.every(msg => msg.role && msg.parts)) {
                     currentChatHistory = loadedHistory;
+                    currentAIContext = {};
+                    aiChatSessionId = null;
                     if (statusEl) statusEl.textContent = `Loaded: ${file.name}`;
                     console.log("Loaded chat history:", currentChatHistory);
                     alert(`Chat '${file.name}' loaded. Click 'Ask AI (General)' to continue.`);
@@ -595,6 +691,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (gridRowsInput) gridRowsInput.value = numRows; if (gridColsInput) gridColsInput.value = numCols;
         floorPlanGrid = Array(numRows).fill(null).map(() => Array(numCols).fill('empty'));
         gatewayPosition = null; sensorPositions = [];
+        liveSessionId = null; pendingEdits = []; if (liveLinkStatus) liveLinkStatus.textContent = '';
         floorplanGridElement.innerHTML = '';
         floorplanGridElement.style.gridTemplateRows = `repeat(${numRows}, 25px)`;
         floorplanGridElement.style.gridTemplateColumns = `repeat(${numCols}, 25px)`;
@@ -654,15 +751,35 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
     function updateGridState(row, col, type) { /* ... (igual, com logs) ... */
-        if (floorPlanGrid && row >= 0 && row < numRows && col >= 0 && col < numCols) { floorPlanGrid[row][col] = type; console.clear(); console.log(`Grid state updated at [${row}, ${col}] to "${type}"`); console.log("Current floorPlanGrid:"); floorPlanGrid.forEach((gridRow, index) => console.log(`Row ${index}:`, gridRow)); updateHiddenInput(); } else { console.error(`Invalid coordinates or grid not initialized: (${row}, ${col})`); }
+        if (floorPlanGrid && row >= 0 && row < numRows && col >= 0 && col < numCols) { floorPlanGrid[row][col] = type; queueLiveEdit(row, col, type); console.clear(); console.log(`Grid state updated at [${row}, ${col}] to "${type}"`); console.log("Current floorPlanGrid:"); floorPlanGrid.forEach((gridRow, index) => console.log(`Row ${index}:`, gridRow)); updateHiddenInput(); } else { console.error(`Invalid coordinates or grid not initialized: (${row}, ${col})`); }
     }
 
     function clearFloorPlan() { 
          if (confirm("Tem a certeza que quer limpar toda a planta?")) { const rows = parseInt(gridRowsInput?.value, 10) || numRows; const cols = parseInt(gridColsInput?.value, 10) || numCols; createFloorPlanGrid(rows, cols); }
     }
 
-    function serializeGridData() { 
-        const data = { rows: numRows, cols: numCols, grid: floorPlanGrid, gateway: gatewayPosition, sensors: sensorPositions }; return JSON.stringify(data, null, 2);
+    // Codificação compacta da grelha (igual a lora_logic.encode_floorplan_grid): pares de bytes (tipo, repetições 1-255) em base64
+    const CELL_TYPES = ['empty', 'drywall', 'brick', 'concrete', 'gateway', 'sensor'];
+    function encodeGridRLE(grid) {
+        const bytes = [];
+        let currentCode = -1, run = 0;
+        for (const row of grid) {
+            for (const cell of row) {
+                const code = Math.max(CELL_TYPES.indexOf(cell), 0);
+                if (code === currentCode && run < 255) { run++; continue; }
+                if (run > 0) bytes.push(currentCode, run);
+                currentCode = code; run = 1;
+            }
+        }
+        if (run > 0) bytes.push(currentCode, run);
+        let binary = '';
+        for (let i = 0; i < bytes.length; i += 0x8000) { binary += String.fromCharCode.apply(null, bytes.slice(i, i + 0x8000)); }
+        return { encoding: 'rle-u8-b64', types: CELL_TYPES, cells: btoa(binary) };
+    }
+
+    function serializeGridData(compact = true) {
+        const grid = compact && floorPlanGrid ? encodeGridRLE(floorPlanGrid) : floorPlanGrid;
+        const data = { rows: numRows, cols: numCols, grid: grid, gateway: gatewayPosition, sensors: sensorPositions }; return JSON.stringify(data, null, 2);
     }
 
     function updateHiddenInput() { /* ... (inalterado, mas verifica jsonOutputElement) ... */
@@ -674,6 +791,56 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
 
+    // --- Live Link Margins (delta API) ---
+    function queueLiveEdit(row, col, type) {
+        pendingEdits.push({ row, col, type });
+        scheduleLiveSync();
+    }
+
+    function scheduleLiveSync() {
+        clearTimeout(liveSyncTimer);
+        liveSyncTimer = setTimeout(syncLiveMargins, 300); // Agrupa os traços do rato num só pedido
+    }
+
+    async function syncLiveMargins() {
+        if (!floorPlanGrid) return;
+        if (liveSyncInFlight) { scheduleLiveSync(); return; }
+        liveSyncInFlight = true;
+        const edits = pendingEdits; pendingEdits = [];
+        try {
+            let response = null;
+            if (liveSessionId) {
+                response = await fetch(`/floorplan_session/${liveSessionId}/edits`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ base_revision: liveRevision, edits }) });
+            }
+            if (!response || response.status === 404 || response.status === 409) {
+                // Sem sessão (ou expirou/dessincronizou): começa uma nova com a planta completa
+                const payload = { region: document.getElementById('region')?.value, floors: document.getElementById('floors')?.value, floorplan_data: serializeGridData() };
+                response = await fetch('/floorplan_session', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) });
+            }
+            const result = await response.json();
+            if (!response.ok) { throw new Error(result.error || `HTTP error! status: ${response.status}`); }
+            liveSessionId = result.session_id; liveRevision = result.revision;
+            displayLiveMargins(result);
+        } catch (error) {
+            console.warn("Live margin update failed:", error);
+            liveSessionId = null;
+        } finally { liveSyncInFlight = false; }
+    }
+
+    function displayLiveMargins(result) {
+        if (!liveLinkStatus) return;
+        if (!result.spreading_factor) { liveLinkStatus.textContent = 'Live margins: place a gateway and at least one sensor.'; liveLinkStatus.className = 'mt-2 text-xs text-gray-600'; return; }
+        const belowSafe = result.sensor_margins_db.filter(m => m < 5).length;
+        liveLinkStatus.textContent = `Live: SF${result.spreading_factor}, worst margin ${result.worst_link_margin_db} dB` + (belowSafe ? ` (${belowSafe} sensor(s) below 5 dB)` : '');
+        liveLinkStatus.className = `mt-2 text-xs ${belowSafe ? 'text-orange-600' : 'text-green-700'}`;
+        // Margem de cada sensor no tooltip da célula (mesma ordem que sensorPositions)
+        sensorPositions.forEach((pos, i) => {
+            const cell = floorplanGridElement?.querySelector(`[data-row="${pos.row}"][data-col="${pos.col}"]`);
+            if (cell && result.sensor_margins_db[i] !== undefined) cell.title = `Margin @ SF${result.spreading_factor}: ${result.sensor_margins_db[i]} dB`;
+        });
+    }
+
+
     // --- UI Update Functions ---
     function displayResults(recommendations) { 
          console.log("Pro version received recommendations object:", recommendations);
@@ -900,16 +1067,37 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     
         if (errorMessage) errorMessage.classList.add('hidden');
+        const firmwareBundleLink = document.getElementById('firmware-bundle-link');
+        if (firmwareBundleLink) firmwareBundleLink.classList.add('hidden');
     
         // Reset state variables
         currentConfigJson = {};
         currentRecommendations = {};
+        currentOmittedParts = {};
         artifactCounter = 0;
         // Reset chat history if needed, or keep it
         // currentChatHistory = [];
         // if (aiChatHistory) aiChatHistory.innerHTML = '';
         // if (aiConfidenceButtonsContainer) aiConfidenceButtonsContainer.classList.add('hidden');
     }
+    async function loadFullParameterNotes(toggleButton) {
+        // Notas completas (com as linhas por sensor) pedidas ao servidor só quando o utilizador abre os detalhes
+        const url = currentOmittedParts.parameter_notes;
+        toggleButton.disabled = true;
+        try {
+            const response = await fetch(url);
+            const result = await response.json();
+            if (!response.ok) { throw new Error(result.error || `HTTP error! status: ${response.status}`); }
+            currentRecommendations.parameter_notes = result.value;
+            delete currentOmittedParts.parameter_notes;
+            displayParameters(currentRecommendations.parameters, currentRecommendations.parameter_notes);
+        } catch (error) {
+            console.warn("Could not load the full calculation details, showing the summary:", error);
+            delete currentOmittedParts.parameter_notes; // Resultado expirado: fica o resumo
+        } finally { toggleButton.disabled = false; }
+        const notesContainer = document.getElementById('parameter-notes');
+        if (notesContainer) { notesContainer.classList.remove('hidden'); toggleButton.textContent = 'Hide Calculation Details «'; }
+    }
     function copyContentToClipboard(elementId, buttonElement) {
         const contentContainer = document.getElementById(elementId);
         if (!contentContainer) { console.error(`Copy target element not found: ${elementId}`); return; }
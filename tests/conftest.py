@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Os módulos da app estão na raiz do repositório (sem pacote): torná-los importáveis em qualquer diretório
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
@@ -0,0 +1,96 @@
+# tests/test_ai_assistant.py
+import types
+import pytest
+import ai_assistant
+from caching import LRUCache
+
+
+class StubClient:
+    def __init__(self, client_options=None):
+        self.api_key = client_options["api_key"]
+
+
+class StubModel:
+    def __init__(self, model_name, system_instruction=None):
+        self.model_name = model_name
+        self._client = None # Como o GenerativeModel do SDK: cliente criado no primeiro pedido
+
+
+class StubModelWithoutClient:
+    def __init__(self, model_name, system_instruction=None):
+        self.model_name = model_name
+
+
+def stub_genai(model_class, configured):
+    """(genai, glm) stand-ins for _load_genai; configured collects the keys passed to genai.configure."""
+    genai = types.SimpleNamespace(GenerativeModel=model_class, configure=lambda api_key: configured.append(api_key))
+    return genai, types.SimpleNamespace(GenerativeServiceClient=StubClient)
+
+
+@pytest.fixture
+def model_pool(monkeypatch):
+    pool = LRUCache(maxsize=8)
+    monkeypatch.setattr(ai_assistant, "_model_pool", pool)
+    return pool
+
+
+def test_each_key_gets_its_own_client(monkeypatch, model_pool):
+    configured = []
+    monkeypatch.setattr(ai_assistant, "_genai", stub_genai(StubModel, configured))
+    first, second = ai_assistant.get_model("key-1"), ai_assistant.get_model("key-2")
+    assert (first._client.api_key, second._client.api_key) == ("key-1", "key-2")
+    assert ai_assistant.get_model("key-1") is first
+    assert len(model_pool) == 2
+    assert configured == [] # Nunca o genai.configure global
+
+
+def test_sdk_without_model_client_falls_back_to_global_configure(monkeypatch, model_pool):
+    configured = []
+    monkeypatch.setattr(ai_assistant, "_genai", stub_genai(StubModelWithoutClient, configured))
+    model = ai_assistant.get_model("key-1")
+    ai_assistant.get_model("key-2")
+    assert ai_assistant.get_model("key-1") is model
+    assert configured == ["key-1", "key-2", "key-1"] # Reconfigurado a cada pedido, com a chave de quem pede
+
+
+REPLY = ('Sure. <<<ASK_CONFIDENCE: gateway height>>> Moving on <<UPDATE <<<UPDATE_PARAMS>>>{"spreading_factor": 9}<<<END_UPDATE>>>'
+         ' see <<<ADD_ARTIFACT>>>{"title": "a <b>"}<<<END_ADD>>> and <<<FLOORPLAN_GRID>>> done <<<NOT_A_MARKER>>>!')
+
+
+def parse(chunks):
+    """All events of MarkerStreamParser for the given chunks, with consecutive text events merged."""
+    parser = ai_assistant.MarkerStreamParser()
+    events = [event for chunk in chunks for event in parser.feed(chunk)] + parser.finish()
+    merged = []
+    for kind, content in events:
+        if kind == 'text' and merged and merged[-1][0] == 'text':
+            merged[-1] = ('text', merged[-1][1] + content)
+        else:
+            merged.append((kind, content))
+    return merged
+
+
+def test_markers_split_across_chunks():
+    expected = [('text', 'Sure. '), ('confidence', ' gateway height'), ('text', ' Moving on <<UPDATE '),
+                ('update_params', '{"spreading_factor": 9}'), ('text', ' see '), ('add_artifact', '{"title": "a <b>"}'),
+                ('text', ' and '), ('floorplan_grid', ''), ('text', ' done <<<NOT_A_MARKER>>>!')]
+    assert parse([REPLY]) == expected
+    assert parse(list(REPLY)) == expected # Um carácter de cada vez: todas as fronteiras possíveis
+    for size in (2, 3, 5, 7, 16):
+        assert parse([REPLY[i:i + size] for i in range(0, len(REPLY), size)]) == expected
+
+
+def test_partial_marker_is_held_back_until_it_resolves():
+    parser = ai_assistant.MarkerStreamParser()
+    assert parser.feed('text <<') == [('text', 'text ')]
+    assert parser.feed('<UPDATE_PA') == []
+    assert parser.feed('RAMS>>>{"a": 1}<<<END_') == []
+    assert parser.feed('UPDATE>>> after') == [('update_params', '{"a": 1}'), ('text', ' after')]
+
+
+@pytest.mark.parametrize("tail", ['<', '<<', '<<<', '<<<ASK_CONF', '<<<UPDATE_PARAMS>>>{"a": 1'])
+def test_unterminated_trailing_marker_is_flushed_as_text(tail):
+    parser = ai_assistant.MarkerStreamParser()
+    assert parser.feed('answer ' + tail) == [('text', 'answer ')]
+    assert parser.finish() == [('text', tail)]
+    assert parser.finish() == []
@@ -0,0 +1,65 @@
+# tests/test_artifact_store.py
+import json
+import os
+import time
+import pytest
+from artifact_store import ArtifactStore
+
+FILE_BYTES = 1000
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Limpeza só quando o teste a chama (a thread de escrita não chega ao intervalo)
+    store = ArtifactStore(root=str(tmp_path), settings={"max_bytes": 2500, "max_age_s": 3600, "eviction_interval_s": 1e9, "queue_size": 64})
+    yield store
+    store.close()
+
+
+def fill(store, namespaces):
+    """Saves a distinct FILE_BYTES file per (namespace, filename), oldest first; returns {(namespace, filename): content}."""
+    contents = {}
+    for age, (namespace, filename) in enumerate(reversed(namespaces)):
+        content = f"{namespace}/{filename}".ljust(FILE_BYTES, "x")
+        content_hash = store.save(namespace, filename, content)
+        assert store.flush(timeout_s=5)
+        path = store._object_path(content_hash, os.path.splitext(filename)[1])
+        os.utime(path, (time.time() - 60 * (age + 1),) * 2) # O primeiro da lista é o mais antigo
+        contents[(namespace, filename)] = content
+    return contents
+
+
+def manifest(store, namespace):
+    with open(store._manifest_path(namespace), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_eviction_past_the_size_cap_prunes_manifests(store):
+    contents = fill(store, [("old", "sender.ino"), ("mixed", "sender.ino"), ("mixed", "README.md"), ("new", "sender.ino")])
+    store.evict() # 4000 bytes com limite de 2500: saem os dois objetos mais antigos
+    assert store.evicted == 2
+    assert not os.path.exists(os.path.dirname(store._manifest_path("old"))) # Namespace vazio removido
+    assert store.load("old", "sender.ino") is None
+    assert list(manifest(store, "mixed")) == ["README.md"]
+    assert store.load("mixed", "README.md") == contents[("mixed", "README.md")]
+    assert store.load("new", "sender.ino") == contents[("new", "sender.ino")]
+
+
+def test_pruning_keeps_the_namespace_age(store):
+    fill(store, [("mixed", "sender.ino"), ("other", "a.ino"), ("mixed", "README.md"), ("other", "b.ino")])
+    manifest_path = store._manifest_path("mixed")
+    old = time.time() - 600
+    os.utime(manifest_path, (old, old))
+    store.evict()
+    assert list(manifest(store, "mixed")) == ["README.md"]
+    assert os.path.getmtime(manifest_path) == pytest.approx(old)
+
+
+def test_shared_objects_are_pruned_from_every_namespace(store):
+    store.save("a", "sender.ino", "same code")
+    store.save("b", "sender.ino", "same code")
+    assert store.flush(timeout_s=5)
+    store.settings["max_age_s"] = -1 # Tudo expirado
+    store.evict()
+    assert store.load("a", "sender.ino") is None and store.load("b", "sender.ino") is None
+    assert os.listdir(os.path.join(store.root, 'namespaces')) == []
@@ -0,0 +1,66 @@
+# tests/test_chat_sessions.py
+import pytest
+from chat_sessions import CHARS_PER_TOKEN, ChatSession, estimate_tokens, _message_text
+from config import AI_SETTINGS
+
+BUDGET_TOKENS = 100
+TURN_CHARS = 30 * CHARS_PER_TOKEN # Cada mensagem ~30 tokens: cabem no máximo 3 depois da troca fixa
+
+
+class StubContext:
+    def first_message(self, question):
+        return f"CONTEXT | {question}"
+
+
+@pytest.fixture(autouse=True)
+def small_budget(monkeypatch):
+    monkeypatch.setitem(AI_SETTINGS, "chat_history_token_budget", BUDGET_TOKENS)
+
+
+def turn(i):
+    return f"question {i}".ljust(TURN_CHARS, "?"), f"answer {i}".ljust(TURN_CHARS, ".")
+
+
+def history(turns):
+    return [{'role': role, 'parts': [{'text': text}]} for i in range(turns) for role, text in zip(('user', 'model'), turn(i))]
+
+
+def texts(messages):
+    return [_message_text(message) for message in messages]
+
+
+def test_session_over_budget_is_compacted():
+    session = ChatSession(history(10), StubContext())
+    assert len(session.messages) < 20
+    assert estimate_tokens(session.messages[2:]) <= BUDGET_TOKENS
+    assert texts(session.messages[:2]) == list(turn(0)) # Primeira troca fixa
+    assert texts(session.messages[-2:]) == list(turn(9)) # As mais recentes ficam
+    # 2 trocas (120 tokens) já não cabem: só fica a última, as perguntas 1-8 vão para o resumo
+    assert texts(session.messages) == [*turn(0), *turn(9)]
+    assert session.omitted_questions == [turn(i)[0] for i in range(1, 9)]
+
+
+def test_recording_turns_keeps_the_history_within_budget():
+    session = ChatSession(history(1), StubContext())
+    for i in range(1, 12):
+        session.record_turn(*turn(i))
+        assert estimate_tokens(session.messages[2:]) <= BUDGET_TOKENS
+        assert texts(session.messages[-2:]) == list(turn(i))
+    assert session.omitted_questions == [turn(i)[0] for i in range(1, 11)]
+
+
+def test_history_keeps_the_context_and_summarizes_omitted_turns():
+    session = ChatSession(history(10), StubContext())
+    sent = texts(session.history_for("new question"))
+    assert sent[0] == f"CONTEXT | {turn(0)[0]}" # Contexto junto à primeira pergunta, nunca no histórico guardado
+    assert sent[1] == turn(0)[1]
+    assert sent[2].startswith("Summary of the earlier conversation")
+    assert all(f"- {turn(i)[0]}" in sent[2] for i in range(1, 9))
+    assert sent[-3:] == [*turn(9), "new question"]
+    assert not any("CONTEXT" in text for text in texts(session.messages))
+
+
+def test_session_within_budget_is_unchanged():
+    session = ChatSession(history(2), StubContext())
+    assert texts(session.messages) == [*turn(0), *turn(1)]
+    assert session.omitted_questions == []
@@ -0,0 +1,63 @@
+# tests/test_floorplan_encoding.py
+import base64
+import numpy as np
+import pytest
+from lora_logic import (CELL_TYPES, compact_floorplan, decode_floorplan_grid, encode_floorplan_grid, encode_grid,
+                        parse_floorplan_data)
+
+
+def runs(encoded):
+    """(type, count) pairs of an encoded grid."""
+    pairs = np.frombuffer(base64.b64decode(encoded["cells"]), dtype=np.uint8).reshape(-1, 2)
+    return [(encoded["types"][t], int(n)) for t, n in pairs]
+
+
+def round_trip(grid):
+    rows, cols = len(grid), len(grid[0]) if grid else 0
+    return decode_floorplan_grid(encode_floorplan_grid(grid), rows, cols)
+
+
+def test_empty_grid():
+    encoded = encode_floorplan_grid([])
+    assert encoded["cells"] == ""
+    assert round_trip([]).shape == (0, 0)
+
+
+def test_single_run():
+    grid = [["brick"] * 7 for _ in range(3)]
+    assert runs(encode_floorplan_grid(grid)) == [("brick", 21)]
+    np.testing.assert_array_equal(round_trip(grid), encode_grid(grid))
+
+
+@pytest.mark.parametrize("length", [255, 256, 510, 511, 1000])
+def test_runs_longer_than_255_are_split(length):
+    grid = [["empty"] * length + ["sensor"]]
+    expected = [("empty", 255)] * (length // 255) + ([("empty", length % 255)] if length % 255 else []) + [("sensor", 1)]
+    assert runs(encode_floorplan_grid(grid)) == expected
+    np.testing.assert_array_equal(round_trip(grid), encode_grid(grid))
+
+
+def test_random_grids_decode_to_encode_grid():
+    rng = np.random.default_rng(0)
+    for rows, cols in [(1, 1), (1, 600), (37, 53), (200, 3)]:
+        # Poucas mudanças de tipo para haver corridas longas e curtas
+        codes = np.cumsum(rng.random(rows * cols) < 0.01) % len(CELL_TYPES)
+        grid = [[CELL_TYPES[code] for code in row] for row in codes.reshape(rows, cols)]
+        decoded = round_trip(grid)
+        assert decoded.dtype == np.uint8
+        np.testing.assert_array_equal(decoded, encode_grid(grid))
+
+
+def test_compact_floorplan_parses_back():
+    floorplan = {"grid": [["empty", "concrete", "concrete"], ["gateway", "empty", "sensor"]],
+                 "gateway": {"row": 1, "col": 0}, "sensors": [{"row": 1, "col": 2}]}
+    parsed, errors = parse_floorplan_data(compact_floorplan(floorplan))
+    assert errors == []
+    np.testing.assert_array_equal(encode_grid(parsed["grid"]), encode_grid(floorplan["grid"]))
+    assert parsed["sensors"] == floorplan["sensors"]
+
+
+def test_cells_that_do_not_match_the_size_are_rejected():
+    encoded = encode_floorplan_grid([["empty"] * 4])
+    with pytest.raises(ValueError):
+        decode_floorplan_grid(encoded, 1, 5)
@@ -0,0 +1,48 @@
+# tests/test_floorplan_sessions.py
+import numpy as np
+from config import REGION_FREQUENCIES
+from floorplan_sessions import apply_session_edits, create_session
+from lora_logic import _calculate_lora_params
+from tests.test_gateway_planning import concrete_plan
+
+WALL_TYPES = ('empty', 'drywall', 'brick', 'concrete')
+
+
+def plan_with_gateway(seed, size=60, gateways=((30, 30),)):
+    data = concrete_plan(seed, size, size, 12, 0.03)
+    for r, c in gateways:
+        data["floorplan_data"]["grid"][r][c] = "gateway"
+    data["floorplan_data"]["sensors"] = [s for s in data["floorplan_data"]["sensors"] if (s["row"], s["col"]) not in gateways]
+    data["floorplan_data"]["gateways"] = [{"row": r, "col": c} for r, c in gateways]
+    return data
+
+
+def expected_summary(data):
+    params, errors, _ = _calculate_lora_params({'floors': 1}, data["floorplan_data"], "EU868", REGION_FREQUENCIES["EU868"])
+    assert errors == []
+    return params["spreading_factor"], params["worst_link_margin_db"], params["_sensor_margins_raw"]
+
+
+def test_summary_matches_the_full_calculation_after_wall_edits():
+    data = plan_with_gateway(0, gateways=((30, 30), (5, 50)))
+    session_id, summary = create_session(data)
+    assert (summary["spreading_factor"], summary["worst_link_margin_db"], summary["sensor_margins_db"]) == expected_summary(data)
+
+    rng = np.random.default_rng(1)
+    grid = data["floorplan_data"]["grid"]
+    for revision in range(5):
+        edits = []
+        for r, c in rng.integers(0, 60, (40, 2)):
+            if grid[r][c] in WALL_TYPES:
+                cell_type = str(rng.choice(WALL_TYPES))
+                grid[r][c] = cell_type
+                edits.append({"row": int(r), "col": int(c), "type": cell_type})
+        summary = apply_session_edits(session_id, edits, revision)
+        assert (summary["spreading_factor"], summary["worst_link_margin_db"], summary["sensor_margins_db"]) == expected_summary(data)
+        assert len(summary["sensor_gateways"]) == len(data["floorplan_data"]["sensors"])
+
+
+def test_single_gateway_sensors_all_use_gateway_one():
+    data = plan_with_gateway(2)
+    _, summary = create_session(data)
+    assert summary["sensor_gateways"] == [1] * len(data["floorplan_data"]["sensors"])
@@ -0,0 +1,79 @@
+# tests/test_gateway_planning.py
+import numpy as np
+import pytest
+from config import REGION_FREQUENCIES
+from lora_logic import (CELL_TYPES, MIN_SAFE_MARGIN, SPREADING_FACTORS, encode_grid, optimize_gateway_placement, plan_gateways,
+                        _calculate_lora_params, _free_cells_mask, _gateway_path_losses, _get_link_settings, _positions_to_array)
+
+
+def concrete_plan(seed, rows, cols, sensors, density):
+    """Request payload with random concrete cells and sensors on free cells."""
+    rng = np.random.default_rng(seed)
+    codes = np.where(rng.random((rows, cols)) < density, CELL_TYPES.index('concrete'), CELL_TYPES.index('empty'))
+    free = np.argwhere(codes == 0)
+    sensor_cells = free[rng.choice(len(free), sensors, replace=False)]
+    grid = [[CELL_TYPES[code] for code in row] for row in codes]
+    for r, c in sensor_cells:
+        grid[r][c] = 'sensor'
+    return {"region": "EU868", "floors": 1,
+            "floorplan_data": {"grid": grid, "sensors": [{'row': int(r), 'col': int(c)} for r, c in sensor_cells]}}
+
+
+def brute_force_path_losses(data):
+    """Gateway-side path losses of every free cell to every sensor: {(row, col): array}."""
+    settings, _ = _get_link_settings(data)
+    grid_codes = encode_grid(data["floorplan_data"]["grid"])
+    sensors = _positions_to_array(data["floorplan_data"]["sensors"])
+    return {(int(r), int(c)): _gateway_path_losses(settings, grid_codes, {'row': int(r), 'col': int(c)}, sensors)
+            for r, c in np.argwhere(_free_cells_mask(grid_codes, sensors))}
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_margin_objective_matches_brute_force(seed):
+    data = concrete_plan(seed, 14, 18, 8, 0.12)
+    result, errors = optimize_gateway_placement(data, top_n=3, objective='margin', parallel=False)
+    assert not errors
+    worst = {cell: losses.max() for cell, losses in brute_force_path_losses(data).items()}
+    best = min(worst.values())
+    top = result["positions"][0]
+    assert worst[(top["row"], top["col"])] == pytest.approx(best)
+    assert [p["rank"] for p in result["positions"]] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_sf_objective_matches_brute_force(seed):
+    data = concrete_plan(seed, 14, 18, 8, 0.12)
+    result, errors = optimize_gateway_placement(data, top_n=1, objective='sf', parallel=False)
+    assert not errors
+    settings, _ = _get_link_settings(data)
+    budget = settings["tx_power_dbm"] + settings["antenna_gain_dbi"] - settings["sensitivity_dbm"]
+    required = [next((sf for sf, b in zip(SPREADING_FACTORS, budget) if b - losses.max() >= MIN_SAFE_MARGIN), None)
+                for losses in brute_force_path_losses(data).values()]
+    best_sf = min((sf for sf in required if sf is not None), default=None)
+    assert result["positions"][0]["required_sf"] == best_sf
+
+
+def test_reported_margin_matches_generate_config():
+    data = concrete_plan(11, 14, 18, 8, 0.12)
+    result, _ = optimize_gateway_placement(data, top_n=1, parallel=False)
+    top = result["positions"][0]
+    floorplan = {**data["floorplan_data"], "gateway": {'row': top["row"], 'col': top["col"]}}
+    params, _, _ = _calculate_lora_params({'floors': 1}, floorplan, "EU868", REGION_FREQUENCIES["EU868"])
+    if top["required_sf"] is not None:
+        assert params["spreading_factor"] == top["required_sf"]
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("max_sf", [9, 12])
+def test_full_coverage_plan_has_no_sensor_below_margin(seed, max_sf):
+    data = concrete_plan(seed, 40, 50, 40, 0.08)
+    plan, errors = plan_gateways(data, max_sf=max_sf, parallel=False)
+    assert not errors
+    if plan["uncoverable_sensors"] or plan["uncovered_sensors"]:
+        pytest.skip("plan doesn't claim full coverage")
+    assert plan["below_margin_sensors"] == []
+    assert all(gateway["required_sf"] is not None and gateway["required_sf"] <= max_sf for gateway in plan["gateways"])
+    assert min(assignment["margin_db"] for assignment in plan["assignments"]) >= MIN_SAFE_MARGIN
+    floorplan = {**data["floorplan_data"], "gateways": [{'row': g["row"], 'col': g["col"]} for g in plan["gateways"]]}
+    params, _, _ = _calculate_lora_params({'floors': 1}, floorplan, "EU868", REGION_FREQUENCIES["EU868"])
+    assert params["worst_link_margin_db"] >= MIN_SAFE_MARGIN
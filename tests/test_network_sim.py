@@ -0,0 +1,47 @@
+# tests/test_network_sim.py
+import pytest
+from lora_logic import time_on_air_ms
+from network_sim import simulate_network, simulate_site
+
+BW_KHZ, CR, PREAMBLE, PAYLOAD = 125, 5, 8, 20
+SENDS_PER_NODE = 50
+
+
+def airtime_ms(sf):
+    return float(time_on_air_ms(sf, BW_KHZ, CR, PREAMBLE, PAYLOAD))
+
+
+def sim_params(spreading_factors, interval_ms):
+    return {"per_sensor": [{"spreading_factor": sf} for sf in spreading_factors], "_send_interval_ms_raw": interval_ms,
+            "signal_bandwidth_khz": BW_KHZ, "_coding_rate_raw": CR, "preamble_length": PREAMBLE, "payload_bytes": PAYLOAD}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_two_nodes_that_always_overlap_lose_every_packet(seed):
+    # Intervalo = tempo no ar, sem jitter, um canal: o pacote do outro nó começa sempre durante o nosso
+    interval_ms = airtime_ms(7)
+    result = simulate_network(sim_params([7, 7], interval_ms), 2, channels=1, duration_s=SENDS_PER_NODE * interval_ms / 1000,
+                              jitter=0.0, seed=seed)
+    assert result["packets_sent"] == 2 * SENDS_PER_NODE
+    assert result["collisions"] == 2 * SENDS_PER_NODE
+    assert result["pdr"] == 0.0
+    assert result["channel_utilization"] == pytest.approx(2.0, abs=1e-3) # Os dois nós ocupam o canal o tempo todo
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_overlapping_nodes_on_different_sfs_do_not_collide(seed):
+    interval_ms = airtime_ms(8)
+    result = simulate_network(sim_params([7, 8], interval_ms), 2, channels=1, duration_s=SENDS_PER_NODE * interval_ms / 1000,
+                              jitter=0.0, seed=seed)
+    assert result["packets_sent"] == 2 * SENDS_PER_NODE
+    assert result["collisions"] == 0
+    assert result["pdr"] == 1.0
+    assert result["per_sf"] == {"SF7": {"packets_sent": SENDS_PER_NODE, "pdr": 1.0}, "SF8": {"packets_sent": SENDS_PER_NODE, "pdr": 1.0}}
+
+
+def test_site_without_sensors_is_an_error():
+    data = {"region": "EU868", "floors": 1,
+            "floorplan_data": {"grid": [["gateway", "empty"]], "gateway": {"row": 0, "col": 0}, "sensors": []}}
+    results, errors = simulate_site(data)
+    assert results == []
+    assert errors == ["No sensors placed on the floor plan. Cannot calculate specific link margins."]
@@ -0,0 +1,32 @@
+# tests/test_recommendation_cache.py
+import json
+import pytest
+import lora_logic
+from caching import LRUCache
+from lora_logic import generate_recommendations_cached, recommendation_cache_key
+
+REQUEST = {"region": "EU868", "floors": 2, "wall_type": "concrete",
+           "floorplan_data": {"grid": [["gateway", "empty", "sensor"]], "gateway": {"row": 0, "col": 0}, "sensors": [{"row": 0, "col": 2}]}}
+
+
+@pytest.fixture
+def no_parsing(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("the floor plan was parsed")
+    monkeypatch.setattr(lora_logic, "parse_floorplan_data", fail)
+    monkeypatch.setattr(lora_logic, "generate_recommendations", fail)
+
+
+def test_key_hashes_the_raw_inputs(no_parsing):
+    key = recommendation_cache_key(REQUEST)
+    reordered = json.loads(json.dumps(dict(reversed(list(REQUEST.items())))))
+    assert recommendation_cache_key({**reordered, "api_key": "secret", "sections": ["layout"]}) == key
+    assert recommendation_cache_key({**REQUEST, "floors": 3}) != key
+
+
+def test_hit_skips_parsing_and_generation(monkeypatch, no_parsing):
+    cache = LRUCache(maxsize=4)
+    monkeypatch.setattr(lora_logic, "recommendation_cache", cache)
+    key = recommendation_cache_key(REQUEST)
+    cache.put(key, ({"layout": "cached"}, []))
+    assert generate_recommendations_cached(REQUEST) == ({"layout": "cached"}, [], key, True)
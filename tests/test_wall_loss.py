@@ -0,0 +1,99 @@
+# tests/test_wall_loss.py
+import numpy as np
+import pytest
+import lora_logic
+from lora_logic import CELL_TYPES, estimate_wall_loss, estimate_wall_losses, sweep_wall_losses, _trace_paths
+
+WALL_CODES = np.array([CELL_TYPES.index(t) for t in ('empty', 'drywall', 'brick', 'concrete')], dtype=np.uint8)
+
+
+def scattered_grid(rng, rows, cols, density):
+    """Random grid with about density of its cells as drywall/brick/concrete."""
+    return rng.choice(WALL_CODES, size=(rows, cols), p=[1 - density] + [density / 3] * 3)
+
+
+def rooms_grid(rows, cols, room=6):
+    """Concrete rooms of room x room cells with a one-cell door in the middle of every wall."""
+    grid = np.zeros((rows, cols), dtype=np.uint8)
+    grid[::room, :] = CELL_TYPES.index('concrete')
+    grid[:, ::room] = CELL_TYPES.index('concrete')
+    grid[::room, room // 2::room] = CELL_TYPES.index('empty')
+    grid[room // 2::room, ::room] = CELL_TYPES.index('empty')
+    return grid
+
+
+def position(cell):
+    return {'row': int(cell[0]), 'col': int(cell[1])}
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("density", [0.1, 0.3])
+def test_wall_loss_is_symmetric_on_random_grids(seed, density):
+    rng = np.random.default_rng(seed)
+    grid = scattered_grid(rng, 30, 45, density)
+    points = np.column_stack([rng.integers(0, 30, 40), rng.integers(0, 45, 40)])
+    for a in points[:10]:
+        forward = estimate_wall_losses(grid, position(a), points)
+        backward = np.array([estimate_wall_losses(grid, position(b), a[np.newaxis])[0] for b in points])
+        np.testing.assert_array_equal(forward, backward)
+
+
+def test_wall_loss_is_symmetric_through_doors():
+    grid = rooms_grid(37, 49)
+    rng = np.random.default_rng(7)
+    free = np.argwhere(grid == 0)
+    for a, b in free[rng.choice(len(free), size=(300, 2))]:
+        assert estimate_wall_loss(grid, position(a), position(b)) == estimate_wall_loss(grid, position(b), position(a))
+
+
+@pytest.mark.parametrize("origin", [(0, 0), (12, 20), (24, 39), (5, 33)])
+def test_sweep_matches_traced_losses(origin):
+    grid = scattered_grid(np.random.default_rng(3), 25, 40, 0.2)
+    cells = np.argwhere(np.ones(grid.shape, dtype=bool))
+    traced = estimate_wall_losses(grid, position(origin), cells).reshape(grid.shape)
+    np.testing.assert_array_equal(sweep_wall_losses(grid, position(origin)), traced)
+
+
+@pytest.mark.parametrize("origin", [(0, 0), (59, 79), (30, 0)])
+def test_sweep_is_one_pass_and_symmetric(monkeypatch, origin):
+    grid = scattered_grid(np.random.default_rng(4), 60, 80, 0.2)
+
+    def no_ray_tracing(*args):
+        raise AssertionError("sweep_wall_losses traced a ray")
+    monkeypatch.setattr(lora_logic, "_trace_paths", no_ray_tracing)
+    monkeypatch.setattr(lora_logic, "estimate_wall_losses", no_ray_tracing)
+    swept = sweep_wall_losses(grid, position(origin))
+    monkeypatch.undo()
+
+    # Células traçadas de volta até à origem (a partir da outra ponta)
+    cells = np.argwhere(np.ones(grid.shape, dtype=bool))[np.random.default_rng(5).choice(grid.size, 300, replace=False)]
+    backward = [estimate_wall_losses(grid, position(cell), np.array([origin]))[0] for cell in cells]
+    np.testing.assert_array_equal(swept[cells[:, 0], cells[:, 1]], backward)
+
+
+@pytest.mark.parametrize("origin", [(0, 0), (45, 70), (90, 10)])
+def test_paths_stay_close_to_the_line(origin):
+    cells = np.argwhere(np.ones((91, 121), dtype=bool))
+    offsets = cells - origin
+    lengths = np.max(np.abs(offsets), axis=1)
+    rr, cc = _trace_paths(position(origin), cells, int(lengths.max()) + 1)
+    # Desvio no eixo menor em relação à reta, passo a passo
+    t = np.maximum(lengths[:, np.newaxis] - np.arange(rr.shape[1]), 0) / np.maximum(lengths, 1)[:, np.newaxis]
+    col_major = (np.abs(offsets[:, 1]) >= np.abs(offsets[:, 0]))[:, np.newaxis]
+    deviation = np.where(col_major, rr - origin[0] - offsets[:, 0:1] * t, cc - origin[1] - offsets[:, 1:2] * t)
+    assert np.abs(deviation).max() <= 3
+    assert (rr[:, -1] == origin[0]).all() and (cc[:, -1] == origin[1]).all()
+
+
+def test_one_crossing_per_wall_run():
+    grid = np.zeros((1, 10), dtype=np.uint8)
+    grid[0, 3:6] = CELL_TYPES.index('concrete')
+    assert estimate_wall_loss(grid, position((0, 0)), position((0, 9))) == 29
+    assert estimate_wall_loss(grid, position((0, 9)), position((0, 0))) == 29
+
+
+def test_wall_run_under_an_end_counts_from_both_sides():
+    grid = np.zeros((1, 10), dtype=np.uint8)
+    grid[0, 0:2] = CELL_TYPES.index('brick')
+    assert estimate_wall_loss(grid, position((0, 0)), position((0, 9))) == estimate_wall_loss(grid, position((0, 9)), position((0, 0)))
+    np.testing.assert_array_equal(sweep_wall_losses(grid, position((0, 0)))[0], np.full(10, lora_logic.WALL_LOSS_DB['brick']))